@@ -0,0 +1,233 @@
+from typing import Callable, Dict, Iterator, List, Tuple, TypedDict, Union
+import json
+
+from .client import HttpClient
+from .jobs import CancelToken
+
+OPENAI_RESPONSE_URL = "https://api.openai.com/v1/responses"
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+
+class Usage(TypedDict):
+    input_tokens: int
+    # The part of `input_tokens` served from OpenAI's prompt cache, billed at a discount.
+    cached_tokens: int
+    output_tokens: int
+
+
+# Shared by every request that isn't given a client, so connections get reused.
+default_client: HttpClient = HttpClient()
+
+
+def build_openai_request(
+    prompt: str, model: str, token: str, stream: bool = False
+) -> Tuple[Dict[str, str], bytes]:
+    headers: Dict[str, str] = request_headers(token, stream)
+    body: Dict = dict(model=model, input=prompt)
+    if stream:
+        body["stream"] = True
+    return headers, json.dumps(body).encode("utf-8")
+
+
+def build_chat_request(
+    prompt: str, model: str, token: str, stream: bool = False
+) -> Tuple[Dict[str, str], bytes]:
+    headers: Dict[str, str] = request_headers(token, stream)
+    body: Dict = dict(model=model, messages=[dict(role="user", content=prompt)])
+    if stream:
+        body["stream"] = True
+        # Otherwise a streamed chat completion doesn't report its usage.
+        body["stream_options"] = dict(include_usage=True)
+    return headers, json.dumps(body).encode("utf-8")
+
+
+def request_headers(token: str, stream: bool) -> Dict[str, str]:
+    headers: Dict[str, str] = {"Content-Type": "application/json"}
+    if token:
+        # Local servers usually don't need a key.
+        headers["Authorization"] = f"Bearer {token}"
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    return headers
+
+
+def get_output_text(body_json: Dict) -> str:
+    if "output" not in body_json:
+        raise Exception(f"Bad response from OpenAI model: {body_json}")
+    return body_json["output"][0]["content"][0]["text"]
+
+
+def get_chat_text(body_json: Dict) -> str:
+    if not body_json.get("choices"):
+        raise Exception(f"Bad response from model: {body_json}")
+    return body_json["choices"][0]["message"]["content"] or ""
+
+
+def get_chat_usage(body_json: Dict) -> Usage:
+    usage: Dict = body_json.get("usage") or {}
+    return Usage(
+        input_tokens=usage.get("prompt_tokens", 0),
+        cached_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+        output_tokens=usage.get("completion_tokens", 0),
+    )
+
+
+def get_usage(body_json: Dict) -> Usage:
+    usage: Dict = body_json.get("usage") or {}
+    return Usage(
+        input_tokens=usage.get("input_tokens", 0),
+        cached_tokens=(usage.get("input_tokens_details") or {}).get("cached_tokens", 0),
+        output_tokens=usage.get("output_tokens", 0),
+    )
+
+
+def get_openai_response(
+    prompt: str,
+    model: str,
+    token: str,
+    client: Union[HttpClient, None] = None,
+    url: str = OPENAI_RESPONSE_URL,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+):
+    headers, request_body = build_openai_request(prompt, model, token)
+
+    with (client or default_client).open(
+        "POST", url, headers, request_body, cancel
+    ) as response:
+        body_bytes = response.read()
+        body_str: str = body_bytes.decode("utf-8")
+        body_json = json.loads(body_str)
+        text: str = get_output_text(body_json)
+        if on_usage is not None:
+            on_usage(get_usage(body_json))
+        return text
+
+
+def iter_server_sent_events(lines: Iterator[bytes]) -> Iterator[Tuple[str, str]]:
+    """Yields (event, data) pairs from a `text/event-stream` body."""
+    event: str = ""
+    data: List[str] = []
+    for raw_line in lines:
+        line: str = raw_line.decode("utf-8").rstrip("\r\n")
+        if line == "":
+            # A blank line dispatches the event collected so far.
+            if data:
+                yield event, "\n".join(data)
+            event, data = "", []
+        elif line.startswith(":"):
+            # Comment, used by servers as a keep-alive.
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+    if data:
+        yield event, "\n".join(data)
+
+
+def stream_openai_response(
+    prompt: str,
+    model: str,
+    token: str,
+    on_delta: Callable[[str], None],
+    client: Union[HttpClient, None] = None,
+    url: str = OPENAI_RESPONSE_URL,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+) -> str:
+    """Requests a streamed response, calling `on_delta` with each chunk of text as it
+    arrives. Returns the full text once the response completes. `on_usage` is only
+    called if the stream got as far as the completed response, which carries the usage."""
+    client = client or default_client
+    headers, request_body = build_openai_request(prompt, model, token, stream=True)
+    chunks: List[str] = []
+    completed: Union[str, None] = None
+
+    with client.open("POST", url, headers, request_body, cancel) as response:
+        for event, data in iter_server_sent_events(client.iter_lines(response)):
+            if data == "[DONE]":
+                break
+            payload: Dict = json.loads(data)
+            event_type: str = payload.get("type", event)
+            if event_type == "response.output_text.delta":
+                delta: str = payload.get("delta", "")
+                chunks.append(delta)
+                on_delta(delta)
+            elif event_type == "response.completed":
+                completed = get_output_text(payload["response"])
+                if on_usage is not None:
+                    on_usage(get_usage(payload["response"]))
+                break
+            elif event_type in ("response.failed", "response.incomplete", "error"):
+                raise Exception(f"Bad response from OpenAI model: {payload}")
+
+    if completed is None and not chunks:
+        raise Exception("OpenAI closed the stream without a response")
+    # Prefer the completed response's text, the deltas are only used for display.
+    return completed if completed is not None else "".join(chunks)
+
+
+def get_chat_response(
+    prompt: str,
+    model: str,
+    token: str,
+    client: Union[HttpClient, None] = None,
+    url: str = OPENAI_CHAT_URL,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+) -> str:
+    """Same as `get_openai_response`, for servers with the Chat Completions API, which
+    is what llama.cpp, vLLM and most other local servers offer."""
+    headers, request_body = build_chat_request(prompt, model, token)
+
+    with (client or default_client).open(
+        "POST", url, headers, request_body, cancel
+    ) as response:
+        body_json: Dict = json.loads(response.read().decode("utf-8"))
+        text: str = get_chat_text(body_json)
+        if on_usage is not None:
+            on_usage(get_chat_usage(body_json))
+        return text
+
+
+def stream_chat_response(
+    prompt: str,
+    model: str,
+    token: str,
+    on_delta: Callable[[str], None],
+    client: Union[HttpClient, None] = None,
+    url: str = OPENAI_CHAT_URL,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+) -> str:
+    """Same as `stream_openai_response`, for servers with the Chat Completions API."""
+    client = client or default_client
+    headers, request_body = build_chat_request(prompt, model, token, stream=True)
+    chunks: List[str] = []
+    finished: bool = False
+
+    with client.open("POST", url, headers, request_body, cancel) as response:
+        for _, data in iter_server_sent_events(client.iter_lines(response)):
+            if data == "[DONE]":
+                break
+            payload: Dict = json.loads(data)
+            if "error" in payload:
+                raise Exception(f"Bad response from model: {payload}")
+            for choice in payload.get("choices") or []:
+                delta: str = (choice.get("delta") or {}).get("content") or ""
+                if delta:
+                    chunks.append(delta)
+                    on_delta(delta)
+                if choice.get("finish_reason"):
+                    finished = True
+            # With `include_usage`, the usage comes in a last chunk without choices.
+            if payload.get("usage") and on_usage is not None:
+                on_usage(get_chat_usage(payload))
+
+    if not finished and not chunks:
+        raise Exception("The model closed the stream without a response")
+    return "".join(chunks)
@@ -0,0 +1,84 @@
+from typing import Dict, List, Tuple, Union
+from threading import Lock
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(
+        json.dumps([model, prompt], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class ResponseCache:
+    """Stores generated responses on disk, one file per (model, filled prompt).
+
+    A file's modification time is bumped whenever it is read, so evicting the oldest
+    files first gives least recently used eviction. Entries older than `max_age` seconds
+    are dropped regardless of size."""
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock: Lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, model: str, prompt: str) -> Union[str, None]:
+        path: str = self.path(cache_key(model, prompt))
+        with self.lock:
+            try:
+                if time.time() - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+                    return None
+                with open(path, encoding="utf-8") as f:
+                    entry: Dict = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                return None
+        return entry.get("response")
+
+    def put(self, model: str, prompt: str, response: str) -> None:
+        path: str = self.path(cache_key(model, prompt))
+        entry: Dict = dict(model=model, created=time.time(), response=response)
+        with self.lock:
+            # Write to a temporary file first so a reader never sees a partial entry.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.evict()
+
+    def evict(self) -> None:
+        now: float = time.time()
+        entries: List[Tuple[float, int, str]] = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path: str = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.max_age:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total: int = sum(size for _, size, _ in entries)
+        # Oldest access first.
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
@@ -0,0 +1,86 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, List, Union, cast
+
+from .jobs import Cancelled
+
+# Separates the generated parts of a chunked story.
+PART_SEPARATOR = "\n\n"
+
+
+def split_into_chunks(vocab: List[str], chunk_size: int) -> List[List[str]]:
+    if chunk_size <= 0 or len(vocab) <= chunk_size:
+        return [vocab]
+    # Spread the words evenly so the last chunk isn't left with only a few of them.
+    chunk_count: int = -(-len(vocab) // chunk_size)
+    base, extra = divmod(len(vocab), chunk_count)
+    chunks: List[List[str]] = []
+    start: int = 0
+    for i in range(chunk_count):
+        end: int = start + base + (1 if i < extra else 0)
+        chunks.append(vocab[start:end])
+        start = end
+    return chunks
+
+
+class ChunkedGenerationError(Exception):
+    def __init__(self, failed: Dict[int, Exception], total: int):
+        self.failed = failed
+        first: Exception = next(iter(failed.values()))
+        super().__init__(
+            f"{len(failed)} of {total} parts of the story failed to generate: {first}")
+
+
+def generate_chunked(
+    chunks: List[List[str]],
+    generate: Callable[[List[str]], str],
+    max_workers: int,
+    retries: int = 0,
+    on_ready: Union[Callable[[str], None], None] = None,
+) -> List[str]:
+    """Runs `generate` for every chunk on a bounded thread pool, returning the parts in
+    chunk order.
+
+    Chunks that fail are retried up to `retries` more times, without rerunning the ones
+    that already succeeded. `on_ready` is called with each part, in order, as soon as
+    every part before it has finished."""
+    parts: List[Union[str, None]] = [None] * len(chunks)
+    failed: Dict[int, Exception] = {}
+    lock: Lock = Lock()
+    next_ready: List[int] = [0]
+
+    def run(idx: int) -> None:
+        try:
+            part: str = generate(chunks[idx])
+        except Exception as exc:
+            with lock:
+                failed[idx] = exc
+            return
+        with lock:
+            parts[idx] = part
+            failed.pop(idx, None)
+            if on_ready is None:
+                return
+            while next_ready[0] < len(parts) and parts[next_ready[0]] is not None:
+                on_ready(cast(str, parts[next_ready[0]]))
+                next_ready[0] += 1
+
+    pending: List[int] = list(range(len(chunks)))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for _ in range(retries + 1):
+            futures: List[Future] = [pool.submit(run, idx) for idx in pending]
+            for future in futures:
+                future.result()
+            pending = sorted(failed)
+            if not pending:
+                break
+            cancelled: Union[Exception, None] = next(
+                (exc for exc in failed.values() if isinstance(exc, Cancelled)), None)
+            if cancelled is not None:
+                # Retrying won't help, the whole story was cancelled.
+                raise cancelled
+
+    if failed:
+        raise ChunkedGenerationError(dict(failed), len(chunks))
+    return [cast(str, part) for part in parts]
+
@@ -0,0 +1,222 @@
+"""Generates stories without Anki running, for example from cron.
+
+    python path/to/anki_storytime/cli.py --collection ~/.local/share/Anki2/User\\ 1/collection.anki2 --deck Japanese
+
+Uses the add-on's config, including any changes made in Anki, and saves the stories to
+the same history the story view shows. Anki must be closed while this runs, as only one
+program can have the collection open at a time; running it on a synced copy of the
+collection also works.
+
+Presets are picked by name, anything that isn't a preset name is used as is. Without
+them, the first preset of each kind is used."""
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+import argparse
+import os
+import sys
+import types
+
+ADDON_DIR: str = os.path.dirname(os.path.abspath(__file__))
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script: set up the package without executing its `__init__`, which needs
+    # a running Anki, so the relative imports below work.
+    __package__ = "anki_storytime"
+    if __package__ not in sys.modules:
+        package = types.ModuleType(__package__)
+        package.__path__ = [ADDON_DIR]
+        sys.modules[__package__] = package
+
+from anki.collection import Collection
+from anki.decks import DeckId
+
+from .cache import ResponseCache
+from .client import HttpClient
+from .config import USER_FILES_DIR, Config, Preset, read_addon_config
+from .generate import (
+    SCOPE_ALL, SCOPE_DECK, SCOPE_SUBDECKS, batch_deck_names, collect_deck_vocab,
+    generate_story)
+from .metrics import MetricsStore, RequestMetrics, request_labels
+from .normalize import VocabCleaner
+from .providers import primary_model
+from .store import StoryMetadata, StoryStore
+from .timing import Trace, Tracer
+from .vocab import VocabExtraction
+
+
+def parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="anki_storytime", description="Generate stories from an Anki collection.")
+    parser.add_argument("--collection", required=True, help="path to collection.anki2")
+    parser.add_argument(
+        "--deck", action="append", default=[],
+        help="deck to generate a story for, can be given more than once")
+    parser.add_argument(
+        "--subdecks", action="store_true",
+        help="generate a separate story for each deck under --deck")
+    parser.add_argument(
+        "--all-decks", action="store_true",
+        help="generate a separate story for every deck in the collection")
+    parser.add_argument("--query", help="vocab query preset")
+    parser.add_argument("--theme", help="theme preset")
+    parser.add_argument("--prompt", help="prompt preset")
+    parser.add_argument("--lang", help="language preset")
+    parser.add_argument("--no-cache", action="store_true", help="skip cached responses")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="list the vocab instead of generating")
+    args = parser.parse_args(argv)
+    if not args.deck and not args.all_decks:
+        parser.error("either --deck or --all-decks is required")
+    return args
+
+
+def preset_value(presets: List[Preset], name: Union[str, None]) -> str:
+    if name is None:
+        return presets[0]["value"] if presets else ""
+    return next((preset["value"] for preset in presets if preset["name"] == name), name)
+
+
+def deck_names(col: Collection, args: argparse.Namespace) -> Tuple[List[str], str]:
+    if args.all_decks:
+        return batch_deck_names(col, DeckId(0), SCOPE_ALL), SCOPE_ALL
+    names: List[str] = []
+    for deck_name in args.deck:
+        deck_id: Union[DeckId, None] = col.decks.id_for_name(deck_name)
+        if deck_id is None:
+            raise SystemExit(f"No deck named {deck_name!r}")
+        if args.subdecks:
+            names.extend(batch_deck_names(col, deck_id, SCOPE_SUBDECKS))
+        else:
+            names.append(deck_name)
+    return list(dict.fromkeys(names)), SCOPE_SUBDECKS if args.subdecks else SCOPE_DECK
+
+
+def collect_vocab(
+    col_path: str,
+    args: argparse.Namespace,
+    config: Config,
+    query: str,
+    trace: Trace,
+    store: StoryStore,
+) -> Dict[str, VocabExtraction]:
+    cleaner: Union[VocabCleaner, None] = VocabCleaner() if config["normalize_vocab"] else None
+    col: Collection = Collection(col_path)
+    try:
+        names, scope = deck_names(col, args)
+        return {
+            # A batch gives every deck its own story, so subdecks aren't included twice.
+            deck_name: collect_deck_vocab(
+                col, deck_name, query, config, trace, cleaner=cleaner,
+                include_subdecks=scope == SCOPE_DECK, store=store)
+            for deck_name in names
+        }
+    finally:
+        # Don't keep the collection locked while waiting on the API.
+        col.close()
+
+
+def main(argv: Sequence[str]) -> int:
+    args = parse_args(argv)
+    config: Config = read_addon_config(ADDON_DIR)
+    tracer: Tracer = Tracer(
+        os.path.join(USER_FILES_DIR, "timings.log"),
+        os.path.join(USER_FILES_DIR, "profiles"),
+    )
+    trace: Trace = tracer.start("cli")
+    os.makedirs(USER_FILES_DIR, exist_ok=True)
+    store: StoryStore = StoryStore(os.path.join(USER_FILES_DIR, "stories.db"))
+    try:
+        return generate_stories(args, config, trace, store)
+    finally:
+        store.close()
+        tracer.finish(trace)
+
+
+def generate_stories(
+    args: argparse.Namespace,
+    config: Config,
+    trace: Trace,
+    store: StoryStore,
+) -> int:
+    query: str = preset_value(config["vocab_query_presets"], args.query)
+    theme: str = preset_value(config["theme_presets"], args.theme)
+    prompt: str = preset_value(config["prompt_presets"], args.prompt)
+    lang: str = preset_value(config["lang_presets"], args.lang)
+    extractions: Dict[str, VocabExtraction] = collect_vocab(
+        os.path.abspath(args.collection), args, config, query, trace, store)
+
+    unknown_note_types: List[str] = sorted({
+        name
+        for extraction in extractions.values()
+        for name in extraction["unknown_note_types"]
+    })
+    if unknown_note_types:
+        print(
+            "Add these note types to note_type_field in the config: "
+            + ", ".join(unknown_note_types), file=sys.stderr)
+        return 1
+    decks: Dict[str, List[str]] = {}
+    for deck_name, extraction in extractions.items():
+        if extraction["vocab"]:
+            decks[deck_name] = extraction["vocab"]
+        else:
+            print(f"{deck_name}: no notes found matching your query")
+    if args.dry_run:
+        for deck_name, vocab in decks.items():
+            print(f"{deck_name}: {', '.join(vocab)}")
+        return 0
+
+    client: HttpClient = HttpClient(
+        config["http_connect_timeout"], config["http_read_timeout"],
+        config["http_max_retries"])
+    cache: Union[ResponseCache, None] = None
+    if config["cache_responses"]:
+        cache = ResponseCache(
+            os.path.join(USER_FILES_DIR, "response_cache"),
+            config["cache_max_size_mb"] * 1024 * 1024,
+            config["cache_max_age_days"] * 24 * 60 * 60,
+        )
+    metadata: StoryMetadata = StoryMetadata(
+        model=primary_model(config), prompt=prompt, theme=theme, lang=lang,
+        vocab_query=query)
+
+    metrics_store: Union[MetricsStore, None] = None
+    if config["record_usage"]:
+        metrics_store = MetricsStore(os.path.join(USER_FILES_DIR, "metrics.db"))
+
+    def metrics_recorder(deck_name: str) -> Union[Callable[[RequestMetrics], None], None]:
+        if metrics_store is None:
+            return None
+        usage_store: MetricsStore = metrics_store
+        labels = request_labels(deck_name, metadata, config)
+        return lambda metrics: usage_store.record(metrics, labels, config["model_prices"])
+
+    failures: int = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, config["max_concurrent_jobs"])) as executor:
+            futures: Dict[str, Future] = {
+                deck_name: executor.submit(
+                    generate_story, vocab, theme, prompt, lang, config, client, cache,
+                    use_cache=not args.no_cache, trace=trace,
+                    on_metrics=metrics_recorder(deck_name))
+                for deck_name, vocab in decks.items()
+            }
+            for deck_name, future in futures.items():
+                try:
+                    story: str = future.result()
+                except Exception as exc:
+                    failures += 1
+                    print(f"{deck_name}: failed to generate story: {exc}", file=sys.stderr)
+                    continue
+                store.add_story(deck_name, story, metadata, vocab=decks[deck_name])
+                store.trim(deck_name, config["max_stories_per_collection"])
+                print(f"{deck_name}: saved a story from {len(decks[deck_name])} words")
+    finally:
+        if metrics_store is not None:
+            metrics_store.close()
+        client.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
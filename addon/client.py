@@ -0,0 +1,303 @@
+from typing import Dict, Iterator, List, Tuple, Union
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from urllib.parse import urlsplit
+import http.client
+import json
+import random
+import socket
+import time
+
+from .jobs import Cancelled, CancelToken
+
+# Statuses that are worth retrying, anything else in the 4xx range won't change by
+# sending the same request again.
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ApiError(Exception):
+    retryable: bool = False
+
+    def __init__(
+        self,
+        message: str,
+        status: Union[int, None] = None,
+        body: str = "",
+        retry_after: Union[float, None] = None,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+        # Seconds the server asked us to wait before trying again.
+        self.retry_after = retry_after
+
+
+class ApiConnectionError(ApiError):
+    retryable = True
+
+
+class ApiTimeoutError(ApiConnectionError):
+    pass
+
+
+class AuthenticationError(ApiError):
+    pass
+
+
+class BadRequestError(ApiError):
+    pass
+
+
+class RateLimitError(ApiError):
+    retryable = True
+
+
+class ServerError(ApiError):
+    retryable = True
+
+
+def parse_retry_after(value: Union[str, None]) -> Union[float, None]:
+    """`Retry-After` is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_for_status(status: int, body: str, headers: http.client.HTTPMessage) -> ApiError:
+    message: str = f"Request failed with status {status}: {error_message(body)}"
+    if status in (401, 403):
+        return AuthenticationError(message, status, body)
+    if status == 429:
+        return RateLimitError(
+            message, status, body, parse_retry_after(headers.get("Retry-After")))
+    if status in RETRYABLE_STATUSES:
+        return ServerError(
+            message, status, body, parse_retry_after(headers.get("Retry-After")))
+    return BadRequestError(message, status, body)
+
+
+def error_message(body: str) -> str:
+    try:
+        return json.loads(body)["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        return body[0:500]
+
+
+def abort(sock: Union[socket.socket, None]) -> None:
+    """Wakes up a thread blocked on the socket, from any other thread."""
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class HttpClient:
+    """Small HTTP client that keeps connections to each host open between requests.
+
+    Requests that fail with a connection error, a timeout, a 429 or a 5xx are retried
+    up to `max_retries` times with exponential backoff and full jitter, waiting at least
+    as long as the server's `Retry-After` asks for."""
+
+    def __init__(
+        self,
+        connect_timeout: float = 10,
+        read_timeout: float = 120,
+        max_retries: int = 3,
+        backoff_base: float = 1,
+        backoff_max: float = 30,
+        max_idle_connections: int = 8,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_idle_connections = max_idle_connections
+        self.lock: Lock = Lock()
+        self.idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+
+    def settings(self) -> Tuple[float, float, int]:
+        return (self.connect_timeout, self.read_timeout, self.max_retries)
+
+    def acquire(self, scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+        with self.lock:
+            idle = self.idle.get((scheme, host, port))
+            if idle:
+                return idle.pop()
+        conn: http.client.HTTPConnection
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        if conn.sock is not None:
+            # The connect timeout only applies to opening the connection, responses can
+            # take much longer to come back.
+            conn.sock.settimeout(self.read_timeout)
+            # Requests are written in one go, waiting to coalesce them only adds latency.
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def release(self, scheme: str, host: str, port: int, conn: http.client.HTTPConnection):
+        with self.lock:
+            idle = self.idle.setdefault((scheme, host, port), [])
+            if len(idle) < self.max_idle_connections:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle.clear()
+
+    def backoff(self, attempt: int, error: ApiError) -> float:
+        delay: float = random.uniform(
+            0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if error.retry_after is not None:
+            delay = max(delay, min(error.retry_after, self.backoff_max))
+        return delay
+
+    @contextmanager
+    def open(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        body: Union[bytes, None] = None,
+        cancel: Union[CancelToken, None] = None,
+    ) -> Iterator[http.client.HTTPResponse]:
+        """Sends the request, retrying as needed, and yields the successful response. The
+        connection goes back to the pool once the body has been fully read.
+
+        Cancelling `cancel` interrupts the request wherever it is, including while
+        waiting on the server, and raises `Cancelled`."""
+        parts = urlsplit(url)
+        scheme: str = parts.scheme
+        host: str = parts.hostname or ""
+        port: int = parts.port or (443 if scheme == "https" else 80)
+        path: str = parts.path + (f"?{parts.query}" if parts.query else "")
+
+        attempt: int = 0
+        while True:
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            try:
+                conn, sock, response = self.send(
+                    scheme, host, port, method, path, headers, body, cancel)
+                break
+            except ApiError as error:
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled() from error
+                if not error.retryable or attempt >= self.max_retries:
+                    raise
+                delay: float = self.backoff(attempt, error)
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+
+        reusable: bool = False
+        # The connection lets go of its socket once a response that closes it arrives,
+        # but the response keeps reading from it.
+        unregister = (
+            cancel.on_cancel(lambda: abort(sock)) if cancel is not None else lambda: None)
+        try:
+            yield response
+            reusable = response.isclosed() and not response.will_close
+        except (ApiError, OSError, http.client.HTTPException) as error:
+            if cancel is not None and cancel.cancelled:
+                raise Cancelled() from error
+            raise
+        finally:
+            unregister()
+            if reusable:
+                self.release(scheme, host, port, conn)
+            else:
+                conn.close()
+
+    def send(
+        self,
+        scheme: str,
+        host: str,
+        port: int,
+        method: str,
+        path: str,
+        headers: Dict[str, str],
+        body: Union[bytes, None],
+        cancel: Union[CancelToken, None] = None,
+    ) -> Tuple[http.client.HTTPConnection, Union[socket.socket, None], http.client.HTTPResponse]:
+        # A pooled connection may have been closed by the server while idle, in which case
+        # the request is sent once more on a fresh connection.
+        for fresh in (False, True):
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            try:
+                conn: http.client.HTTPConnection = (
+                    self.acquire(scheme, host, port) if not fresh
+                    else self.acquire_fresh(scheme, host, port)
+                )
+            except socket.timeout as exc:
+                raise ApiTimeoutError(f"Timed out connecting to {host}") from exc
+            except OSError as exc:
+                raise ApiConnectionError(f"Could not connect to {host}: {exc}") from exc
+            sock: Union[socket.socket, None] = conn.sock
+            unregister = (
+                cancel.on_cancel(lambda: abort(sock)) if cancel is not None
+                else lambda: None
+            )
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response: http.client.HTTPResponse = conn.getresponse()
+            except socket.timeout as exc:
+                conn.close()
+                raise ApiTimeoutError(f"Timed out waiting for a response from {host}") from exc
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as exc:
+                conn.close()
+                if not fresh:
+                    continue
+                raise ApiConnectionError(f"Connection to {host} was closed: {exc}") from exc
+            except (OSError, http.client.HTTPException) as exc:
+                conn.close()
+                raise ApiConnectionError(f"Request to {host} failed: {exc}") from exc
+            finally:
+                unregister()
+
+            if response.status >= 400:
+                error_body: str = response.read().decode("utf-8", errors="replace")
+                error: ApiError = error_for_status(response.status, error_body, response.headers)
+                if response.will_close:
+                    conn.close()
+                else:
+                    self.release(scheme, host, port, conn)
+                raise error
+            return conn, sock, response
+        raise ApiConnectionError(f"Could not send request to {host}")
+
+    def acquire_fresh(self, scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+        with self.lock:
+            # Anything else idle for this host is likely just as stale.
+            for conn in self.idle.pop((scheme, host, port), []):
+                conn.close()
+        return self.acquire(scheme, host, port)
+
+    def iter_lines(self, response: http.client.HTTPResponse) -> Iterator[bytes]:
+        try:
+            for line in response:
+                yield line
+        except socket.timeout as exc:
+            raise ApiTimeoutError("Timed out waiting for more of the response") from exc
+        except (OSError, http.client.HTTPException) as exc:
+            raise ApiConnectionError(f"Connection lost while reading the response: {exc}") from exc
@@ -0,0 +1,199 @@
+from typing import Callable, Dict, List, TypedDict, Union, cast
+from threading import Lock
+import copy
+import json
+import os
+import tempfile
+
+# Seconds to wait for more changes before writing the config.
+SAVE_DELAY = 1.0
+# Anki keeps this folder when the add-on is updated.
+USER_FILES_DIR = os.path.join(os.path.dirname(__file__), "user_files")
+
+
+class Preset(TypedDict):
+    name: str
+    value: str
+
+
+class ModelPrice(TypedDict):
+    # US dollars per million tokens.
+    input: float
+    cached_input: float
+    output: float
+
+
+class ProviderConfig(TypedDict):
+    name: str
+    # Full URL of the endpoint, such as http://192.168.1.20:8080/v1/chat/completions.
+    url: str
+    # "responses" or "chat_completions".
+    schema: str
+    model: str
+    # Can be left empty for servers that don't need one.
+    api_key: str
+    max_concurrent_requests: int
+
+
+class Config(TypedDict):
+    openai_api_key: str
+    openai_model: str
+    # Lets the add-on be pointed at anything that serves the Responses API, such as the
+    # fake server in bench/.
+    openai_api_url: str
+    MOCK_API_RESPONSE: str
+    vocab_query_presets: List[Preset]
+    theme_presets: List[Preset]
+    prompt_presets: List[Preset]
+    lang_presets: List[Preset]
+    # Asks for a continuation using the words a story left out, filled in with {story},
+    # {vocab} (the missing words), {theme} and {lang}.
+    supplement_prompt: str
+    # No longer used, kept so stories from older versions can be moved to the story store.
+    previous_stories: Dict[str, List[str]]
+    # 0 keeps every story.
+    max_stories_per_collection: int
+    story_font_size_idx: int
+    story_font_family: str
+    stream_responses: bool
+    # Vocab lists longer than this are split up and generated as separate parts of the
+    # story. 0 disables splitting. Splitting happens after `max_vocab_words` and
+    # `vocab_token_budget` have trimmed the list, so it only does anything when this is
+    # below them.
+    vocab_chunk_size: int
+    max_concurrent_requests: int
+    max_concurrent_jobs: int
+    # Write the selected deck's story with the first presets in the background after a
+    # review session, ready for when the prompt dialog is opened.
+    pregenerate_stories: bool
+    chunk_retries: int
+    cache_responses: bool
+    cache_max_size_mb: int
+    cache_max_age_days: int
+    http_connect_timeout: float
+    http_read_timeout: float
+    http_max_retries: int
+    # Requests taking longer than `hedge_percentile` of recent ones for the same model and
+    # prompt size are sent again, using whichever answers first, for at most
+    # `hedge_max_extra_requests` of all requests (0.05 is one in twenty).
+    hedge_requests: bool
+    hedge_percentile: float
+    hedge_max_extra_requests: float
+    vocab_index_enabled: bool
+    normalize_vocab: bool
+    dedupe_vocab: bool
+    # The most words, and roughly prompt tokens, a story is written with. 0 for no limit.
+    max_vocab_words: int
+    vocab_token_budget: int
+    # "include", "deprioritize" or "exclude" the words the deck's last
+    # `recent_vocab_stories` stories were asked to use.
+    recent_vocab_handling: str
+    recent_vocab_stories: int
+    record_usage: bool
+    # Where to send prompts, tried in order until one answers. When empty, OpenAI is used
+    # with the openai_ settings above.
+    providers: List[ProviderConfig]
+    model_prices: Dict[str, ModelPrice]
+
+    # This is a mapping of note types to a given field index
+    # in order to determine what field to pull the vocab from.
+    note_type_field: Dict[str, int]
+
+
+def write_json_atomic(path: str, data: Dict) -> None:
+    """Writes to a temporary file next to `path` and moves it into place, so the file is
+    never left half written."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def preset_name(presets: List[Preset], value: str) -> str:
+    """The name of the preset with this value, for text that was edited after picking a
+    preset this is "Custom"."""
+    return next((preset["name"] for preset in presets if preset["value"] == value), "Custom")
+
+
+def read_addon_config(addon_dir: str) -> Config:
+    """Reads the config the way Anki does outside of Anki: the defaults from
+    `config.json`, overridden by whatever the user changed, kept in `meta.json`."""
+    with open(os.path.join(addon_dir, "config.json"), encoding="utf8") as f:
+        config: Dict = json.load(f)
+    try:
+        with open(os.path.join(addon_dir, "meta.json"), encoding="utf8") as f:
+            config.update(json.load(f).get("config", {}))
+    except FileNotFoundError:
+        pass
+    return cast(Config, config)
+
+
+class ConfigService:
+    """Keeps one config object in memory for everything to share.
+
+    `save` only marks the config as changed and schedules a write, so a burst of changes
+    ends up as a single write `SAVE_DELAY` seconds after the last one. Writes are skipped
+    when nothing actually changed since the last one. Without a `schedule` function,
+    every save is written straight away."""
+
+    def __init__(
+        self,
+        load: Callable[[], Dict],
+        write: Callable[[Dict], None],
+        schedule: Union[Callable[[float, Callable[[], None]], None], None] = None,
+        delay: float = SAVE_DELAY,
+    ):
+        self.load = load
+        self.write = write
+        self.schedule = schedule
+        self.delay = delay
+        self.lock: Lock = Lock()
+        self.config: Union[Dict, None] = None
+        self.written: str = ""
+        # Bumped on every save, a scheduled write only goes ahead if nothing was saved
+        # after it was scheduled.
+        self.generation: int = 0
+
+    def get(self) -> Dict:
+        with self.lock:
+            if self.config is None:
+                self.config = self.load()
+                self.written = json.dumps(self.config, sort_keys=True)
+            return self.config
+
+    def reload(self) -> None:
+        """Drops the cached config, for when it was changed from outside the add-on."""
+        with self.lock:
+            self.config = None
+            self.generation += 1
+
+    def save(self, config: Union[Dict, None] = None) -> None:
+        with self.lock:
+            if config is not None:
+                self.config = config
+            self.generation += 1
+            generation: int = self.generation
+        if self.schedule is None:
+            self.flush()
+        else:
+            self.schedule(self.delay, lambda: self.flush_if_current(generation))
+
+    def flush_if_current(self, generation: int) -> None:
+        if generation == self.generation:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.config is None:
+                return
+            serialized: str = json.dumps(self.config, sort_keys=True)
+            if serialized == self.written:
+                return
+            snapshot: Dict = copy.deepcopy(self.config)
+            self.write(snapshot)
+            self.written = serialized
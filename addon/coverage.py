@@ -0,0 +1,116 @@
+from typing import Dict, Iterator, List, Sequence, Tuple, TypedDict
+
+# Checks which of the words a story was asked to use it actually contains, to highlight
+# them and ask for the missing ones without writing the whole story again.
+
+# Scripts from here on are written without spaces, so a term can start anywhere in a
+# word. Before it, such as Latin or Cyrillic, a match has to start a word.
+UNSPACED_SCRIPTS_START = 0x2E80
+HIRAGANA = range(0x3041, 0x30A0)
+# Verbs and adjectives ending with these are also matched by what comes before, so that
+# 勉強する matches 勉強した.
+VERB_SUFFIXES = ("する",)
+# Shorter stems match too much unrelated text, 高 of 高い in 高校 for one.
+MIN_STEM_LENGTH = 2
+
+
+class Coverage(TypedDict):
+    # Where terms were found, as (start, end) character offsets into the story.
+    spans: List[Tuple[int, int]]
+    found: List[str]
+    missing: List[str]
+
+
+def fold(text: str) -> str:
+    # Lowercases without changing the length, so offsets still point into the original.
+    return "".join(
+        lower if len(lower := c.lower()) == 1 else c
+        for c in text
+    )
+
+
+def term_forms(term: str) -> List[str]:
+    """The forms of `term` that count as using it: the term itself and, for Japanese
+    words that inflect, their stem."""
+    forms: List[str] = [term]
+    for suffix in VERB_SUFFIXES:
+        if term.endswith(suffix) and len(term) - len(suffix) >= MIN_STEM_LENGTH:
+            forms.append(term[:-len(suffix)])
+            return forms
+    if len(term) > MIN_STEM_LENGTH and ord(term[-1]) in HIRAGANA and any(
+            ord(c) not in HIRAGANA for c in term):
+        # 食べる as 食べた, 美しい as 美しく.
+        forms.append(term[:-1])
+    return forms
+
+
+class TermMatcher:
+    """An Aho-Corasick automaton over a set of patterns, finding every occurrence of all
+    of them in one pass over the text, however many there are."""
+
+    def __init__(self, patterns: Sequence[Tuple[str, int]]):
+        # Each pattern comes with the index of the term it is a form of.
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # (pattern length, term index) of every pattern ending at each state.
+        self.output: List[List[Tuple[int, int]]] = [[]]
+        for pattern, term_index in patterns:
+            state: int = 0
+            for c in pattern:
+                next_state: int = self.goto[state].get(c, -1)
+                if next_state < 0:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][c] = next_state
+                state = next_state
+            self.output[state].append((len(pattern), term_index))
+
+        # Breadth first, so the state each one falls back to is already done.
+        queue: List[int] = list(self.goto[0].values())
+        for state in queue:
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback: int = self.fail[state]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(c, 0)
+                self.output[next_state] = (
+                    self.output[next_state] + self.output[self.fail[next_state]])
+
+    def find(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yields the (start, end, term index) of every match, overlapping ones included."""
+        state: int = 0
+        for i, c in enumerate(text):
+            while state and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+            for length, term_index in self.output[state]:
+                yield i + 1 - length, i + 1, term_index
+
+
+def check_coverage(story: str, vocab: Sequence[str]) -> Coverage:
+    terms: List[str] = [term for term in dict.fromkeys(vocab) if term.strip()]
+    # A stem can be a term of its own as well, both count as found.
+    patterns: List[Tuple[str, int]] = [
+        (form, term_index)
+        for term_index, term in enumerate(terms)
+        for form in term_forms(fold(term.strip()))
+    ]
+
+    text: str = fold(story)
+    spans: List[Tuple[int, int]] = []
+    used: List[bool] = [False] * len(terms)
+    for start, end, term_index in TermMatcher(patterns).find(text):
+        if (ord(text[start]) < UNSPACED_SCRIPTS_START and text[start].isalnum()
+                and start > 0 and text[start - 1].isalnum()):
+            # Inside another word, such as "cat" in "scatter".
+            continue
+        spans.append((start, end))
+        used[term_index] = True
+    return Coverage(
+        spans=spans,
+        found=[term for term, is_used in zip(terms, used) if is_used],
+        missing=[term for term, is_used in zip(terms, used) if not is_used],
+    )
@@ -0,0 +1,298 @@
+from typing import Callable, Dict, List, Sequence, Union
+import time
+from anki.collection import Collection
+from anki.decks import DeckId
+from anki.notes import NoteId
+
+from .api import Usage
+from .cache import ResponseCache
+from .chunks import PART_SEPARATOR, generate_chunked, split_into_chunks
+from .client import HttpClient
+from .config import Config
+from .jobs import CancelToken
+from .hedging import hedge_settings
+from .metrics import RequestMetrics
+from .normalize import VocabCleaner
+from .providers import Provider, check_providers, complete_with_fallback, get_providers
+from .ranking import RECENT_DEPRIORITIZE, RECENT_EXCLUDE, drop_recent, select_vocab
+from .store import StoryStore
+from .timing import Trace, span
+from .vocab import VocabExtraction, deck_search, extract_vocab, extract_vocab_from_rows
+from .vocab_index import VocabIndex
+
+# The story generation pipeline, kept apart from the GUI so it can also run without
+# Anki, from the command line.
+
+# Which decks to generate stories for: the deck with its subdecks as one story, or a
+# separate story for each deck in its subtree or in the collection.
+SCOPE_DECK = "deck"
+SCOPE_SUBDECKS = "subdecks"
+SCOPE_ALL = "all"
+
+
+def batch_deck_names(col: Collection, deck_id: DeckId, scope: str) -> List[str]:
+    if scope == SCOPE_SUBDECKS:
+        return [col.decks.name(child_id) for child_id in col.decks.deck_and_child_ids(deck_id)]
+    return [
+        entry.name
+        for entry in col.decks.all_names_and_ids(skip_empty_default=True)
+    ]
+
+
+def collect_deck_vocab(
+    col: Collection,
+    deck_name: str,
+    preset_query: str,
+    config: Config,
+    trace: Trace,
+    index: Union[VocabIndex, None] = None,
+    cleaner: Union[VocabCleaner, None] = None,
+    include_subdecks: bool = True,
+    store: Union[StoryStore, None] = None,
+) -> VocabExtraction:
+    """Finds the notes of the deck matching `preset_query` and pulls out their vocab,
+    trimmed to the configured budget. Uses `index` for the queries it can answer, and
+    `store` to leave out or rank lower the words of the deck's recent stories."""
+    dedupe_vocab: bool = config["dedupe_vocab"]
+    known_notes: Dict[str, int] = config["note_type_field"]
+
+    def extract() -> VocabExtraction:
+        if index is not None:
+            with trace.span("vocab_index"):
+                rows = index.rows(col, deck_name, preset_query, include_subdecks)
+            if rows is not None:
+                with trace.span("extract_vocab"):
+                    return extract_vocab_from_rows(
+                        col, rows, known_notes, cleaner, dedupe_vocab)
+        with trace.span("get_notes"):
+            note_ids: Sequence[NoteId] = col.find_notes(
+                f"{deck_search(deck_name, include_subdecks)} {preset_query}")
+        with trace.span("extract_vocab"):
+            return extract_vocab(col, note_ids, known_notes, cleaner, dedupe_vocab)
+
+    with trace.profiled():
+        extraction: VocabExtraction = extract()
+        if not extraction["unknown_note_types"]:
+            recent_stories: int = config["recent_vocab_stories"]
+            recent: Dict[str, int] = {}
+            if store is not None and config["recent_vocab_handling"] in (
+                    RECENT_DEPRIORITIZE, RECENT_EXCLUDE):
+                with trace.span("recent_vocab"):
+                    recent = store.recent_vocab(deck_name, recent_stories)
+            if recent and config["recent_vocab_handling"] == RECENT_EXCLUDE:
+                found: int = len(extraction["vocab"])
+                extraction = drop_recent(extraction, recent)
+                trace.count("recent_vocab_skipped", found - len(extraction["vocab"]))
+            found = len(extraction["vocab"])
+            with trace.span("select_vocab"):
+                extraction = select_vocab(
+                    col, extraction, config["max_vocab_words"], config["vocab_token_budget"],
+                    recent, recent_stories)
+            trace.count("vocab_dropped", found - len(extraction["vocab"]))
+    if cleaner is not None or dedupe_vocab:
+        trace.count("tokens_saved", extraction["tokens_saved"])
+    return extraction
+
+
+def generate_story(
+    vocab: List[str],
+    theme: str,
+    prompt: str,
+    lang: str,
+    config: Config,
+    client: HttpClient,
+    cache: Union[ResponseCache, None] = None,
+    on_delta: Union[Callable[[str], None], None] = None,
+    use_cache: bool = True,
+    trace: Union[Trace, None] = None,
+    cancel: Union[CancelToken, None] = None,
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = None,
+) -> str:
+    # When `on_delta` is given, the response is streamed and each new chunk of text is
+    # passed to it as it arrives. Cancelling `cancel` stops any request in flight.
+    # `on_metrics` is called with the usage and latency of each request made.
+    if len(vocab) == 0:
+        raise Exception("No notes found matching your query")
+    if config.get("MOCK_API_RESPONSE") is True:
+        # So we don't run up the bill while testing :)
+        response: str = (
+            f"ここに何かがありますよ。テーマは「{theme}」です。下には、選んだ言葉があります：\n"
+            + "\n".join(vocab)
+        )
+        if len(response) > 1000:
+            response = (
+                response[0:1000] +
+                f"... ({len(response) - 1000} characters omitted"
+            )
+        if on_delta is not None:
+            on_delta(response)
+        return response
+    check_providers(config)
+
+    chunks: List[List[str]] = split_into_chunks(vocab, config["vocab_chunk_size"])
+    if len(chunks) > 1:
+        return generate_chunked_story(
+            chunks, theme, prompt, lang, config, client, cache, on_delta, use_cache, trace,
+            cancel, on_metrics)
+    with span(trace, "prompt_format"):
+        filled_prompt: str = prompt.format(vocab="\n".join(vocab), theme=theme, lang=lang)
+    return request_story(
+        filled_prompt, config, client, cache, on_delta, use_cache, trace, cancel=cancel,
+        on_metrics=on_metrics)
+
+
+def generate_supplement(
+    story: str,
+    missing: List[str],
+    theme: str,
+    lang: str,
+    config: Config,
+    client: HttpClient,
+    cache: Union[ResponseCache, None] = None,
+    trace: Union[Trace, None] = None,
+    cancel: Union[CancelToken, None] = None,
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = None,
+) -> str:
+    """Asks for a continuation of `story` using the `missing` words, which costs far
+    less than writing the story again."""
+    if len(missing) == 0:
+        raise Exception("The story already uses every word")
+    if config.get("MOCK_API_RESPONSE") is True:
+        return "続きです：" + "、".join(missing)
+    check_providers(config)
+    filled_prompt: str = config["supplement_prompt"].format(
+        story=story, vocab="\n".join(missing), theme=theme, lang=lang)
+    return request_story(
+        filled_prompt, config, client, cache, trace=trace, span_name="request_supplement",
+        cancel=cancel, on_metrics=on_metrics)
+
+
+def generate_chunked_story(
+    chunks: List[List[str]],
+    theme: str,
+    prompt: str,
+    lang: str,
+    config: Config,
+    client: HttpClient,
+    cache: Union[ResponseCache, None] = None,
+    on_delta: Union[Callable[[str], None], None] = None,
+    use_cache: bool = True,
+    trace: Union[Trace, None] = None,
+    cancel: Union[CancelToken, None] = None,
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = None,
+) -> str:
+    # Each chunk gets its own request with the same prompt, and the parts are joined in
+    # order. Parts are passed to `on_delta` as they become ready rather than streamed.
+    ready_count: List[int] = [0]
+
+    def generate(chunk: List[str]) -> str:
+        return request_story(
+            prompt.format(vocab="\n".join(chunk), theme=theme, lang=lang),
+            config,
+            client,
+            cache,
+            use_cache=use_cache,
+            trace=trace,
+            span_name="request_part",
+            cancel=cancel,
+            on_metrics=on_metrics,
+        )
+
+    def on_ready(part: str) -> None:
+        if on_delta is not None:
+            on_delta((PART_SEPARATOR if ready_count[0] else "") + part)
+        ready_count[0] += 1
+
+    with span(trace, "request"):
+        parts: List[str] = generate_chunked(
+            chunks,
+            generate,
+            max_workers=config["max_concurrent_requests"],
+            retries=config["chunk_retries"],
+            on_ready=on_ready,
+        )
+    return PART_SEPARATOR.join(parts)
+
+
+def request_story(
+    filled_prompt: str,
+    config: Config,
+    client: HttpClient,
+    cache: Union[ResponseCache, None] = None,
+    on_delta: Union[Callable[[str], None], None] = None,
+    use_cache: bool = True,
+    trace: Union[Trace, None] = None,
+    span_name: str = "request",
+    cancel: Union[CancelToken, None] = None,
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = None,
+) -> str:
+    # Tried in order, falling back to the next when one can't be reached.
+    providers: List[Provider] = get_providers(config)
+    start: float = time.perf_counter()
+    if cache is not None and use_cache:
+        with span(trace, "cache_lookup"):
+            cached: Union[str, None] = None
+            for provider in providers:
+                cached = cache.get(provider.model, filled_prompt)
+                if cached is not None:
+                    break
+        if cached is not None:
+            if on_metrics is not None:
+                on_metrics(RequestMetrics(
+                    model=provider.model,
+                    usage=Usage(input_tokens=0, cached_tokens=0, output_tokens=0),
+                    latency=time.perf_counter() - start,
+                    from_cache=True,
+                    hedge=False,
+                ))
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    def record_hedge(model: str, usage: Usage) -> None:
+        # Recorded even if the request fails, it was paid for all the same.
+        if on_metrics is not None:
+            on_metrics(RequestMetrics(
+                model=model, usage=usage, latency=0.0, from_cache=False, hedge=True))
+
+    usages: List[Usage] = []
+    response: str
+    start = time.perf_counter()
+    with span(trace, span_name):
+        provider, response = complete_with_fallback(
+            providers, filled_prompt, client,
+            time_first_delta(on_delta, trace) if on_delta is not None else None,
+            cancel, usages.append, hedge_settings(config), record_hedge)
+    if on_metrics is not None:
+        on_metrics(RequestMetrics(
+            model=provider.model,
+            # Streams that ended early may not have reported their usage.
+            usage=usages[-1] if usages else Usage(
+                input_tokens=0, cached_tokens=0, output_tokens=0),
+            latency=time.perf_counter() - start,
+            from_cache=False,
+            hedge=False,
+        ))
+
+    if cache is not None:
+        # Still store the response when bypassing, so the newest story is the one reused.
+        with span(trace, "cache_store"):
+            cache.put(provider.model, filled_prompt, response)
+    return response
+
+
+def time_first_delta(
+    on_delta: Callable[[str], None], trace: Union[Trace, None]
+) -> Callable[[str], None]:
+    if trace is None:
+        return on_delta
+    start: float = time.perf_counter()
+    first: List[bool] = [True]
+
+    def timed_on_delta(delta: str) -> None:
+        if first[0]:
+            first[0] = False
+            trace.record("first_token", start)
+        on_delta(delta)
+
+    return timed_on_delta
@@ -0,0 +1,239 @@
+from typing import Callable, Deque, Dict, List, Tuple, TypedDict, Union, cast
+from collections import deque
+from queue import Empty, Queue
+from threading import Lock, Thread
+import math
+import time
+
+from .api import Usage
+from .config import Config
+from .jobs import Cancelled, CancelToken
+from .timing import percentile
+
+# Requests that take much longer than usual are sent a second time, and whichever answers
+# first is used. A stalled connection then costs one extra request rather than minutes.
+
+# Latencies kept for each model and prompt size.
+HEDGE_WINDOW = 200
+# Too few latencies say little about what is unusually slow.
+HEDGE_MIN_SAMPLES = 20
+# How often a request waiting on the first answer checks whether it was cancelled.
+HEDGE_POLL_INTERVAL = 0.2
+# How long to wait for the copy that wasn't used to stop once cancelled, so its usage
+# is reported before the request returns.
+HEDGE_DRAIN_TIMEOUT = 5.0
+
+# Model, prompt size bucket and whether the response is streamed, for which the time to
+# the first text is kept rather than to the whole response.
+LatencyKey = Tuple[str, int, bool]
+# Sends the request with the given on_delta, cancel token and on_usage.
+Send = Callable[
+    [Union[Callable[[str], None], None], Union[CancelToken, None],
+     Callable[[Usage], None]],
+    str,
+]
+
+
+class HedgeSettings(TypedDict):
+    # Percentile of past latencies after which a duplicate is sent.
+    percentile: float
+    # At most this fraction of requests is sent twice.
+    max_extra_requests: float
+
+
+def hedge_settings(config: Config) -> Union[HedgeSettings, None]:
+    if not config["hedge_requests"]:
+        return None
+    return HedgeSettings(
+        percentile=config["hedge_percentile"],
+        max_extra_requests=config["hedge_max_extra_requests"],
+    )
+
+
+def latency_key(model: str, prompt: str, streamed: bool) -> LatencyKey:
+    # Prompts of similar length take similar time, sizes double from one bucket to the
+    # next.
+    return model, int(math.log2(max(len(prompt), 1))), streamed
+
+
+class LatencyHistogram:
+    """Recent latencies per model and prompt size, and how many requests were sent a
+    second time, shared by every story being generated."""
+
+    def __init__(self):
+        self.lock: Lock = Lock()
+        self.latencies: Dict[LatencyKey, Deque[float]] = {}
+        self.requests: int = 0
+        self.hedged: int = 0
+
+    def record(self, key: LatencyKey, seconds: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(key, deque(maxlen=HEDGE_WINDOW)).append(seconds)
+
+    def hedge_delay(self, key: LatencyKey, pct: float) -> Union[float, None]:
+        """How long to wait before sending a duplicate, None until there is enough
+        history to tell."""
+        with self.lock:
+            latencies: List[float] = list(self.latencies.get(key, ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(latencies, pct)
+
+    def count_request(self) -> None:
+        with self.lock:
+            self.requests += 1
+
+    def try_hedge(self, max_extra_requests: float) -> bool:
+        """Counts a duplicate request if it stays within the budget."""
+        with self.lock:
+            if self.hedged + 1 > max_extra_requests * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+
+latency_histogram: LatencyHistogram = LatencyHistogram()
+
+
+def send_hedged(
+    send: Send,
+    key: LatencyKey,
+    settings: Union[HedgeSettings, None],
+    on_delta: Union[Callable[[str], None], None] = None,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+    on_extra_usage: Union[Callable[[Usage], None], None] = None,
+) -> str:
+    """Sends the request, and again if it runs past the usual latency for `key`. The
+    first to answer, or for streams the first to start, is used and the other is
+    cancelled. The usage of the request used is passed to `on_usage`, and that of the
+    other to `on_extra_usage`, with no tokens if it was cancelled before reporting any."""
+    histogram: LatencyHistogram = latency_histogram
+    histogram.count_request()
+    start: float = time.perf_counter()
+    delay: Union[float, None] = (
+        histogram.hedge_delay(key, settings["percentile"]) if settings is not None else None)
+    if settings is None or delay is None:
+        return send_timed(send, key, on_delta, cancel, on_usage)
+    hedge_at: Union[float, None] = start + delay
+
+    lock: Lock = Lock()
+    # Index of the attempt whose response is used, once known.
+    winner: List[Union[int, None]] = [None]
+    tokens: List[CancelToken] = []
+    results: "Queue[Tuple[int, Union[str, None], Union[Exception, None]]]" = Queue()
+
+    def claim(attempt: int) -> bool:
+        with lock:
+            if winner[0] is None:
+                winner[0] = attempt
+                histogram.record(key, time.perf_counter() - start)
+                for i, token in enumerate(tokens):
+                    if i != attempt:
+                        token.cancel()
+            return winner[0] == attempt
+
+    def run(attempt: int, token: CancelToken) -> None:
+        usages: List[Usage] = []
+
+        def attempt_delta(delta: str) -> None:
+            if not claim(attempt):
+                raise Cancelled()
+            cast(Callable[[str], None], on_delta)(delta)
+
+        def report_usage() -> None:
+            if winner[0] not in (None, attempt):
+                # Reported even when cancelled before the server said what it used, so
+                # every copy sent is counted.
+                if on_extra_usage is not None:
+                    on_extra_usage(usages[-1] if usages else Usage(
+                        input_tokens=0, cached_tokens=0, output_tokens=0))
+            elif on_usage is not None and usages:
+                on_usage(usages[-1])
+
+        unregister: Callable[[], None] = (
+            cancel.on_cancel(token.cancel) if cancel is not None else lambda: None)
+        try:
+            response: str = send(
+                attempt_delta if on_delta is not None else None, token, usages.append)
+            if not claim(attempt):
+                raise Cancelled()
+        except Exception as exc:
+            report_usage()
+            results.put((attempt, None, exc))
+            return
+        finally:
+            unregister()
+        report_usage()
+        results.put((attempt, response, None))
+
+    def start_attempt() -> None:
+        token: CancelToken = CancelToken()
+        with lock:
+            tokens.append(token)
+            attempt: int = len(tokens) - 1
+            if winner[0] is not None:
+                # Answered while this one was being started.
+                token.cancel()
+        Thread(
+            target=run, args=(attempt, token), name="storytime-request", daemon=True
+        ).start()
+
+    def drain(finished: int) -> None:
+        # The others were cancelled, wait for them to stop so their usage is in.
+        for _ in range(len(tokens) - finished):
+            try:
+                results.get(timeout=HEDGE_DRAIN_TIMEOUT)
+            except Empty:
+                return
+
+    start_attempt()
+    errors: List[Exception] = []
+    while True:
+        timeout: float = HEDGE_POLL_INTERVAL
+        if hedge_at is not None:
+            timeout = max(min(timeout, hedge_at - time.perf_counter()), 0)
+        try:
+            attempt, response, error = results.get(timeout=timeout)
+        except Empty:
+            if hedge_at is not None and time.perf_counter() >= hedge_at:
+                hedge_at = None
+                if winner[0] is None and histogram.try_hedge(settings["max_extra_requests"]):
+                    start_attempt()
+            continue
+        if error is None:
+            drain(len(errors) + 1)
+            return cast(str, response)
+        errors.append(error)
+        if winner[0] == attempt or len(errors) == len(tokens):
+            # Failed after its stream had started, so the other can't take over, or every
+            # attempt failed.
+            drain(len(errors))
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            raise error if winner[0] == attempt else next(
+                (exc for exc in errors if not isinstance(exc, Cancelled)), error)
+
+
+def send_timed(
+    send: Send,
+    key: LatencyKey,
+    on_delta: Union[Callable[[str], None], None] = None,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+) -> str:
+    """Sends the request once, adding how long it took to the histogram."""
+    start: float = time.perf_counter()
+    first: List[bool] = [True]
+
+    def timed_delta(delta: str) -> None:
+        if first[0]:
+            first[0] = False
+            latency_histogram.record(key, time.perf_counter() - start)
+        cast(Callable[[str], None], on_delta)(delta)
+
+    response: str = send(
+        timed_delta if on_delta is not None else None, cancel, on_usage or (lambda _: None))
+    if on_delta is None:
+        latency_histogram.record(key, time.perf_counter() - start)
+    return response
@@ -0,0 +1,213 @@
+from typing import Any, Callable, Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+import itertools
+import time
+
+JOB_QUEUED = "Queued"
+JOB_RUNNING = "Running"
+JOB_DONE = "Done"
+JOB_FAILED = "Failed"
+JOB_CANCELLED = "Cancelled"
+# Finished jobs kept around for the jobs view.
+MAX_FINISHED_JOBS = 50
+
+
+class Cancelled(Exception):
+    def __init__(self, message: str = "Cancelled"):
+        super().__init__(message)
+
+
+class CancelToken:
+    """Shared between a job and the work it runs. Work checks it between steps, and
+    anything blocking, like a request waiting on the network, registers a callback to
+    be interrupted with."""
+
+    def __init__(self):
+        self.event: Event = Event()
+        self.lock: Lock = Lock()
+        self.callbacks: Dict[int, Callable[[], None]] = {}
+        self.next_id: int = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self) -> None:
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks: List[Callable[[], None]] = list(self.callbacks.values())
+            self.callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Calls `callback` once the token is cancelled, right away if it already was.
+        Returns a function that unregisters it."""
+        with self.lock:
+            if not self.event.is_set():
+                callback_id: int = self.next_id
+                self.next_id += 1
+                self.callbacks[callback_id] = callback
+                return lambda: self.remove(callback_id)
+        callback()
+        return lambda: None
+
+    def remove(self, callback_id: int) -> None:
+        with self.lock:
+            self.callbacks.pop(callback_id, None)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps for `timeout` seconds, waking up early if cancelled. Returns whether it
+        was cancelled."""
+        return self.event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        if self.event.is_set():
+            raise Cancelled()
+
+
+class Job:
+    def __init__(self, job_id: int, key: str, title: str, deck_name: str):
+        self.id = job_id
+        self.key = key
+        self.title = title
+        self.deck_name = deck_name
+        self.status: str = JOB_QUEUED
+        self.created: float = time.time()
+        self.started: Union[float, None] = None
+        self.finished: Union[float, None] = None
+        self.result: Any = None
+        self.error: Union[Exception, None] = None
+        self.cancel_token: CancelToken = CancelToken()
+        # Everyone who asked for this job, called once it finishes.
+        self.waiters: List[Callable[["Job"], None]] = []
+
+    @property
+    def active(self) -> bool:
+        return self.status in (JOB_QUEUED, JOB_RUNNING)
+
+
+class JobManager:
+    """Runs story generation jobs in the background, at most `max_workers` at a time.
+
+    Jobs are identified by a key, such as the deck, prompt and model. Submitting a job
+    while another with the same key is queued or running adds to the existing one instead
+    of starting a second, so double clicks and overlapping batches only pay once.
+    `on_change` is called with a job whenever its status changes, from whichever thread
+    changed it."""
+
+    def __init__(
+        self,
+        max_workers: int,
+        on_change: Callable[[Job], None] = lambda _: None,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.on_change = on_change
+        self.lock: Lock = Lock()
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="storytime-job")
+        self.ids = itertools.count(1)
+        self.all_jobs: List[Job] = []
+
+    def find(self, key: str) -> Union[Job, None]:
+        with self.lock:
+            return self.active_job(key)
+
+    def active_job(self, key: str) -> Union[Job, None]:
+        # Called with the lock held.
+        return next((job for job in self.all_jobs if job.active and job.key == key), None)
+
+    def jobs(self) -> List[Job]:
+        with self.lock:
+            return list(self.all_jobs)
+
+    def submit(
+        self,
+        key: str,
+        title: str,
+        deck_name: str,
+        work: Callable[[CancelToken], Any],
+        on_done: Union[Callable[[Job], None], None] = None,
+    ) -> Job:
+        """Queues `work`, which is passed the job's cancel token, unless an identical job
+        is already queued or running. `on_done` is called with the job once it finished,
+        failed or was cancelled."""
+        with self.lock:
+            job: Union[Job, None] = self.active_job(key)
+            if job is not None:
+                if on_done is not None:
+                    job.waiters.append(on_done)
+                return job
+            job = Job(next(self.ids), key, title, deck_name)
+            if on_done is not None:
+                job.waiters.append(on_done)
+            self.all_jobs.append(job)
+            self.prune()
+        self.on_change(job)
+        self.executor.submit(self.run, job, work)
+        return job
+
+    def run(self, job: Job, work: Callable[[CancelToken], Any]) -> None:
+        with self.lock:
+            if job.status != JOB_QUEUED:
+                # Cancelled while waiting for a worker.
+                return
+            job.status = JOB_RUNNING
+            job.started = time.time()
+        self.on_change(job)
+        try:
+            job.cancel_token.raise_if_cancelled()
+            result: Any = work(job.cancel_token)
+        except Exception as exc:
+            if job.cancel_token.cancelled:
+                self.finish(job, JOB_CANCELLED)
+            else:
+                self.finish(job, JOB_FAILED, error=exc)
+            return
+        if job.cancel_token.cancelled:
+            # Finished anyway, but whoever cancelled it no longer wants the result.
+            self.finish(job, JOB_CANCELLED)
+        else:
+            self.finish(job, JOB_DONE, result=result)
+
+    def finish(
+        self, job: Job, status: str, result: Any = None, error: Union[Exception, None] = None
+    ) -> None:
+        with self.lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+            waiters: List[Callable[[Job], None]] = job.waiters
+            job.waiters = []
+        self.on_change(job)
+        for waiter in waiters:
+            waiter(job)
+
+    def cancel(self, job: Job) -> None:
+        with self.lock:
+            if not job.active:
+                return
+            queued: bool = job.status == JOB_QUEUED
+            if queued:
+                # Keeps a worker from picking it up in the meantime.
+                job.status = JOB_CANCELLED
+        job.cancel_token.cancel()
+        if queued:
+            self.finish(job, JOB_CANCELLED)
+
+    def cancel_all(self) -> None:
+        for job in self.jobs():
+            self.cancel(job)
+
+    def prune(self) -> None:
+        finished: List[Job] = [job for job in self.all_jobs if not job.active]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            self.all_jobs.remove(job)
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self.executor.shutdown(wait=False)
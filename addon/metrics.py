@@ -0,0 +1,190 @@
+from typing import Dict, List, TypedDict, Union
+from threading import Lock
+import sqlite3
+import time
+
+from .api import Usage
+from .config import Config, ModelPrice, preset_name
+from .store import StoryMetadata
+
+SCHEMA = """
+create table if not exists requests (
+    id integer primary key,
+    created real not null,
+    deck text not null,
+    model text not null,
+    prompt_preset text not null default '',
+    theme_preset text not null default '',
+    query_preset text not null default '',
+    input_tokens integer not null default 0,
+    cached_tokens integer not null default 0,
+    output_tokens integer not null default 0,
+    -- Seconds from sending the request to having the full response.
+    latency real not null default 0,
+    -- In US dollars, null when the model has no price in the config.
+    cost real,
+    -- Answered from the add-on's response cache without a request.
+    from_cache integer not null default 0,
+    -- A duplicate of a slow request whose answer wasn't used, see hedging.py.
+    hedge integer not null default 0
+);
+create index if not exists requests_created on requests (created);
+"""
+
+# What the summary can be grouped by, and the SQL expression for each.
+GROUP_BY_DAY = "day"
+GROUP_BY_DECK = "deck"
+GROUP_BY_MODEL = "model"
+GROUP_BY_PROMPT = "prompt_preset"
+GROUP_BY_THEME = "theme_preset"
+GROUP_BY_QUERY = "query_preset"
+GROUP_EXPRESSIONS: Dict[str, str] = {
+    GROUP_BY_DAY: "date(created, 'unixepoch', 'localtime')",
+    GROUP_BY_DECK: "deck",
+    GROUP_BY_MODEL: "model",
+    GROUP_BY_PROMPT: "prompt_preset",
+    GROUP_BY_THEME: "theme_preset",
+    GROUP_BY_QUERY: "query_preset",
+}
+
+
+class RequestMetrics(TypedDict):
+    model: str
+    usage: Usage
+    latency: float
+    from_cache: bool
+    # Paid for but not used, as another copy of the request answered first.
+    hedge: bool
+
+
+class RequestLabels(TypedDict):
+    """What a request was made for, to group the summary by."""
+    deck: str
+    prompt_preset: str
+    theme_preset: str
+    query_preset: str
+
+
+class UsageSummary(TypedDict):
+    group: str
+    requests: int
+    cache_hits: int
+    # Requests sent again because they were slow, whose answers weren't used.
+    hedges: int
+    input_tokens: int
+    cached_tokens: int
+    output_tokens: int
+    # Averaged over the requests whose answers were used, cache hits don't count.
+    average_latency: float
+    cost: float
+    # Requests for models without a price, left out of `cost`.
+    unpriced: int
+
+
+def request_labels(deck: str, metadata: StoryMetadata, config: Config) -> RequestLabels:
+    return RequestLabels(
+        deck=deck,
+        prompt_preset=preset_name(config["prompt_presets"], metadata.get("prompt", "")),
+        theme_preset=preset_name(config["theme_presets"], metadata.get("theme", "")),
+        query_preset=preset_name(
+            config["vocab_query_presets"], metadata.get("vocab_query", "")),
+    )
+
+
+def estimate_cost(usage: Usage, price: Union[ModelPrice, None]) -> Union[float, None]:
+    if price is None:
+        return None
+    uncached: int = max(usage["input_tokens"] - usage["cached_tokens"], 0)
+    return (
+        uncached * price["input"]
+        + usage["cached_tokens"] * price["cached_input"]
+        + usage["output_tokens"] * price["output"]
+    ) / 1_000_000
+
+
+class MetricsStore:
+    """Token usage, latency and cost of every request, kept apart from the story history
+    so it can be cleared without losing any stories."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock: Lock = Lock()
+        # Requests finish on background threads.
+        self.db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+            columns = [row[1] for row in self.db.execute("pragma table_info(requests)")]
+            if "hedge" not in columns:
+                # Recorded before hedged requests were.
+                self.db.execute(
+                    "alter table requests add column hedge integer not null default 0")
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    def record(
+        self,
+        metrics: RequestMetrics,
+        labels: RequestLabels,
+        prices: Dict[str, ModelPrice],
+        created: Union[float, None] = None,
+    ) -> None:
+        usage: Usage = metrics["usage"]
+        # Priced when made, so later price changes don't rewrite history.
+        cost: Union[float, None] = (
+            0.0 if metrics["from_cache"]
+            else estimate_cost(usage, prices.get(metrics["model"])))
+        with self.lock, self.db:
+            self.db.execute(
+                "insert into requests (created, deck, model, prompt_preset, theme_preset,"
+                " query_preset, input_tokens, cached_tokens, output_tokens, latency, cost,"
+                " from_cache, hedge) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time() if created is None else created,
+                    labels["deck"],
+                    metrics["model"],
+                    labels["prompt_preset"],
+                    labels["theme_preset"],
+                    labels["query_preset"],
+                    usage["input_tokens"],
+                    usage["cached_tokens"],
+                    usage["output_tokens"],
+                    metrics["latency"],
+                    cost,
+                    metrics["from_cache"],
+                    metrics["hedge"],
+                ),
+            )
+
+    def summary(self, group_by: str, days: int = 0) -> List[UsageSummary]:
+        """Totals per day, deck, model or preset over the last `days` days, 0 for all
+        time. Days are listed newest first, anything else most expensive first."""
+        expression: str = GROUP_EXPRESSIONS[group_by]
+        order: str = (
+            "grp desc" if group_by == GROUP_BY_DAY else "total(cost) desc, count() desc")
+        since: float = time.time() - days * 86400 if days else 0
+        with self.lock:
+            rows = self.db.execute(
+                f"select {expression} as grp, count(), sum(from_cache), sum(hedge),"
+                " sum(input_tokens), sum(cached_tokens), sum(output_tokens),"
+                " avg(case when from_cache or hedge then null else latency end),"
+                " total(cost), sum(cost is null)"
+                f" from requests where created >= ? group by grp order by {order}",
+                (since,),
+            ).fetchall()
+        return [
+            UsageSummary(
+                group=row[0],
+                requests=row[1],
+                cache_hits=row[2],
+                hedges=row[3],
+                input_tokens=row[4],
+                cached_tokens=row[5],
+                output_tokens=row[6],
+                average_latency=row[7] or 0.0,
+                cost=row[8],
+                unpriced=row[9],
+            )
+            for row in rows
+        ]
@@ -0,0 +1,95 @@
+from typing import Dict, List, Sequence, Tuple
+from threading import Lock
+import html
+import re
+from anki.notes import NoteId
+
+# Tags that end a line when the field is rendered.
+LINE_BREAK_TAG = re.compile(r"<\s*(?:br|/div|/p|/li|/tr|hr)\b[^>]*>", re.IGNORECASE)
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+HIDDEN_ELEMENT = re.compile(
+    r"<\s*(style|script)\b[^>]*>.*?<\s*/\s*\1\s*>", re.IGNORECASE | re.DOTALL)
+HTML_TAG = re.compile(r"<[^>]*>")
+SOUND_TAG = re.compile(r"\[sound:[^\]]*\]")
+# `{{c1::answer::hint}}` -> `answer`
+CLOZE = re.compile(r"\{\{c\d+::(.*?)(?:::[^}]*)?\}\}", re.DOTALL)
+# Same pattern as Anki's furigana filters: `漢字[かんじ]` -> `漢字`
+FURIGANA = re.compile(r" ?([^ >]+?)\[(.+?)\]")
+# Separators between alternative forms or meanings, the headword is the first one.
+ALTERNATIVES = re.compile(r"[,;/、，；／|]")
+TRAILING_READING = re.compile(r"\s*[(（【][^)）】]*[)）】]\s*$")
+WHITESPACE = re.compile(r"\s+")
+
+
+def strip_markup(text: str) -> str:
+    text = HTML_COMMENT.sub("", text)
+    text = HIDDEN_ELEMENT.sub("", text)
+    text = LINE_BREAK_TAG.sub("\n", text)
+    text = HTML_TAG.sub("", text)
+    text = html.unescape(text).replace("\xa0", " ")
+    text = SOUND_TAG.sub("", text)
+    text = CLOZE.sub(r"\1", text)
+    return FURIGANA.sub(r"\1", text)
+
+
+def headword(text: str) -> str:
+    """The first non-empty line, without alternative forms or a reading in brackets."""
+    for line in text.splitlines():
+        word: str = ALTERNATIVES.split(line, 1)[0]
+        word = WHITESPACE.sub(" ", TRAILING_READING.sub("", word)).strip()
+        if word:
+            return word
+    return ""
+
+
+def normalize_term(text: str) -> str:
+    """Turns the raw contents of a vocab field into the plain term to put in a prompt."""
+    return headword(strip_markup(text))
+
+
+def dedupe(vocab: Sequence[str]) -> List[int]:
+    """Returns the indices of the terms to keep, dropping empty and repeated terms but
+    keeping the first occurrence of each."""
+    seen: Dict[str, None] = {}
+    kept: List[int] = []
+    for i, term in enumerate(vocab):
+        key: str = term.casefold()
+        if term and key not in seen:
+            seen[key] = None
+            kept.append(i)
+    return kept
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count without a tokenizer: about four characters per token for ASCII
+    and one per character for everything else, which is close for CJK text."""
+    ascii_chars: int = sum(1 for char in text if char < "\x80")
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+class VocabCleaner:
+    """Remembers the normalized term of each note, so a note is only cleaned again once
+    it was modified.
+
+    Entries are keyed by note ID and checked against the note's modification time and
+    the raw field. The raw field is needed as well because edits can be seen (by the
+    vocab index) before the notes table bumps the modification time."""
+
+    def __init__(self):
+        self.lock: Lock = Lock()
+        self.cache: Dict[NoteId, Tuple[int, str, str]] = {}
+
+    def clean(self, note_id: NoteId, mod: int, raw: str) -> str:
+        with self.lock:
+            cached = self.cache.get(note_id)
+        if cached is not None and cached[0] == mod and cached[1] == raw:
+            return cached[2]
+        term: str = normalize_term(raw)
+        with self.lock:
+            self.cache[note_id] = (mod, raw, term)
+        return term
+
+    def forget(self, note_ids: Sequence[NoteId]) -> None:
+        with self.lock:
+            for note_id in note_ids:
+                self.cache.pop(note_id, None)
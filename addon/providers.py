@@ -0,0 +1,186 @@
+from typing import Callable, Dict, List, Tuple, Union, cast
+from threading import BoundedSemaphore, Lock
+
+from .api import (
+    Usage, get_chat_response, get_openai_response, stream_chat_response,
+    stream_openai_response)
+from .client import BadRequestError, HttpClient
+from .config import Config, ProviderConfig
+from .hedging import HedgeSettings, latency_key, send_hedged
+from .jobs import Cancelled, CancelToken
+
+SCHEMA_RESPONSES = "responses"
+SCHEMA_CHAT = "chat_completions"
+# Used for whatever a configured provider leaves out.
+PROVIDER_DEFAULTS: Dict = dict(
+    name="", schema=SCHEMA_RESPONSES, api_key="", max_concurrent_requests=4)
+# How often a request waiting for a free slot checks whether it was cancelled.
+SLOT_POLL_INTERVAL = 0.2
+
+
+class Provider:
+    """Somewhere to send prompts: a server, the API it speaks, the model to ask for, and
+    how many requests it takes at once. Requests over the limit wait for a free slot,
+    whichever job or chunk they come from."""
+
+    def __init__(self, settings: ProviderConfig):
+        self.name: str = settings["name"]
+        self.url: str = settings["url"]
+        self.schema: str = settings["schema"]
+        self.model: str = settings["model"]
+        self.api_key: str = settings["api_key"]
+        self.max_concurrent_requests: int = max(1, settings["max_concurrent_requests"])
+        self.slots: BoundedSemaphore = BoundedSemaphore(self.max_concurrent_requests)
+
+    def complete(
+        self,
+        prompt: str,
+        client: HttpClient,
+        on_delta: Union[Callable[[str], None], None] = None,
+        cancel: Union[CancelToken, None] = None,
+        on_usage: Union[Callable[[Usage], None], None] = None,
+    ) -> str:
+        """Sends the prompt, streaming the response to `on_delta` if given."""
+        self.acquire(cancel)
+        try:
+            if self.schema == SCHEMA_CHAT:
+                if on_delta is not None:
+                    return stream_chat_response(
+                        prompt, self.model, self.api_key, on_delta, client=client,
+                        url=self.url, cancel=cancel, on_usage=on_usage)
+                return get_chat_response(
+                    prompt, self.model, self.api_key, client=client, url=self.url,
+                    cancel=cancel, on_usage=on_usage)
+            if on_delta is not None:
+                return stream_openai_response(
+                    prompt, self.model, self.api_key, on_delta, client=client,
+                    url=self.url, cancel=cancel, on_usage=on_usage)
+            return get_openai_response(
+                prompt, self.model, self.api_key, client=client, url=self.url,
+                cancel=cancel, on_usage=on_usage)
+        finally:
+            self.slots.release()
+
+    def acquire(self, cancel: Union[CancelToken, None]) -> None:
+        while not self.slots.acquire(timeout=SLOT_POLL_INTERVAL):
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+
+
+def provider_settings(config: Config) -> List[ProviderConfig]:
+    """The configured providers in the order to try them. Without any, the OpenAI
+    settings from before providers existed are used."""
+    if config["providers"]:
+        return [
+            cast(ProviderConfig, {**PROVIDER_DEFAULTS, **settings})
+            for settings in config["providers"]
+        ]
+    return [ProviderConfig(
+        name="OpenAI",
+        url=config["openai_api_url"],
+        schema=SCHEMA_RESPONSES,
+        model=config["openai_model"],
+        api_key=config["openai_api_key"],
+        max_concurrent_requests=config["max_concurrent_requests"],
+    )]
+
+
+def primary_model(config: Config) -> str:
+    return provider_settings(config)[0]["model"]
+
+
+def with_model(config: Config, model: str) -> Config:
+    """A copy of `config` asking every provider for `model` instead, for comparing the
+    stories different models write."""
+    if model == primary_model(config):
+        return config
+    variant: Config = cast(Config, dict(config))
+    variant["openai_model"] = model
+    variant["providers"] = [
+        cast(ProviderConfig, {**settings, "model": model}) for settings in config["providers"]
+    ]
+    return variant
+
+
+def check_providers(config: Config) -> None:
+    """Raises if stories can't be generated with these settings."""
+    if not config["providers"] and not config["openai_api_key"]:
+        raise Exception(
+            "No API Key set for OpenAI, please add this key in this addon's config"
+        )
+    for settings in provider_settings(config) if config["providers"] else []:
+        for key in ("url", "model"):
+            if not settings.get(key):
+                raise Exception(f"Provider {settings['name']!r} needs a {key!r}")
+        if settings["schema"] not in (SCHEMA_RESPONSES, SCHEMA_CHAT):
+            raise Exception(
+                f"Unknown schema {settings['schema']!r} for provider {settings['name']!r},"
+                f" use {SCHEMA_RESPONSES!r} or {SCHEMA_CHAT!r}"
+            )
+
+
+# Providers are kept for as long as their settings don't change, so the concurrency
+# limits hold across every story being generated.
+providers_lock: Lock = Lock()
+known_providers: Dict[Tuple, Provider] = {}
+
+
+def get_providers(config: Config) -> List[Provider]:
+    providers: List[Provider] = []
+    with providers_lock:
+        for settings in provider_settings(config):
+            key: Tuple = tuple(sorted(settings.items()))
+            if key not in known_providers:
+                known_providers[key] = Provider(settings)
+            providers.append(known_providers[key])
+    return providers
+
+
+def complete_with_fallback(
+    providers: List[Provider],
+    prompt: str,
+    client: HttpClient,
+    on_delta: Union[Callable[[str], None], None] = None,
+    cancel: Union[CancelToken, None] = None,
+    on_usage: Union[Callable[[Usage], None], None] = None,
+    hedging: Union[HedgeSettings, None] = None,
+    on_hedge_usage: Union[Callable[[str, Usage], None], None] = None,
+) -> Tuple[Provider, str]:
+    """Tries each provider in turn until one answers, returning it with the response.
+
+    Falls back on errors a different server might not have, such as a local server
+    being offline, but not once any of a streamed response was shown, as the next
+    provider would write a different story. With `hedging`, a request to a provider
+    that is slower than usual is sent to it again, see `send_hedged`. The usage of any
+    copy whose answer wasn't used is passed to `on_hedge_usage` with the model."""
+    streamed: List[bool] = [False]
+
+    def track_delta(delta: str) -> None:
+        streamed[0] = True
+        if on_delta is not None:
+            on_delta(delta)
+
+    for i, provider in enumerate(providers):
+        try:
+            return provider, send_hedged(
+                lambda send_delta, send_cancel, send_usage: provider.complete(
+                    prompt, client, send_delta, send_cancel, send_usage),
+                latency_key(provider.model, prompt, on_delta is not None),
+                hedging,
+                track_delta if on_delta is not None else None,
+                cancel,
+                on_usage,
+                (lambda usage: on_hedge_usage(provider.model, usage))
+                if on_hedge_usage is not None else None,
+            )
+        except Cancelled:
+            raise
+        except Exception as exc:
+            last: bool = i == len(providers) - 1
+            if last or streamed[0] or (cancel is not None and cancel.cancelled):
+                raise
+            if isinstance(exc, BadRequestError) and exc.status != 404:
+                # The prompt itself was rejected, another server would likely do the same.
+                # A 404 is more likely a server that doesn't have the model or endpoint.
+                raise
+    raise Exception("No providers configured")
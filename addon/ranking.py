@@ -0,0 +1,149 @@
+from typing import Dict, List, Sequence, TypedDict, Union
+import time
+from anki.collection import Collection
+from anki.notes import NoteId
+from anki.utils import ids2str
+
+from .normalize import estimate_tokens
+from .vocab import NOTE_ID_BATCH_SIZE, VocabExtraction
+
+# How much each statistic counts towards a note's priority, the parts are each 0 to 1.
+LAPSE_WEIGHT = 0.4
+EASE_WEIGHT = 0.3
+INTERVAL_WEIGHT = 0.15
+STALENESS_WEIGHT = 0.15
+# Lapses at which a note counts as struggling as much as it can.
+MAX_LAPSES = 8
+DEFAULT_EASE = 2500
+MIN_EASE = 1300
+# Taken off the priority of a word used in every recent story, less for fewer.
+RECENT_WEIGHT = 0.5
+
+# What to do with words the deck's recent stories already used.
+RECENT_INCLUDE = "include"
+RECENT_DEPRIORITIZE = "deprioritize"
+RECENT_EXCLUDE = "exclude"
+
+
+class NoteStats(TypedDict):
+    lapses: int
+    # Lowest ease factor of the note's cards, in permille. 0 if none were reviewed.
+    ease: int
+    # Shortest interval of the note's cards, in days.
+    interval: int
+    # Time of the latest review of the note's cards in ms, 0 if never reviewed.
+    last_review: int
+
+
+def note_stats(col: Collection, note_ids: Sequence[NoteId]) -> Dict[NoteId, NoteStats]:
+    """Reads the review statistics of every given note, combining its cards, in one query
+    per batch of notes."""
+    stats: Dict[NoteId, NoteStats] = {}
+    unique_ids: List[NoteId] = list(dict.fromkeys(note_ids))
+    for start in range(0, len(unique_ids), NOTE_ID_BATCH_SIZE):
+        batch: Sequence[NoteId] = unique_ids[start:start + NOTE_ID_BATCH_SIZE]
+        for note_id, lapses, ease, interval, last_review in col.db.execute(
+            "select c.nid, sum(c.lapses), min(case when c.factor > 0 then c.factor end),"
+            " min(max(c.ivl, 0)), max((select max(r.id) from revlog r where r.cid = c.id))"
+            f" from cards c where c.nid in {ids2str(batch)} group by c.nid"
+        ):
+            stats[NoteId(note_id)] = NoteStats(
+                lapses=lapses or 0,
+                ease=ease or 0,
+                interval=interval or 0,
+                last_review=last_review or 0,
+            )
+    return stats
+
+
+def priority(stats: NoteStats, now: float) -> float:
+    """Higher for words the learner struggles with: many lapses, low ease, a short
+    interval, and a long time since the last review relative to that interval."""
+    lapses: float = min(stats["lapses"], MAX_LAPSES) / MAX_LAPSES
+    ease: float = 0.0
+    if stats["ease"]:
+        ease = (DEFAULT_EASE - stats["ease"]) / (DEFAULT_EASE - MIN_EASE)
+        ease = min(max(ease, 0.0), 1.0)
+    interval: float = 1 / (1 + stats["interval"] / 7)
+    staleness: float = 0.0
+    if stats["last_review"]:
+        days_since: float = max(now - stats["last_review"] / 1000, 0) / 86400
+        staleness = min(days_since / max(stats["interval"], 1), 2) / 2
+    return (
+        LAPSE_WEIGHT * lapses
+        + EASE_WEIGHT * ease
+        + INTERVAL_WEIGHT * interval
+        + STALENESS_WEIGHT * staleness
+    )
+
+
+def fits_budget(vocab: Sequence[str], max_words: int, token_budget: int) -> bool:
+    if max_words and len(vocab) > max_words:
+        return False
+    # Terms are listed one per line.
+    return not token_budget or estimate_tokens("\n".join(vocab)) <= token_budget
+
+
+def drop_recent(extraction: VocabExtraction, recent: Dict[str, int]) -> VocabExtraction:
+    """Leaves out the terms used by recent stories, unless that would leave nothing."""
+    kept: List[int] = [
+        i for i, term in enumerate(extraction["vocab"]) if term.casefold() not in recent]
+    if not kept or len(kept) == len(extraction["vocab"]):
+        return extraction
+    return VocabExtraction(
+        vocab=[extraction["vocab"][i] for i in kept],
+        note_ids=[extraction["note_ids"][i] for i in kept],
+        unknown_note_types=extraction["unknown_note_types"],
+        tokens_saved=extraction["tokens_saved"],
+    )
+
+
+def select_vocab(
+    col: Collection,
+    extraction: VocabExtraction,
+    max_words: int,
+    token_budget: int,
+    recent: Union[Dict[str, int], None] = None,
+    recent_stories: int = 0,
+) -> VocabExtraction:
+    """Keeps the highest priority terms that fit in `max_words` and `token_budget`, 0 for
+    no limit, in their original order. Returns `extraction` as is when it already fits.
+
+    `recent` is how many of the last `recent_stories` stories used each casefolded term,
+    those terms are ranked lower the more stories used them."""
+    vocab: List[str] = extraction["vocab"]
+    if fits_budget(vocab, max_words, token_budget):
+        return extraction
+
+    note_ids: List[NoteId] = extraction["note_ids"]
+    stats: Dict[NoteId, NoteStats] = note_stats(col, note_ids)
+    now: float = time.time()
+    scores: List[float] = [
+        priority(stats[note_id], now) if note_id in stats else 0.0 for note_id in note_ids
+    ]
+    if recent and recent_stories:
+        for i, term in enumerate(vocab):
+            uses: int = recent.get(term.casefold(), 0)
+            scores[i] -= RECENT_WEIGHT * min(uses / recent_stories, 1)
+    # Sorting is stable, so ties keep the order of the search.
+    ranked: List[int] = sorted(range(len(vocab)), key=lambda i: -scores[i])
+
+    chosen: List[int] = []
+    tokens: int = 0
+    for i in ranked:
+        if max_words and len(chosen) >= max_words:
+            break
+        cost: int = estimate_tokens(vocab[i]) + 1
+        if token_budget and tokens + cost > token_budget:
+            # A shorter term further down might still fit.
+            continue
+        chosen.append(i)
+        tokens += cost
+    chosen.sort()
+
+    return VocabExtraction(
+        vocab=[vocab[i] for i in chosen],
+        note_ids=[note_ids[i] for i in chosen],
+        unknown_note_types=extraction["unknown_note_types"],
+        tokens_saved=extraction["tokens_saved"],
+    )
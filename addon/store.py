@@ -0,0 +1,354 @@
+from typing import Dict, List, Sequence, TypedDict, Union, cast
+from threading import Lock
+import re
+import sqlite3
+import time
+
+SCHEMA = """
+create table if not exists stories (
+    id integer primary key,
+    -- Deck name, or the collection path for stories made from the whole collection.
+    deck text not null,
+    created real not null,
+    model text not null default '',
+    prompt text not null default '',
+    theme text not null default '',
+    lang text not null default '',
+    vocab_query text not null default '',
+    story text not null
+);
+create index if not exists stories_deck_created on stories (deck, created);
+-- The vocab each story was asked to use, to find the words recent stories covered.
+create table if not exists story_vocab (
+    story_id integer not null references stories (id),
+    -- Casefolded, so the same word is matched however it was written.
+    term text not null,
+    primary key (story_id, term)
+) without rowid;
+create trigger if not exists story_vocab_delete after delete on stories begin
+    delete from story_vocab where story_id = old.id;
+end;
+create table if not exists meta (
+    key text primary key,
+    value text not null
+);
+"""
+
+# Full-text index of the stories. The trigram tokenizer matches any substring of three or
+# more characters, so it works for languages without spaces between words, like Japanese.
+# It indexes the stories table rather than keeping its own copy of every story. Only the
+# text is indexed, so a term in a deck name or theme doesn't match stories without it.
+FTS_COLUMNS = ["story"]
+FTS_SCHEMA = """
+create virtual table if not exists stories_fts using fts5(
+    story, content='stories', content_rowid='id', tokenize='trigram'
+);
+create trigger if not exists stories_fts_insert after insert on stories begin
+    insert into stories_fts (rowid, story) values (new.id, new.story);
+end;
+create trigger if not exists stories_fts_delete after delete on stories begin
+    insert into stories_fts (stories_fts, rowid, story) values ('delete', old.id, old.story);
+end;
+create trigger if not exists stories_fts_update after update of story on stories begin
+    insert into stories_fts (stories_fts, rowid, story) values ('delete', old.id, old.story);
+    insert into stories_fts (rowid, story) values (new.id, new.story);
+end;
+"""
+# For indexes built with other columns, which are then built again.
+DROP_FTS = """
+drop trigger if exists stories_fts_insert;
+drop trigger if exists stories_fts_delete;
+drop trigger if exists stories_fts_update;
+drop table if exists stories_fts;
+delete from meta where key = 'built_stories_fts';
+"""
+# The trigram tokenizer can't match anything shorter.
+MIN_INDEXED_TERM = 3
+# Characters of context either side of a match shown in search results.
+SNIPPET_CONTEXT = 16
+MAX_SEARCH_RESULTS = 100
+LIKE_SPECIAL = re.compile(r"[%_\\]")
+
+
+class StoryMetadata(TypedDict, total=False):
+    model: str
+    prompt: str
+    theme: str
+    lang: str
+    vocab_query: str
+
+
+# Characters of a story shown when picking from the history.
+PREVIEW_LENGTH = 48
+
+
+class StoryPreview(TypedDict):
+    id: int
+    created: float
+    preview: str
+
+
+class SearchResult(TypedDict):
+    id: int
+    deck: str
+    created: float
+    # The part of the story around the first match.
+    snippet: str
+
+
+class StoryRecord(TypedDict):
+    id: int
+    deck: str
+    created: float
+    model: str
+    prompt: str
+    theme: str
+    lang: str
+    vocab_query: str
+    story: str
+
+
+class StoryStore:
+    """Story history, kept in SQLite rather than the add-on config so that reading the
+    config doesn't pull every story into memory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock: Lock = Lock()
+        # Stories are saved from background operations as well as the main thread.
+        self.db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+        self.full_text: bool = self.create_full_text_index()
+
+    def create_full_text_index(self) -> bool:
+        """Returns False if SQLite was built without FTS5, searches then scan every
+        story instead."""
+        try:
+            with self.lock, self.db:
+                columns: List[str] = [
+                    row[1] for row in self.db.execute("pragma table_info(stories_fts)")]
+                if columns and columns != FTS_COLUMNS:
+                    self.db.executescript(DROP_FTS)
+                self.db.executescript(FTS_SCHEMA)
+                if not self.db.execute(
+                    "select 1 from meta where key = 'built_stories_fts'"
+                ).fetchone():
+                    # Index the stories saved before the index existed.
+                    self.db.execute("insert into stories_fts (stories_fts) values ('rebuild')")
+                    self.db.execute(
+                        "insert into meta (key, value) values ('built_stories_fts', ?)",
+                        (str(time.time()),),
+                    )
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    def add_story(
+        self,
+        deck: str,
+        story: str,
+        metadata: Union[StoryMetadata, None] = None,
+        created: Union[float, None] = None,
+        vocab: Sequence[str] = (),
+    ) -> int:
+        """Saves the story, along with the `vocab` it was asked to use."""
+        metadata = metadata or StoryMetadata()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "insert into stories (deck, created, model, prompt, theme, lang, vocab_query, story)"
+                " values (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    deck,
+                    time.time() if created is None else created,
+                    metadata.get("model", ""),
+                    metadata.get("prompt", ""),
+                    metadata.get("theme", ""),
+                    metadata.get("lang", ""),
+                    metadata.get("vocab_query", ""),
+                    story,
+                ),
+            )
+            story_id: int = cast(int, cursor.lastrowid)
+            self.db.executemany(
+                "insert or ignore into story_vocab (story_id, term) values (?, ?)",
+                [(story_id, term.casefold()) for term in vocab],
+            )
+            return story_id
+
+    def recent_vocab(self, deck: str, stories: int) -> Dict[str, int]:
+        """How many of the deck's last `stories` stories each term was used in, keyed by
+        the casefolded term."""
+        if stories <= 0:
+            return {}
+        with self.lock:
+            rows = self.db.execute(
+                "select term, count() from story_vocab where story_id in"
+                " (select id from stories where deck = ? order by created desc, id desc limit ?)"
+                " group by term",
+                (deck, stories),
+            ).fetchall()
+        return {term: uses for term, uses in rows}
+
+    def stories(self, deck: str) -> List[StoryRecord]:
+        """Returns the deck's stories, oldest first."""
+        with self.lock:
+            rows = self.db.execute(
+                "select * from stories where deck = ? order by created, id", (deck,)
+            ).fetchall()
+        return [row_to_record(row) for row in rows]
+
+    def previews(self, deck: str) -> List[StoryPreview]:
+        """Returns the start of each of the deck's stories, oldest first, without reading
+        the full text."""
+        with self.lock:
+            rows = self.db.execute(
+                "select id, created, substr(story, 1, ?) from stories where deck = ?"
+                " order by created, id",
+                (PREVIEW_LENGTH, deck),
+            ).fetchall()
+        return [StoryPreview(id=row[0], created=row[1], preview=row[2]) for row in rows]
+
+    def story(self, story_id: int) -> Union[str, None]:
+        with self.lock:
+            row = self.db.execute(
+                "select story from stories where id = ?", (story_id,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, story_id: int) -> Union[StoryRecord, None]:
+        with self.lock:
+            row = self.db.execute(
+                "select * from stories where id = ?", (story_id,)).fetchone()
+        return row_to_record(row) if row else None
+
+    def story_vocab(self, story_id: int) -> List[str]:
+        """The casefolded vocab the story was asked to use, empty for stories saved
+        before it was recorded."""
+        with self.lock:
+            rows = self.db.execute(
+                "select term from story_vocab where story_id = ?", (story_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def append_to_story(self, story_id: int, text: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "update stories set story = story || ? where id = ?", (text, story_id))
+
+    def count(self, deck: str) -> int:
+        with self.lock:
+            return self.db.execute(
+                "select count() from stories where deck = ?", (deck,)).fetchone()[0]
+
+    def trim(self, deck: str, keep: int) -> None:
+        """Deletes all but the newest `keep` stories for the deck, 0 keeps them all."""
+        if keep <= 0:
+            return
+        with self.lock, self.db:
+            self.db.execute(
+                "delete from stories where deck = ? and id not in"
+                " (select id from stories where deck = ? order by created desc, id desc limit ?)",
+                (deck, deck, keep),
+            )
+
+    def search(
+        self, text: str, deck: Union[str, None] = None, limit: int = MAX_SEARCH_RESULTS
+    ) -> List[SearchResult]:
+        """Finds the stories containing every space separated term of `text`, in any
+        deck unless `deck` is given. Results are ranked by relevance when the index can
+        be used, otherwise newest first."""
+        terms: List[str] = list(dict.fromkeys(text.split()))
+        if not terms:
+            return []
+        indexed: List[str] = [term for term in terms if len(term) >= MIN_INDEXED_TERM]
+        # Terms the index can't match are checked against the story text instead, which
+        # is only slow when no term narrows the search down first.
+        unindexed: List[str] = terms if not self.full_text else [
+            term for term in terms if len(term) < MIN_INDEXED_TERM]
+
+        conditions: List[str] = []
+        args: List[Union[str, int]] = []
+        if self.full_text and indexed:
+            conditions.append("stories_fts match ?")
+            # Quoted, so the terms are matched literally rather than as query syntax.
+            args.append(" ".join('"' + term.replace('"', '""') + '"' for term in indexed))
+        for term in unindexed:
+            # Like the index, `like` ignores case for ASCII letters.
+            conditions.append("s.story like ? escape '\\'")
+            args.append("%" + LIKE_SPECIAL.sub(r"\\\g<0>", term) + "%")
+        if deck is not None:
+            conditions.append("s.deck = ?")
+            args.append(deck)
+        args.append(limit)
+        where: str = " and ".join(conditions)
+
+        with self.lock:
+            if self.full_text and indexed:
+                rows = self.db.execute(
+                    "select s.id, s.deck, s.created, s.story from stories_fts"
+                    " join stories s on s.id = stories_fts.rowid"
+                    f" where {where} order by bm25(stories_fts) limit ?",
+                    args,
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "select s.id, s.deck, s.created, s.story from stories s"
+                    # By ID rather than time, so the scan can stop at the limit.
+                    f" where {where} order by s.id desc limit ?",
+                    args,
+                ).fetchall()
+        return [
+            SearchResult(id=row[0], deck=row[1], created=row[2], snippet=snippet(row[3], terms))
+            for row in rows
+        ]
+
+    def migrate_previous_stories(self, previous_stories: Dict[str, List[str]]) -> bool:
+        """Imports the stories that used to be kept in the config. Returns False if they
+        were already imported by an earlier run, in which case nothing is added."""
+        with self.lock, self.db:
+            if self.db.execute(
+                "select 1 from meta where key = 'migrated_previous_stories'"
+            ).fetchone():
+                return False
+            # The config had no timestamps, keep the stories in their original order.
+            created: float = time.time() - sum(map(len, previous_stories.values()))
+            for deck, stories in previous_stories.items():
+                for story in stories:
+                    self.db.execute(
+                        "insert into stories (deck, created, story) values (?, ?, ?)",
+                        (deck, created, story),
+                    )
+                    created += 1
+            self.db.execute(
+                "insert into meta (key, value) values ('migrated_previous_stories', ?)",
+                (str(time.time()),),
+            )
+        return True
+
+
+def snippet(story: str, terms: List[str]) -> str:
+    lowered: str = story.lower()
+    found: List[int] = [
+        i for i in (lowered.find(term.lower()) for term in terms) if i >= 0]
+    start: int = max(min(found, default=0) - SNIPPET_CONTEXT, 0)
+    end: int = min(start + 2 * SNIPPET_CONTEXT + max(map(len, terms)), len(story))
+    text: str = " ".join(story[start:end].split())
+    return ("..." if start > 0 else "") + text + ("..." if end < len(story) else "")
+
+
+def row_to_record(row: sqlite3.Row) -> StoryRecord:
+    return StoryRecord(
+        id=row["id"],
+        deck=row["deck"],
+        created=row["created"],
+        model=row["model"],
+        prompt=row["prompt"],
+        theme=row["theme"],
+        lang=row["lang"],
+        vocab_query=row["vocab_query"],
+        story=row["story"],
+    )
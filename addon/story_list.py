@@ -0,0 +1,44 @@
+from typing import List, Tuple, Union
+from aqt.qt.qt6 import QAbstractListModel, QModelIndex, Qt
+
+from .store import StoryPreview
+
+# Kept out of ui.py so it can be used without the rest of the GUI, by the benchmarks.
+
+
+class StoryListModel(QAbstractListModel):
+    """Story history for the story view's combo box. Only the previews are kept, full
+    stories are read from the store when they are selected."""
+
+    def __init__(self, previews: List[StoryPreview]):
+        super().__init__()
+        # Story ID and preview. A story that is still being generated has no ID yet.
+        self.rows: List[Tuple[Union[int, None], str]] = [
+            (preview["id"], preview["preview"]) for preview in previews
+        ]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        story_id, preview = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return preview + '...'
+        if role == Qt.ItemDataRole.UserRole:
+            return story_id
+        return None
+
+    def append_pending(self) -> None:
+        self.append_story(None, "")
+
+    def append_story(self, story_id: Union[int, None], preview: str) -> None:
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows))
+        self.rows.append((story_id, preview))
+        self.endInsertRows()
+
+    def set_row(self, row: int, story_id: Union[int, None], preview: str) -> None:
+        self.rows[row] = (story_id, preview)
+        index: QModelIndex = self.index(row)
+        self.dataChanged.emit(index, index)
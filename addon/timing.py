@@ -0,0 +1,202 @@
+from typing import Callable, Deque, Dict, Iterator, List, Tuple, TypedDict, TypeVar, Union
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+
+# Number of recent timings per phase used for the percentiles.
+WINDOW_SIZE = 200
+MAX_LOG_BYTES = 1024 * 1024
+PERCENTILES = (50, 90, 99)
+
+
+class Span(TypedDict):
+    name: str
+    # Seconds since the start of the trace.
+    start: float
+    duration: float
+
+
+class Trace:
+    """Timings for a single story generation. Spans can be recorded from any thread, so
+    the same trace follows the work from the dialog to the background operations."""
+
+    def __init__(self, name: str = "story"):
+        self.name = name
+        self.started: float = time.time()
+        self.origin: float = time.perf_counter()
+        self.spans: List[Span] = []
+        self.lock: Lock = Lock()
+        self.profile: Union[cProfile.Profile, None] = None
+        # Other numbers worth keeping about the run, such as tokens saved.
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def record(self, name: str, start: float) -> None:
+        """Records a span from `start`, a `time.perf_counter()` value, until now."""
+        end: float = time.perf_counter()
+        with self.lock:
+            self.spans.append(
+                Span(name=name, start=start - self.origin, duration=end - start))
+
+    def count(self, name: str, value: int) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def profiled(self) -> Iterator[None]:
+        """Profiles the wrapped code if profiling was requested for this trace. cProfile
+        only sees the thread it was enabled on, so this wraps the background work."""
+        if self.profile is None:
+            yield
+            return
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        with self.lock:
+            for span in self.spans:
+                totals[span["name"]] = totals.get(span["name"], 0) + span["duration"]
+        return totals
+
+
+T = TypeVar("T")
+
+
+def span(trace: Union[Trace, None], name: str):
+    return trace.span(name) if trace is not None else nullcontext()
+
+
+def run_profiled(trace: Union[Trace, None], fn: Callable[[], T]) -> T:
+    if trace is None:
+        return fn()
+    with trace.profiled():
+        return fn()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered: List[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class PhaseStats(TypedDict):
+    last: float
+    count: int
+    percentiles: Dict[int, float]
+
+
+class Tracer:
+    """Collects finished traces, appending them to a log file and keeping a rolling
+    window of timings for each phase."""
+
+    def __init__(self, log_path: str, profile_dir: str):
+        self.log_path = log_path
+        self.profile_dir = profile_dir
+        self.lock: Lock = Lock()
+        self.windows: Dict[str, Deque[float]] = {}
+        self.profile_next: bool = False
+        self.last_profile: Union[str, None] = None
+        self.last_counters: Dict[str, int] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Seeds the windows from the log, so percentiles survive restarts."""
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                lines: List[str] = f.readlines()[-WINDOW_SIZE:]
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry: Dict = json.loads(line)
+            except ValueError:
+                continue
+            self.record(entry.get("phases", {}))
+
+    def record(self, totals: Dict[str, float]) -> None:
+        with self.lock:
+            for name, duration in totals.items():
+                if name not in self.windows:
+                    self.windows[name] = deque(maxlen=WINDOW_SIZE)
+                self.windows[name].append(duration)
+
+    def start(self, name: str = "story") -> Trace:
+        trace: Trace = Trace(name)
+        if self.profile_next:
+            # Only profile a single run.
+            self.profile_next = False
+            trace.profile = cProfile.Profile()
+        return trace
+
+    def finish(self, trace: Trace) -> None:
+        totals: Dict[str, float] = trace.totals()
+        totals["total"] = time.perf_counter() - trace.origin
+        self.record(totals)
+        self.last_counters = dict(trace.counters)
+        entry: Dict = dict(
+            name=trace.name,
+            started=trace.started,
+            phases=totals,
+            spans=trace.spans,
+            counters=self.last_counters,
+        )
+        self.write(entry)
+        if trace.profile is not None:
+            self.save_profile(trace)
+
+    def record_startup(self, phases: Dict[str, float]) -> None:
+        """Logs how long the add-on took to load, measured outside of any trace."""
+        self.record(phases)
+        self.write(dict(name="startup", started=time.time(), phases=phases))
+
+    def write(self, entry: Dict) -> None:
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with self.lock:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > MAX_LOG_BYTES:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def save_profile(self, trace: Trace) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp: str = time.strftime("%Y%m%d-%H%M%S", time.localtime(trace.started))
+        path: str = os.path.join(self.profile_dir, f"{trace.name}-{stamp}")
+        assert trace.profile is not None
+        trace.profile.dump_stats(path + ".prof")
+        # A readable summary next to the raw stats, which need pstats or snakeviz to view.
+        out: io.StringIO = io.StringIO()
+        pstats.Stats(trace.profile, stream=out).sort_stats("cumulative").print_stats(40)
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        self.last_profile = path + ".txt"
+
+    def stats(self) -> Dict[str, PhaseStats]:
+        with self.lock:
+            windows: List[Tuple[str, List[float]]] = [
+                (name, list(window)) for name, window in self.windows.items()
+            ]
+        return {
+            name: PhaseStats(
+                last=values[-1],
+                count=len(values),
+                percentiles={pct: percentile(values, pct) for pct in PERCENTILES},
+            )
+            for name, values in windows
+            if values
+        }
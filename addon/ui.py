@@ -0,0 +1,1971 @@
+from typing import Callable, List, Union, Dict, TypedDict, cast, Callable, Set, Sequence, Tuple
+from concurrent.futures import Future
+import itertools
+import os
+import time
+import aqt
+from aqt import mw
+import aqt.gui_hooks
+from aqt.utils import showInfo, tooltip
+from aqt.operations import QueryOp
+from aqt.addcards import AddCards
+from aqt.editor import Editor
+from aqt.reviewer import Reviewer
+from aqt.qt.qt6 import (
+    QDialog,
+    QComboBox,
+    QPushButton,
+    QFormLayout,
+    QLabel,
+    QLineEdit,
+    QPlainTextEdit,
+    QHBoxLayout,
+    pyqtSignal,
+    QObject,
+    QApplication,
+    QVBoxLayout,
+    QWidget,
+    QFont,
+    QCloseEvent,
+    QIcon,
+    QFontDatabase,
+    QCheckBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QListWidget,
+    QListWidgetItem,
+    Qt,
+    QTextEdit,
+    QTextCharFormat,
+    QTextCursor,
+    QColor,
+    sip,
+)
+import anki.hooks
+from anki.cards import Card
+from anki.collection import Collection, OpChanges
+from anki.decks import DeckId, DeckDict
+from anki.notes import NoteId
+
+from . import generate
+from .cache import ResponseCache, cache_key
+from .coverage import Coverage, check_coverage
+from .client import HttpClient
+from .chunks import PART_SEPARATOR
+from .config import USER_FILES_DIR, Config, ConfigService, Preset, write_json_atomic
+from .generate import (
+    SCOPE_ALL, SCOPE_DECK, SCOPE_SUBDECKS, batch_deck_names, generate_story,
+    generate_supplement)
+from .hedging import latency_histogram
+from .jobs import JOB_CANCELLED, JOB_DONE, JOB_FAILED, CancelToken, Job, JobManager
+from .metrics import (
+    GROUP_BY_DAY, GROUP_BY_DECK, GROUP_BY_MODEL, GROUP_BY_PROMPT, GROUP_BY_QUERY,
+    GROUP_BY_THEME, MetricsStore, RequestLabels, RequestMetrics, UsageSummary,
+    request_labels)
+from .store import (
+    PREVIEW_LENGTH, SearchResult, StoryMetadata, StoryRecord, StoryStore)
+from .story_list import StoryListModel
+from .timing import PERCENTILES, PhaseStats, Trace, Tracer, run_profiled, span
+from .normalize import VocabCleaner
+from .providers import primary_model, with_model
+from .ranking import RECENT_DEPRIORITIZE, RECENT_EXCLUDE, RECENT_INCLUDE
+from .vocab import VocabExtraction
+from .vocab_index import VocabIndex
+
+# Reading the installed fonts can be slow, so it is only done once.
+font_families: List[str] = []
+
+
+def load_font_families(on_loaded: Callable[[List[str]], None]) -> None:
+    if font_families:
+        on_loaded(font_families)
+        return
+
+    def on_done(future: Future) -> None:
+        if not font_families:
+            font_families.extend(future.result())
+        on_loaded(font_families)
+
+    mw.taskman.run_in_background(
+        QFontDatabase.families, on_done, uses_collection=False)
+
+
+class StoryView(QWidget):
+    def __init__(self, deck_name: str, font_size_idx: int = 4, streaming: bool = False):
+        super().__init__()
+        config: Config = get_config()
+        self.store: StoryStore = get_story_store()
+        self.font_sizes = QFontDatabase.standardSizes()
+        self.font_size_idx = font_size_idx
+        self.story_font: QFont = QFont()
+        self.story_font.setPointSize(self.font_sizes[font_size_idx])
+        # Text of the story being streamed in, if any.
+        self.streamed_text: str = ""
+        # The saved story shown, and the words it was asked to use but doesn't.
+        self.shown_story_id: Union[int, None] = None
+        self.missing_terms: List[str] = []
+        self.variants_added: int = 0
+
+        layout: QVBoxLayout = QVBoxLayout()
+        font_row_layout: QHBoxLayout = QHBoxLayout()
+
+        # Text view
+        text_view: QPlainTextEdit = QPlainTextEdit()
+        text_view.setReadOnly(True)
+        self.text_view = text_view
+
+        # Coverage of the story's vocab
+        coverage_row_layout: QHBoxLayout = QHBoxLayout()
+        self.coverage_label: QLabel = QLabel()
+        self.coverage_label.setWordWrap(True)
+        coverage_row_layout.addWidget(self.coverage_label, stretch=1)
+        self.supplement_button: QPushButton = QPushButton("Add the Missing Words")
+        self.supplement_button.setToolTip(
+            "Ask for a short continuation of the story using only the words it left out"
+        )
+        self.supplement_button.clicked.connect(self.supplement_on_click)
+        coverage_row_layout.addWidget(self.supplement_button)
+        self.coverage_label.hide()
+        self.supplement_button.hide()
+
+        # Combo box
+        self.story_model: StoryListModel = StoryListModel(self.store.previews(deck_name))
+        if streaming:
+            self.story_model.append_pending()
+        story_select: QComboBox = QComboBox()
+        story_select.setModel(self.story_model)
+        story_select.view().setUniformItemSizes(True)
+        self.story_select = story_select
+        story_select.setCurrentIndex(self.story_model.rowCount() - 1)
+        story_select.currentIndexChanged.connect(self.story_select_on_change)
+        self.story_select_on_change()
+
+        # Search
+        self.deck_name = deck_name
+        search_row_layout: QHBoxLayout = QHBoxLayout()
+        self.search_box: QLineEdit = QLineEdit()
+        self.search_box.setPlaceholderText("Search stories")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.search)
+        search_row_layout.addWidget(self.search_box)
+        self.search_all_checkbox: QCheckBox = QCheckBox("All decks")
+        self.search_all_checkbox.setChecked(True)
+        self.search_all_checkbox.toggled.connect(self.search)
+        search_row_layout.addWidget(self.search_all_checkbox)
+        self.search_results: QListWidget = QListWidget()
+        self.search_results.setUniformItemSizes(True)
+        self.search_results.currentItemChanged.connect(self.search_result_on_change)
+        self.search_results.hide()
+
+        # Font Box
+        curr_font: str = self.text_view.fontInfo().family()
+        if config['story_font_family'] == '':
+            config['story_font_family'] = curr_font
+            save_config(config)
+        else:
+            curr_font = config['story_font_family']
+
+        # Only the current font is listed until the rest have been loaded.
+        font_select: QComboBox = QComboBox()
+        font_select.addItem(curr_font)
+        font_row_layout.addWidget(font_select)
+        font_select.currentIndexChanged.connect(self.font_select_on_change)
+        self.font_select = font_select
+
+        self.story_font.setFamily(curr_font)
+        self.text_view.setFont(self.story_font)
+        load_font_families(self.on_font_families_loaded)
+
+        # Copy to clipboard button
+        copy_button: QPushButton = QPushButton()
+        copy_button.setText("Copy to clipboard")
+        copy_button.clicked.connect(self.copy_to_clipboard_on_click)
+
+        # Font size buttons
+        for (change, icon) in [(-1, QIcon.ThemeIcon.ListRemove), (1, QIcon.ThemeIcon.ListAdd)]:
+            font_size_button: QPushButton = QPushButton()
+            font_size_button.setIcon(QIcon.fromTheme(icon))
+            font_size_button.clicked.connect(
+                self.font_size_on_click_factory(change))
+            font_row_layout.addWidget(font_size_button)
+
+        # Layout
+        layout.addLayout(search_row_layout)
+        layout.addWidget(self.search_results)
+        layout.addWidget(story_select)
+        layout.addLayout(font_row_layout)
+        layout.addWidget(text_view)
+        layout.addLayout(coverage_row_layout)
+        layout.addWidget(copy_button)
+
+        self.setLayout(layout)
+
+        self.setWindowTitle("Anki Storytime")
+        self.resize(800, 600)
+        self.text_view = text_view
+
+    def copy_to_clipboard_on_click(self) -> None:
+        app: QApplication = mw.app
+        clipboard_success: bool = False
+        clipboard = app.clipboard()
+        if clipboard is not None:
+            clipboard.setText(self.text_view.toPlainText())
+            clipboard_success = True
+
+        if not clipboard_success:
+            raise Exception("Failed to copy to clipboard")
+
+    def story_select_on_change(self):
+        story_id: Union[int, None] = self.story_select.currentData()
+        if story_id is None:
+            # The story that is still being streamed in.
+            self.text_view.setPlainText(self.streamed_text)
+        else:
+            self.text_view.setPlainText(self.store.story(story_id) or "")
+        self.show_coverage(story_id)
+
+    def search(self) -> None:
+        text: str = self.search_box.text()
+        deck: Union[str, None] = None if self.search_all_checkbox.isChecked() else self.deck_name
+        results: List[SearchResult] = self.store.search(text, deck)
+        self.search_results.blockSignals(True)
+        self.search_results.clear()
+        for result in results:
+            created: str = time.strftime("%Y-%m-%d", time.localtime(result["created"]))
+            item: QListWidgetItem = QListWidgetItem(
+                f"{result['deck']} ({created}): {result['snippet']}")
+            item.setData(Qt.ItemDataRole.UserRole, result["id"])
+            self.search_results.addItem(item)
+        self.search_results.blockSignals(False)
+        self.search_results.setVisible(bool(text.strip()))
+
+    def search_result_on_change(self, item: Union[QListWidgetItem, None]) -> None:
+        if item is not None:
+            story_id: int = item.data(Qt.ItemDataRole.UserRole)
+            self.text_view.setPlainText(self.store.story(story_id) or "")
+            self.show_coverage(story_id)
+
+    def show_coverage(self, story_id: Union[int, None]) -> None:
+        """Highlights the words the shown story was asked to use, and lists the ones it
+        left out."""
+        self.shown_story_id = story_id
+        vocab: List[str] = self.store.story_vocab(story_id) if story_id is not None else []
+        if not vocab:
+            # Still being streamed, or saved before its vocab was.
+            self.missing_terms = []
+            self.text_view.setExtraSelections([])
+            self.coverage_label.hide()
+            self.supplement_button.hide()
+            return
+        story: str = self.text_view.toPlainText()
+        coverage: Coverage = check_coverage(story, vocab)
+        self.text_view.setExtraSelections(
+            highlight_selections(self.text_view, story, coverage["spans"]))
+        self.missing_terms = coverage["missing"]
+        text: str = f"Uses {len(coverage['found'])} of {len(vocab)} words"
+        if self.missing_terms:
+            text += ", missing: " + ", ".join(self.missing_terms)
+        self.coverage_label.setText(text)
+        self.coverage_label.show()
+        self.supplement_button.setVisible(bool(self.missing_terms))
+        self.supplement_button.setDisabled(False)
+
+    def supplement_on_click(self) -> None:
+        if self.shown_story_id is None or not self.missing_terms:
+            return
+        self.supplement_button.setDisabled(True)
+        submit_supplement_job(self.shown_story_id, self.missing_terms, self)
+        tooltip("Asking for the missing words in the background")
+
+    def reload_story(self, story_id: int) -> None:
+        if self.shown_story_id == story_id:
+            self.text_view.setPlainText(self.store.story(story_id) or "")
+            self.show_coverage(story_id)
+
+    def on_font_families_loaded(self, families: List[str]) -> None:
+        if sip.isdeleted(self):
+            return
+        config: Config = get_config()
+        curr_font: str = self.font_select.currentText()
+        # Filling the combo box shouldn't count as picking a font.
+        self.font_select.blockSignals(True)
+        self.font_select.clear()
+        self.font_select.addItems(families)
+        self.font_select.setCurrentText(curr_font)
+        self.font_select.blockSignals(False)
+
+        if curr_font not in families:
+            # The font from the config was not found.
+            # Reset config back to empty string, and show error
+            showInfo(
+                f"An error occured loading the font '{curr_font}' from config, falling back to Anki default.")
+            self.text_view.setFont(QFont())
+            config['story_font_family'] = ''
+            save_config(config)
+
+    def append_streamed_text(self, delta: str) -> None:
+        # The story being streamed is always the last one.
+        last_idx: int = self.story_model.rowCount() - 1
+        self.streamed_text += delta
+        self.story_model.set_row(last_idx, None, self.streamed_text[0:PREVIEW_LENGTH])
+        if self.story_select.currentIndex() == last_idx:
+            # Append rather than resetting the text so the cursor and scroll stay put.
+            cursor = self.text_view.textCursor()
+            cursor.movePosition(cursor.MoveOperation.End)
+            cursor.insertText(delta)
+
+    def add_variant(self, story: str, story_id: int, label: str) -> None:
+        """Lists a finished variant, labelled with what sets it apart. Only the first is
+        shown right away, so reading it isn't interrupted by the rest."""
+        self.story_model.append_story(story_id, f"{label}: {story[0:PREVIEW_LENGTH]}")
+        if self.variants_added == 0:
+            self.story_select.setCurrentIndex(self.story_model.rowCount() - 1)
+        self.variants_added += 1
+
+    def finish_stream(self, story: str, story_id: int) -> None:
+        last_idx: int = self.story_model.rowCount() - 1
+        self.streamed_text = story
+        self.story_model.set_row(last_idx, story_id, story[0:PREVIEW_LENGTH])
+        if self.story_select.currentIndex() == last_idx:
+            if self.text_view.toPlainText() != story:
+                self.text_view.setPlainText(story)
+            self.show_coverage(story_id)
+
+    def closeEvent(self, a0: QCloseEvent | None):
+        config: Config = get_config()
+
+        if config['story_font_size_idx'] != self.font_size_idx:
+            # Update the font size so that it may persist
+            config['story_font_size_idx'] = self.font_size_idx
+            save_config(config)
+        get_config_service().flush()
+
+        if a0:
+            a0.accept()
+
+    def font_size_on_click_factory(self, change: int):
+        def font_size_on_click():
+            new_font_size_idx: int = self.font_size_idx + change
+
+            if new_font_size_idx < 0:
+                new_font_size_idx = 0
+            if new_font_size_idx >= len(self.font_sizes):
+                new_font_size_idx = len(self.font_sizes) - 1
+
+            self.font_size_idx = new_font_size_idx
+            self.story_font.setPointSize(self.font_sizes[self.font_size_idx])
+
+            self.text_view.setFont(self.story_font)
+        return font_size_on_click
+
+    def font_select_on_change(self):
+        curr_font: str = self.font_select.currentText()
+        self.story_font.setFamily(curr_font)
+        self.text_view.setFont(self.story_font)
+        config = get_config()
+        if config['story_font_family'] != curr_font:
+            config['story_font_family'] = curr_font
+            save_config(config)
+
+
+def highlight_selections(
+    text_view: QPlainTextEdit, text: str, spans: List[Tuple[int, int]]
+) -> List[QTextEdit.ExtraSelection]:
+    highlight: QTextCharFormat = QTextCharFormat()
+    # Translucent, so it works with light and dark themes alike.
+    highlight.setBackground(QColor(255, 200, 0, 90))
+    # Qt counts UTF-16 code units, so characters outside the BMP, such as emoji, count
+    # twice.
+    positions: List[int] = list(itertools.accumulate(
+        (2 if ord(c) > 0xFFFF else 1 for c in text), initial=0))
+    selections: List[QTextEdit.ExtraSelection] = []
+    for start, end in spans:
+        selection: QTextEdit.ExtraSelection = QTextEdit.ExtraSelection()
+        cursor: QTextCursor = QTextCursor(text_view.document())
+        cursor.setPosition(positions[start])
+        cursor.setPosition(positions[end], QTextCursor.MoveMode.KeepAnchor)
+        selection.cursor = cursor
+        selection.format = highlight
+        selections.append(selection)
+    return selections
+
+
+class NoteTypeForm(QDialog):
+    def __init__(self, new_notes: Dict[str, List[str]]):
+        super().__init__()
+        layout: QFormLayout = QFormLayout()
+        layout.setRowWrapPolicy(QFormLayout.RowWrapPolicy.WrapLongRows)
+        header_label: QLabel = QLabel(
+            "The following are note types that have yet to have the correct field specified for use in this addon. Please use the dropdowns to select the field with your Japanese vocab."
+        )
+        header_label.setWordWrap(True)
+        layout.addRow(header_label)
+        self.note_selects: Dict[str, QComboBox] = {}
+        fields: List[str]
+        for name, fields in new_notes.items():
+            select: QComboBox = QComboBox()
+            select.addItems([value[0:32] for value in fields])
+            self.note_selects[name] = select
+            layout.addRow(QLabel(name), select)
+
+        self.finished_button: QPushButton = QPushButton("Confirm")
+        self.finished_button.clicked.connect(self.on_confirm)
+        layout.addRow(self.finished_button)
+
+        self.setLayout(layout)
+
+    def on_confirm(self):
+        config: Config = get_config()
+        note_type_field = config["note_type_field"]
+
+        for name, select in self.note_selects.items():
+            note_type_field[name] = select.currentIndex()
+        save_config(config)
+        self.close()
+
+
+class DiagnosticsView(QWidget):
+    def __init__(self, tracer: Tracer):
+        super().__init__()
+        self.tracer = tracer
+        layout: QVBoxLayout = QVBoxLayout()
+
+        self.table: QTableWidget = QTableWidget()
+        self.table.setColumnCount(3 + len(PERCENTILES))
+        self.table.setHorizontalHeaderLabels(
+            ["Phase", "Runs", "Last (ms)"] + [f"p{pct} (ms)" for pct in PERCENTILES]
+        )
+        self.table.verticalHeader().hide()
+        layout.addWidget(self.table)
+
+        self.profile_checkbox: QCheckBox = QCheckBox("Profile the next run")
+        self.profile_checkbox.setChecked(tracer.profile_next)
+        self.profile_checkbox.toggled.connect(self.profile_on_toggle)
+        layout.addWidget(self.profile_checkbox)
+
+        self.info_label: QLabel = QLabel()
+        self.info_label.setWordWrap(True)
+        self.info_label.setTextInteractionFlags(
+            Qt.TextInteractionFlag.TextSelectableByMouse)
+        layout.addWidget(self.info_label)
+
+        refresh_button: QPushButton = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh)
+        layout.addWidget(refresh_button)
+
+        self.setLayout(layout)
+        self.setWindowTitle("Anki Storytime Diagnostics")
+        self.resize(700, 450)
+        self.refresh()
+
+    def refresh(self) -> None:
+        stats: Dict[str, PhaseStats] = self.tracer.stats()
+        self.table.setRowCount(len(stats))
+        for row, (name, phase) in enumerate(stats.items()):
+            values: List[str] = [name, str(phase["count"]), f"{phase['last'] * 1000:.1f}"]
+            values += [f"{phase['percentiles'][pct] * 1000:.1f}" for pct in PERCENTILES]
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(value))
+        self.table.resizeColumnsToContents()
+        # Profiling is switched back off once a run has been profiled.
+        self.profile_checkbox.setChecked(self.tracer.profile_next)
+
+        info: str = f"Timings are logged to {self.tracer.log_path}"
+        if "tokens_saved" in self.tracer.last_counters:
+            info += (
+                "\nVocab normalization saved about "
+                f"{self.tracer.last_counters['tokens_saved']} prompt tokens last run"
+            )
+        if self.tracer.last_counters.get("vocab_dropped"):
+            info += (
+                f"\n{self.tracer.last_counters['vocab_dropped']} lower priority words "
+                "were left out of the last run to stay within the word and token budget"
+            )
+        if self.tracer.last_counters.get("recent_vocab_skipped"):
+            info += (
+                f"\n{self.tracer.last_counters['recent_vocab_skipped']} words used by recent"
+                " stories were left out of the last run"
+            )
+        if latency_histogram.hedged:
+            info += (
+                f"\n{latency_histogram.hedged} of {latency_histogram.requests} requests this"
+                " session were slow enough to be sent again"
+            )
+        if self.tracer.last_profile:
+            info += f"\nLast profile: {self.tracer.last_profile}"
+        self.info_label.setText(info)
+
+    def profile_on_toggle(self, checked: bool) -> None:
+        self.tracer.profile_next = checked
+
+
+class UsageView(QWidget):
+    """Token usage, latency and estimated cost of the requests made, totalled by day,
+    deck, model or preset."""
+
+    GROUPS: List[Tuple[str, str]] = [
+        ("Day", GROUP_BY_DAY),
+        ("Deck", GROUP_BY_DECK),
+        ("Model", GROUP_BY_MODEL),
+        ("Prompt preset", GROUP_BY_PROMPT),
+        ("Theme preset", GROUP_BY_THEME),
+        ("Query preset", GROUP_BY_QUERY),
+    ]
+    PERIODS: List[Tuple[str, int]] = [
+        ("Last 7 days", 7),
+        ("Last 30 days", 30),
+        ("Last year", 365),
+        ("All time", 0),
+    ]
+
+    def __init__(self, store: MetricsStore):
+        super().__init__()
+        self.store = store
+        layout: QVBoxLayout = QVBoxLayout()
+
+        select_row: QHBoxLayout = QHBoxLayout()
+        self.group_select: QComboBox = QComboBox()
+        for label, group_by in self.GROUPS:
+            self.group_select.addItem(label, userData=group_by)
+        self.group_select.currentIndexChanged.connect(lambda _: self.refresh())
+        select_row.addWidget(self.group_select)
+        self.period_select: QComboBox = QComboBox()
+        for label, days in self.PERIODS:
+            self.period_select.addItem(label, userData=days)
+        self.period_select.setCurrentIndex(1)
+        self.period_select.currentIndexChanged.connect(lambda _: self.refresh())
+        select_row.addWidget(self.period_select)
+        layout.addLayout(select_row)
+
+        self.table: QTableWidget = QTableWidget()
+        self.table.setColumnCount(9)
+        self.table.setHorizontalHeaderLabels([
+            "", "Requests", "Cache hits", "Sent again", "Input tokens", "Cached input",
+            "Output tokens", "Avg latency (s)", "Cost ($)",
+        ])
+        self.table.verticalHeader().hide()
+        layout.addWidget(self.table)
+
+        self.info_label: QLabel = QLabel(
+            "Cached input is the share of input tokens OpenAI billed at the prompt caching"
+            " discount. Cache hits were answered from the add-on's own response cache"
+            " without a request. Sent again counts the duplicates of slow requests whose"
+            " answers weren't used, their tokens and cost are included in the totals."
+            " Costs are estimates from model_prices in the config.")
+        self.info_label.setWordWrap(True)
+        layout.addWidget(self.info_label)
+
+        refresh_button: QPushButton = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh)
+        layout.addWidget(refresh_button)
+
+        self.setLayout(layout)
+        self.setWindowTitle("Anki Storytime Usage")
+        self.resize(900, 450)
+        self.refresh()
+
+    def refresh(self) -> None:
+        summaries: List[UsageSummary] = self.store.summary(
+            self.group_select.currentData(), self.period_select.currentData())
+        self.table.setHorizontalHeaderItem(
+            0, QTableWidgetItem(self.group_select.currentText()))
+        self.table.setRowCount(len(summaries))
+        for row, summary in enumerate(summaries):
+            cached_share: float = (
+                summary["cached_tokens"] / summary["input_tokens"]
+                if summary["input_tokens"] else 0.0)
+            cost: str = f"{summary['cost']:.4f}"
+            if summary["unpriced"]:
+                cost += f" (+{summary['unpriced']} unpriced)"
+            values: List[str] = [
+                summary["group"],
+                str(summary["requests"]),
+                str(summary["cache_hits"]),
+                str(summary["hedges"]),
+                str(summary["input_tokens"]),
+                f"{cached_share:.0%}",
+                str(summary["output_tokens"]),
+                f"{summary['average_latency']:.2f}",
+                cost,
+            ]
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(value))
+        self.table.resizeColumnsToContents()
+
+
+class JobsView(QWidget):
+    """Lists queued, running and recently finished story generations. Running ones can
+    be cancelled, and finished ones opened in the story view."""
+
+    def __init__(self, manager: JobManager):
+        super().__init__()
+        self.manager = manager
+        self.shown_jobs: List[Job] = []
+        layout: QVBoxLayout = QVBoxLayout()
+
+        self.table: QTableWidget = QTableWidget()
+        self.table.setColumnCount(3)
+        self.table.setHorizontalHeaderLabels(["Story", "Status", "Time (s)"])
+        self.table.verticalHeader().hide()
+        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.table.cellDoubleClicked.connect(lambda row, _: self.open_story(row))
+        layout.addWidget(self.table)
+
+        button_row: QHBoxLayout = QHBoxLayout()
+        self.open_button: QPushButton = QPushButton("Open Story")
+        self.open_button.clicked.connect(lambda: self.open_story(self.table.currentRow()))
+        button_row.addWidget(self.open_button)
+        self.cancel_button: QPushButton = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_on_click)
+        button_row.addWidget(self.cancel_button)
+        layout.addLayout(button_row)
+
+        self.setLayout(layout)
+        self.setWindowTitle("Anki Storytime Jobs")
+        self.resize(600, 400)
+        self.refresh()
+
+    def refresh(self) -> None:
+        selected: Union[Job, None] = self.selected_job()
+        # Newest first.
+        self.shown_jobs = list(reversed(self.manager.jobs()))
+        self.table.setRowCount(len(self.shown_jobs))
+        now: float = time.time()
+        for row, job in enumerate(self.shown_jobs):
+            status: str = job.status
+            if job.status == JOB_FAILED:
+                status += f": {job.error}"
+            elapsed: str = ""
+            if job.started is not None:
+                elapsed = f"{(job.finished or now) - job.started:.1f}"
+            for col, value in enumerate([job.title, status, elapsed]):
+                self.table.setItem(row, col, QTableWidgetItem(value))
+            if job is selected:
+                self.table.selectRow(row)
+        self.table.resizeColumnsToContents()
+
+    def selected_job(self) -> Union[Job, None]:
+        row: int = self.table.currentRow()
+        return self.shown_jobs[row] if 0 <= row < len(self.shown_jobs) else None
+
+    def open_story(self, row: int) -> None:
+        if not 0 <= row < len(self.shown_jobs) or self.shown_jobs[row].status != JOB_DONE:
+            return
+        story_view: StoryView = StoryView(
+            self.shown_jobs[row].deck_name,
+            font_size_idx=get_config()["story_font_size_idx"],
+        )
+        setattr(mw, "anki_storytime__story_view", story_view)
+        story_view.show()
+
+    def cancel_on_click(self) -> None:
+        job: Union[Job, None] = self.selected_job()
+        if job is not None:
+            self.manager.cancel(job)
+
+
+class SaveDialog(QDialog):
+    def __init__(self, preset_name: str):
+        super().__init__()
+        # `presets` should be a reference to the presets
+        self.save_button = QPushButton("Save")
+        self.save_button.clicked.connect(self.accept)
+        layout: QFormLayout = QFormLayout()
+        self.name_input: QLineEdit = QLineEdit()
+        self.name_input.setText(preset_name)
+        layout.addRow("Name", self.name_input)
+        layout.addWidget(self.save_button)
+        self.setLayout(layout)
+
+
+class PresetFieldRow(QObject):
+    preset_update: pyqtSignal = pyqtSignal(dict)
+
+    def __init__(self, presets: List[Preset], text_area: bool = False):
+        super().__init__()
+        self.value_field_dirty: bool = False
+        self.presets_modified: bool = False
+        self.presets = presets
+        self.text_area = text_area
+
+        self.row = QHBoxLayout()
+
+        self.save_button = QPushButton("Save")
+        self.reset_button = QPushButton("Reset")
+
+        self.preset_select = QComboBox()
+        self.preset_select.currentIndexChanged.connect(self.select_on_change)
+        self.value_field: Union[QPlainTextEdit, QLineEdit]
+
+        self.get_value: Callable[[], str]
+
+        if text_area:
+            self.get_value = lambda: cast(
+                QPlainTextEdit, self.value_field
+            ).toPlainText()
+            self.value_field = QPlainTextEdit()
+        else:
+            self.get_value = lambda: cast(QLineEdit, self.value_field).text()
+            self.value_field = QLineEdit()
+
+        self.row.addWidget(self.preset_select)
+        self.row.addWidget(self.value_field)
+        self.row.addWidget(self.save_button)
+        self.row.addWidget(self.reset_button)
+
+        # Hide them until we need to show them when edits happen.
+        self.save_button.hide()
+        self.reset_button.hide()
+
+        self.value_field.textChanged.connect(
+            lambda: self.value_field_on_change())
+
+        self.set_value_field: Callable = (
+            QPlainTextEdit.setPlainText if text_area else QLineEdit.setText
+        )
+
+        self.save_button.clicked.connect(self.on_save_click)
+        self.reset_button.clicked.connect(
+            lambda _: self.set_value_field(
+                self.value_field, self.preset_select.currentData()
+            )
+        )
+
+        for preset in presets:
+            self.preset_select.addItem(
+                preset["name"], userData=preset["value"])
+
+    def select_on_change(self, idx: int) -> None:
+        new_value: str = self.preset_select.itemData(idx)
+        self.set_value_field(self.value_field, new_value)
+
+    def value_field_on_change(self) -> None:
+        new_text: str = self.get_value()
+        if new_text == self.preset_select.currentData() and self.value_field_dirty:
+            # Unchanged preset has been set.
+            self.save_button.hide()
+            self.reset_button.hide()
+            self.value_field_dirty = False
+        elif (
+            new_text != self.preset_select.currentData() and not self.value_field_dirty
+        ):
+            # We have a change that resulted in data not matching the preset and we aren't
+            # already labeled dirty.
+            self.value_field_dirty = True
+            self.save_button.show()
+            self.reset_button.show()
+
+    def on_save_click(self):
+        save_dialog = SaveDialog(self.preset_select.currentText())
+        if save_dialog.exec():
+            # The dialog was confirmed.
+            name: str = save_dialog.name_input.text()
+            value: str = self.get_value()
+            curr_idx: int = self.preset_select.currentIndex()
+            if name == self.preset_select.currentText():
+                self.preset_select.setItemData(curr_idx, value)
+            else:
+                self.preset_select.addItem(name, value)
+                idx: int = self.preset_select.findText(name)
+                self.preset_select.setCurrentIndex(idx)
+            # Manually trigger this, since it does not retrigger after we add in the new
+            # option.
+            self.value_field_on_change()
+            self.preset_update.emit(Preset(name=name, value=value))
+
+
+def save_config(config: Config):
+    # Written shortly after, along with any other changes made in the meantime.
+    get_config_service().save(cast(Dict, config))
+
+
+def write_config(config: Dict) -> None:
+    # Same as addonManager.writeConfig, but without the chance of leaving a truncated
+    # meta.json behind.
+    addon: str = mw.addonManager.addonFromModule(__name__)
+    meta: Dict = mw.addonManager.addonMeta(addon)
+    meta["config"] = config
+    write_json_atomic(
+        os.path.join(mw.addonManager.addonsFolder(addon), "meta.json"), meta)
+
+
+def get_config_service() -> ConfigService:
+    service: Union[ConfigService, None] = getattr(
+        mw, "anki_storytime__config_service", None)
+    if service is None:
+        service = ConfigService(
+            load=lambda: mw.addonManager.getConfig(__name__) or {},
+            write=write_config,
+            schedule=lambda delay, fn: mw.progress.single_shot(
+                int(delay * 1000), fn, False),
+        )
+        setattr(mw, "anki_storytime__config_service", service)
+    return service
+
+
+class PresetRows(TypedDict):
+    prompt: PresetFieldRow
+    vocab_query: PresetFieldRow
+    theme: PresetFieldRow
+    lang: PresetFieldRow
+
+
+class Variant(TypedDict):
+    # What sets it apart from the other variants, shown in the story view.
+    label: str
+    theme: str
+    prompt: str
+    model: str
+
+
+class VariantsForm(QDialog):
+    """Picks the themes, prompts and models to write a story with for comparison, one
+    story for each combination of them."""
+
+    def __init__(self, theme: str, prompt: str, config: Config):
+        super().__init__()
+        self.setWindowTitle("Compare Variants")
+        self.theme_list: QListWidget = self.create_list(
+            [(preset["name"], preset["value"]) for preset in config["theme_presets"]], theme)
+        self.prompt_list: QListWidget = self.create_list(
+            [(preset["name"], preset["value"]) for preset in config["prompt_presets"]],
+            prompt)
+        # The models there are prices for are the ones likely to be available.
+        model: str = primary_model(config)
+        self.model_list: QListWidget = self.create_list(
+            [(name, name) for name in dict.fromkeys([model, *config["model_prices"]])],
+            model)
+
+        layout: QFormLayout = QFormLayout()
+        layout.addRow(QLabel("Themes"), self.theme_list)
+        layout.addRow(QLabel("Prompts"), self.prompt_list)
+        layout.addRow(QLabel("Models"), self.model_list)
+        self.run_button: QPushButton = QPushButton()
+        self.run_button.clicked.connect(self.accept)
+        layout.addRow(self.run_button)
+        self.setLayout(layout)
+        self.update_run_button()
+        self.resize(600, 500)
+
+    def create_list(self, items: List[Tuple[str, str]], current: str) -> QListWidget:
+        if current not in (value for _, value in items):
+            # Edited in the prompt dialog without saving it as a preset.
+            items = [("Custom", current), *items]
+        list_widget: QListWidget = QListWidget()
+        for name, value in items:
+            item: QListWidgetItem = QListWidgetItem(name)
+            item.setData(Qt.ItemDataRole.UserRole, value)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(
+                Qt.CheckState.Checked if value == current else Qt.CheckState.Unchecked)
+            list_widget.addItem(item)
+        list_widget.itemChanged.connect(lambda _: self.update_run_button())
+        return list_widget
+
+    def checked(self, list_widget: QListWidget) -> List[Tuple[str, str]]:
+        items: List[Tuple[str, str]] = []
+        for row in range(list_widget.count()):
+            item: Union[QListWidgetItem, None] = list_widget.item(row)
+            if item is not None and item.checkState() == Qt.CheckState.Checked:
+                items.append((item.text(), item.data(Qt.ItemDataRole.UserRole)))
+        return items
+
+    def variants(self) -> List[Variant]:
+        themes = self.checked(self.theme_list)
+        prompts = self.checked(self.prompt_list)
+        models = self.checked(self.model_list)
+        variants: List[Variant] = []
+        for (theme_name, theme), (prompt_name, prompt), (model, _) in itertools.product(
+                themes, prompts, models):
+            # Only what differs between them is worth showing.
+            label: str = " / ".join(
+                name for name, options in
+                ((theme_name, themes), (prompt_name, prompts), (model, models))
+                if len(options) > 1
+            )
+            variants.append(Variant(
+                label=label or model, theme=theme, prompt=prompt, model=model))
+        return variants
+
+    def update_run_button(self) -> None:
+        count: int = len(self.variants())
+        self.run_button.setText(f"Generate {count} Stories")
+        # One is just a normal run.
+        self.run_button.setDisabled(count < 2)
+
+
+class PromptForm(QDialog):
+    def __init__(
+        self,
+        prompts: List[Preset],
+        vocab_queries: List[Preset],
+        themes: List[Preset],
+        langs: List[Preset],
+        deck_name: str,
+        config: Config,
+    ):
+        super(PromptForm, self).__init__()
+        self.config: Config = config
+        self.setWindowTitle("AI Prompt Configuration")
+
+        self.preset_rows: PresetRows = {
+            "prompt": PresetFieldRow(prompts, text_area=True),
+            "vocab_query": PresetFieldRow(vocab_queries),
+            "theme": PresetFieldRow(themes),
+            "lang": PresetFieldRow(langs)
+        }
+
+        self.preset_rows["theme"].preset_update.connect(
+            lambda preset: self.on_preset_update("theme_presets", preset)
+        )
+
+        self.preset_rows["vocab_query"].preset_update.connect(
+            lambda preset: self.on_preset_update("vocab_query_presets", preset)
+        )
+
+        self.preset_rows["prompt"].preset_update.connect(
+            lambda preset: self.on_preset_update("prompt_presets", preset)
+        )
+
+        self.preset_rows["lang"].preset_update.connect(
+            lambda preset: self.on_preset_update("lang_presets", preset)
+        )
+
+        self.button = QPushButton("Run")
+        self.copy_button = QPushButton("Copy to Clipboard")
+        self.variants_button = QPushButton("Compare Variants")
+        self.variants_button.setToolTip(
+            "Write the same words with several themes, prompts or models at once"
+        )
+        self.button.clicked.connect(self.prepare_story)
+        self.variants_button.clicked.connect(self.show_variants_form)
+        self.copy_button.clicked.connect(
+            lambda _: self.prepare_story(copy_to_clipboard=True)
+        )
+
+        layout = QFormLayout()
+        run_button_row = QHBoxLayout()
+
+        layout.addRow(QLabel("Theme"), self.preset_rows["theme"].row)
+        layout.addRow(QLabel("Collection Query"),
+                      self.preset_rows["vocab_query"].row)
+        layout.addRow(QLabel("Language"), self.preset_rows["lang"].row)
+        layout.addRow(QLabel("Prompt"), self.preset_rows["prompt"].row)
+
+        self.scope_select: QComboBox = QComboBox()
+        self.scope_select.addItem("This deck", userData=SCOPE_DECK)
+        self.scope_select.addItem("This deck and each subdeck", userData=SCOPE_SUBDECKS)
+        self.scope_select.addItem("Every deck", userData=SCOPE_ALL)
+        self.scope_select.setToolTip(
+            "Generate a separate story for each deck, from the notes of that deck alone"
+        )
+        self.scope_select.currentIndexChanged.connect(self.scope_select_on_change)
+        layout.addRow(QLabel("Decks"), self.scope_select)
+
+        self.recent_select: QComboBox = QComboBox()
+        self.recent_select.addItem("Use them as usual", userData=RECENT_INCLUDE)
+        self.recent_select.addItem("Prefer other words", userData=RECENT_DEPRIORITIZE)
+        self.recent_select.addItem("Leave them out", userData=RECENT_EXCLUDE)
+        self.recent_select.setCurrentIndex(
+            max(self.recent_select.findData(self.config["recent_vocab_handling"]), 0))
+        self.recent_select.setToolTip(
+            f"Words the deck's last {self.config['recent_vocab_stories']} stories were"
+            " written with. Other words are preferred when there are more than fit in a"
+            " story, and if every word was used recently, they are all kept."
+        )
+        self.recent_select.currentIndexChanged.connect(self.recent_select_on_change)
+        layout.addRow(QLabel("Recently used words"), self.recent_select)
+        run_button_row.addWidget(self.button)
+        run_button_row.addWidget(self.copy_button)
+        run_button_row.addWidget(self.variants_button)
+        self.diagnostics_button = QPushButton("Diagnostics")
+        self.diagnostics_button.clicked.connect(show_diagnostics)
+        run_button_row.addWidget(self.diagnostics_button)
+        self.jobs_button = QPushButton("Jobs")
+        self.jobs_button.clicked.connect(show_jobs)
+        run_button_row.addWidget(self.jobs_button)
+        self.usage_button = QPushButton("Usage")
+        self.usage_button.clicked.connect(show_usage)
+        run_button_row.addWidget(self.usage_button)
+        layout.addRow(run_button_row)
+
+        # Shown once a story for this deck has been written in advance with the first
+        # presets, see `pregenerate_story`.
+        self.staged_button = QPushButton("Open Story Written in Advance")
+        self.staged_button.setToolTip(
+            "Written in the background with the first preset of each kind, from the words"
+            " the query finds now"
+        )
+        self.staged_button.clicked.connect(self.open_staged_story)
+        layout.addRow(self.staged_button)
+        staged: Union[StagedStory, None] = get_staged_stories().get(deck_name)
+        self.staged_button.setVisible(staged is not None and staged.story is not None)
+
+        self.bypass_cache_checkbox = QCheckBox("Bypass cache")
+        self.bypass_cache_checkbox.setToolTip(
+            "Always request a new story, even if this exact prompt has been run before"
+        )
+        if self.config["cache_responses"]:
+            layout.addRow(self.bypass_cache_checkbox)
+
+        if not self.config["openai_api_key"] and not self.config["providers"]:
+            # No api key provided, we disable the Run button.
+            self.button.setDisabled(True)
+            self.variants_button.setDisabled(True)
+            self.button.setToolTip(
+                "No OpenAI key provided, cannot automatically query. Please use the Copy to Clipboard option"
+            )
+
+        self.deck_name: str = deck_name
+
+        if get_story_store().count(deck_name) > 0:
+            self.previous_stories_button = QPushButton("Previous Stories")
+            self.previous_stories_button.clicked.connect(
+                self.show_previous_stories)
+            layout.addRow(self.previous_stories_button)
+        self.setLayout(layout)
+        self.resize(1200, 800)
+
+    def show_previous_stories(self):
+        story_view: StoryView = StoryView(self.deck_name,
+                                          font_size_idx=self.config['story_font_size_idx'])
+        setattr(mw, "anki_storytime__previous_story_view", story_view)
+        story_view.show()
+        story_view.raise_()
+        story_view.activateWindow()
+        self.close()
+
+    def open_staged_story(self) -> None:
+        # Runs with the presets it was written with. If the query now finds different
+        # words, a new story is written for them instead.
+        for row in self.preset_rows.values():
+            row.preset_select.setCurrentIndex(0)
+            row.select_on_change(0)
+        self.scope_select.setCurrentIndex(0)
+        self.bypass_cache_checkbox.setChecked(False)
+        self.prepare_story()
+
+    def on_preset_update(self, field: str, new_preset: Preset):
+        curr_custom_presets: List[Preset] = self.config[field]
+        try:
+            existing: Preset = next(
+                filter(
+                    lambda curr_preset: new_preset["name"] == curr_preset["name"],
+                    curr_custom_presets,
+                )
+            )
+            # Update an existing vaue.
+            existing["value"] = new_preset["value"]
+        except StopIteration:
+            # It does not exist.
+            curr_custom_presets.append(new_preset)
+
+        save_config(self.config)
+
+    def prepare_story(self, copy_to_clipboard: bool = False):
+        # Both the following casts are guaranteed safe since the button won't show unless
+        # we both have a collection and a deck is selected.
+        config: Config = get_config()
+        col: Collection = cast(Collection, mw.col)
+        selected_deck_id: DeckId = col.decks.selected()
+        selected_deck = cast(DeckDict, col.decks.get(selected_deck_id))
+        selected_deck_name = selected_deck["name"]
+
+        scope: str = self.scope_select.currentData()
+        if scope != SCOPE_DECK:
+            self.prepare_batch(batch_deck_names(col, selected_deck_id, scope))
+            return
+
+        preset_query: str = self.preset_rows["vocab_query"].get_value()
+        trace: Trace = get_tracer().start()
+
+        def collect_vocab(col: Collection) -> VocabExtraction:
+            return collect_deck_vocab(col, selected_deck_name, preset_query, config, trace)
+
+        op = QueryOp(
+            parent=mw,
+            op=collect_vocab,
+            success=lambda extraction: self.on_vocab_extracted(
+                extraction, selected_deck_name, copy_to_clipboard, trace
+            ),
+        )
+
+        op.with_progress("Collecting vocab...").run_in_background()
+
+    def recent_select_on_change(self) -> None:
+        self.config["recent_vocab_handling"] = self.recent_select.currentData()
+        save_config(self.config)
+
+    def scope_select_on_change(self) -> None:
+        # A batch can't be copied as a single prompt.
+        self.copy_button.setDisabled(self.scope_select.currentData() != SCOPE_DECK)
+
+    def show_variants_form(self) -> None:
+        variants_form: VariantsForm = VariantsForm(
+            self.preset_rows["theme"].get_value(), self.preset_rows["prompt"].get_value(),
+            get_config())
+        if variants_form.exec():
+            self.prepare_variants(variants_form.variants())
+
+    def prepare_variants(self, variants: List[Variant]) -> None:
+        config: Config = get_config()
+        col: Collection = cast(Collection, mw.col)
+        deck_name: str = cast(DeckDict, col.decks.get(col.decks.selected()))["name"]
+        preset_query: str = self.preset_rows["vocab_query"].get_value()
+        trace: Trace = get_tracer().start()
+
+        # The vocab is collected once, every variant is written with the same words.
+        op = QueryOp(
+            parent=mw,
+            op=lambda col: collect_deck_vocab(col, deck_name, preset_query, config, trace),
+            success=lambda extraction: self.on_variants_vocab_extracted(
+                extraction, deck_name, variants, trace),
+        )
+        op.with_progress("Collecting vocab...").run_in_background()
+
+    def on_variants_vocab_extracted(
+        self,
+        extraction: VocabExtraction,
+        deck_name: str,
+        variants: List[Variant],
+        trace: Trace,
+    ) -> None:
+        if extraction["unknown_note_types"]:
+            note_type_form: NoteTypeForm = NoteTypeForm(extraction["unknown_note_types"])
+            setattr(mw, "anki_storytime__note_type_window", note_type_form)
+            note_type_form.show()
+            finish_trace(trace, "unknown_note_types")
+            return
+        vocab: List[str] = extraction["vocab"]
+        if not vocab:
+            finish_trace(trace, "no_vocab")
+            showInfo("No notes found matching your query")
+            return
+
+        config: Config = get_config()
+        lang: str = self.preset_rows["lang"].get_value()
+        use_cache: bool = not self.bypass_cache_checkbox.isChecked()
+        story_view: StoryView = StoryView(
+            deck_name, font_size_idx=config['story_font_size_idx'])
+        setattr(mw, "anki_storytime__story_view", story_view)
+        story_view.show()
+
+        # They run side by side on the job manager, each added to the view once done.
+        manager: JobManager = get_job_manager()
+        tracer: Tracer = get_tracer()
+        for i, variant in enumerate(variants):
+            metadata: StoryMetadata = StoryMetadata(
+                model=variant["model"],
+                prompt=variant["prompt"],
+                theme=variant["theme"],
+                lang=lang,
+                vocab_query=self.preset_rows["vocab_query"].get_value(),
+            )
+            submit_story_job(
+                manager, deck_name, vocab, variant["theme"], variant["prompt"], lang,
+                use_cache, metadata, trace if i == 0 else tracer.start(),
+                story_view=story_view, show_view=False,
+                config=with_model(config, variant["model"]), variant=variant["label"])
+        tooltip(f"Generating {len(variants)} stories in the background")
+        self.close()
+
+    def prepare_batch(self, deck_names: List[str]):
+        config: Config = get_config()
+        preset_query: str = self.preset_rows["vocab_query"].get_value()
+        tracer: Tracer = get_tracer()
+
+        def collect_vocab(col: Collection) -> List[Tuple[str, VocabExtraction, Trace]]:
+            # Each deck only gets the notes directly in it, so no word ends up in both a
+            # deck's story and its parent's.
+            collected: List[Tuple[str, VocabExtraction, Trace]] = []
+            for deck_name in deck_names:
+                trace: Trace = tracer.start()
+                extraction: VocabExtraction = collect_deck_vocab(
+                    col, deck_name, preset_query, config, trace, include_subdecks=False)
+                collected.append((deck_name, extraction, trace))
+            return collected
+
+        op = QueryOp(
+            parent=mw,
+            op=collect_vocab,
+            success=self.on_batch_vocab_extracted,
+        )
+        op.with_progress(
+            f"Collecting vocab for {len(deck_names)} decks...").run_in_background()
+
+    def on_batch_vocab_extracted(
+        self, collected: List[Tuple[str, VocabExtraction, Trace]]
+    ) -> None:
+        unknown_note_types: Dict[str, List[str]] = {}
+        for _, extraction, _ in collected:
+            for name, fields in extraction["unknown_note_types"].items():
+                unknown_note_types.setdefault(name, fields)
+        if unknown_note_types:
+            note_type_form: NoteTypeForm = NoteTypeForm(unknown_note_types)
+            setattr(mw, "anki_storytime__note_type_window", note_type_form)
+            note_type_form.show()
+            for _, _, trace in collected:
+                finish_trace(trace, "unknown_note_types")
+            return
+
+        for _, extraction, trace in collected:
+            if not extraction["vocab"]:
+                finish_trace(trace, "no_vocab")
+        collected = [entry for entry in collected if entry[1]["vocab"]]
+        if not collected:
+            showInfo("No notes found matching your query in any of the decks")
+            return
+
+        config: Config = get_config()
+        theme: str = self.preset_rows["theme"].get_value()
+        prompt: str = self.preset_rows["prompt"].get_value()
+        lang: str = self.preset_rows["lang"].get_value()
+        use_cache: bool = not self.bypass_cache_checkbox.isChecked()
+        metadata: StoryMetadata = StoryMetadata(
+            model=primary_model(config),
+            prompt=prompt,
+            theme=theme,
+            lang=lang,
+            vocab_query=self.preset_rows["vocab_query"].get_value(),
+        )
+
+        manager: JobManager = get_job_manager()
+        for deck_name, extraction, trace in collected:
+            submit_story_job(
+                manager, deck_name, extraction["vocab"], theme, prompt, lang, use_cache,
+                metadata, trace, show_view=False)
+        show_jobs()
+        self.close()
+
+    def on_vocab_extracted(
+        self,
+        extraction: VocabExtraction,
+        deck_name: str,
+        copy_to_clipboard: bool,
+        trace: Union[Trace, None] = None,
+    ):
+        with span(trace, "note_type_check"):
+            if len(extraction["unknown_note_types"]) > 0:
+                note_type_form: NoteTypeForm = NoteTypeForm(
+                    extraction["unknown_note_types"])
+                setattr(mw, "anki_storytime__note_type_window", note_type_form)
+                note_type_form.show()
+        if len(extraction["unknown_note_types"]) > 0:
+            finish_trace(trace, "unknown_note_types")
+            return None
+
+        vocab: List[str] = extraction["vocab"]
+        theme: str = self.preset_rows["theme"].get_value()
+        prompt: str = self.preset_rows["prompt"].get_value()
+        lang: str = self.preset_rows["lang"].get_value()
+        use_cache: bool = not self.bypass_cache_checkbox.isChecked()
+        config: Config = get_config()
+        metadata: StoryMetadata = StoryMetadata(
+            model=primary_model(config),
+            prompt=prompt,
+            theme=theme,
+            lang=lang,
+            vocab_query=self.preset_rows["vocab_query"].get_value(),
+        )
+
+        if copy_to_clipboard or len(vocab) == 0:
+            op = QueryOp(
+                parent=mw,
+                op=lambda _: run_profiled(trace, lambda: prepare_story(
+                    vocab, theme, prompt, lang, copy_to_clipboard, use_cache=use_cache,
+                    trace=trace)),
+                success=lambda response: prepare_story_on_success(
+                    response, deck_name=deck_name, metadata=metadata, trace=trace
+                ),
+            )
+
+            def on_failure(exc: Exception) -> None:
+                finish_trace(trace, "failed" if vocab else "no_vocab")
+                showInfo(f"Failed to generate story: {exc}")
+
+            op.failure(on_failure).with_progress().run_in_background()
+            self.close()
+            return
+
+        key: str = story_job_key(deck_name, config, prompt, theme, lang, vocab)
+        staged: Union[StagedStory, None] = (
+            take_staged_story(deck_name, key) if use_cache else None)
+        if staged is not None and staged.story is not None:
+            prepare_story_on_success(
+                staged.story, deck_name=deck_name, metadata=metadata, trace=trace,
+                vocab=vocab)
+            self.close()
+            return
+
+        manager: JobManager = get_job_manager()
+        if staged is None and manager.find(key):
+            # Most likely a double click, don't pay for the same story twice.
+            finish_trace(trace, "duplicate")
+            tooltip("This story is already being generated")
+            show_jobs()
+            self.close()
+            return
+
+        story_view: Union[StoryView, None] = None
+        on_delta: Union[Callable[[str], None], None] = None
+        if staged is not None:
+            # Being written in advance, submitting it again waits for that job instead.
+            tooltip("This story is almost ready")
+        elif config["stream_responses"]:
+            # Show the story view right away and fill it in as the response streams in.
+            streaming_view: StoryView = StoryView(
+                deck_name, font_size_idx=config['story_font_size_idx'], streaming=True)
+            setattr(mw, "anki_storytime__story_view", streaming_view)
+            streaming_view.show()
+            story_view = streaming_view
+
+            def append_delta(delta: str) -> None:
+                mw.taskman.run_on_main(
+                    lambda: streaming_view.append_streamed_text(delta))
+            on_delta = append_delta
+        else:
+            tooltip("Generating the story in the background")
+
+        submit_story_job(
+            manager, deck_name, vocab, theme, prompt, lang, use_cache, metadata, trace,
+            on_delta, story_view)
+        self.close()
+
+
+def setup(startup_phases: Dict[str, float]) -> None:
+    """Called the first time Storytime is opened, rather than when Anki starts, so the
+    add-on costs next to nothing until it is used. `startup_phases` are the timings of
+    getting here, logged with the rest. Called again after the config check fails, the
+    hooks are only added once."""
+    validate_config()
+    if getattr(mw, "anki_storytime__set_up", False):
+        return
+    # Set first, so hooks added before anything below fails aren't added twice.
+    setattr(mw, "anki_storytime__set_up", True)
+    get_tracer().record_startup(startup_phases)
+    migrate_previous_stories()
+    aqt.gui_hooks.profile_will_close.append(
+        lambda: get_config_service().flush())
+    aqt.gui_hooks.profile_will_close.append(shutdown_job_manager)
+    # Staged stories are kept by deck name, which another profile may also have.
+    aqt.gui_hooks.profile_will_close.append(lambda: get_staged_stories().clear())
+    # Edits from Anki's config editor are written straight to disk, drop our copy.
+    mw.addonManager.setConfigUpdatedAction(
+        __name__, lambda _: get_config_service().reload())
+
+    # Keep the vocab index up to date with reviews and edits made while Anki is open. Any
+    # made before this point are read from the collection when the index is filled.
+    aqt.gui_hooks.reviewer_did_answer_card.append(on_card_answered)
+    anki.hooks.note_will_flush.append(
+        lambda note: get_vocab_index().on_note_flushed(note))
+    anki.hooks.notes_will_be_deleted.append(on_notes_deleted)
+    aqt.gui_hooks.operation_did_execute.append(on_operation_executed)
+    aqt.gui_hooks.state_did_undo.append(lambda _: get_vocab_index().invalidate())
+    aqt.gui_hooks.sync_did_finish.append(lambda: get_vocab_index().invalidate())
+    aqt.gui_hooks.profile_will_close.append(lambda: get_vocab_index().invalidate())
+
+
+def on_card_answered(reviewer, card: Card, ease: int) -> None:
+    get_vocab_index().on_card_answered(card, ease)
+
+
+def on_notes_deleted(col: Collection, note_ids: Sequence[NoteId]) -> None:
+    get_vocab_index().on_notes_deleted(note_ids)
+    get_vocab_cleaner().forget(note_ids)
+
+
+def on_operation_executed(changes: OpChanges, handler: Union[object, None]) -> None:
+    # Answering a card and editing or deleting notes are followed by the hooks above.
+    # Anything else that moves cards, changes decks or note types or rewrites notes in
+    # bulk, such as the browser or an import, can't be followed, so the index starts over.
+    if isinstance(handler, (Reviewer, Editor, AddCards)):
+        return
+    if changes.card or changes.deck or changes.notetype or changes.note_text:
+        get_vocab_index().invalidate()
+
+
+def validate_config() -> None:
+    config: Dict = mw.addonManager.getConfig(__name__) or {}
+    required_fields: Set[str] = set(Config.__required_keys__)
+    missing_fields: Set[str] = required_fields - set(config.keys())
+
+    # Technically, the below will only ever occur due to a programming error since if the user
+    # tries to remove a field from the json config, it gets repopulated with the default value.
+    if missing_fields:
+        missing_fields_str: str = "\n" + "\n".join(missing_fields)
+
+        showInfo(
+            f"Anki Storytime addon is missing required configuration fields, this is likely a programming error. It may not function properly. Please try populating the provided fields or resetting to default values. Missing fields: {missing_fields_str}"
+        )
+        raise Exception("Invalid configuration for Anki Storytime")
+
+
+def get_config() -> Config:
+    return cast(Config, get_config_service().get())
+
+
+def collect_deck_vocab(
+    col: Collection,
+    deck_name: str,
+    preset_query: str,
+    config: Config,
+    trace: Trace,
+    include_subdecks: bool = True,
+) -> VocabExtraction:
+    # Runs in a background operation.
+    return generate.collect_deck_vocab(
+        col,
+        deck_name,
+        preset_query,
+        config,
+        trace,
+        index=get_vocab_index() if config["vocab_index_enabled"] else None,
+        cleaner=get_vocab_cleaner() if config["normalize_vocab"] else None,
+        include_subdecks=include_subdecks,
+        store=get_story_store(),
+    )
+
+
+def prepare_story_on_success(
+    story: Union[str, None],
+    deck_name: Union[str, None] = None,
+    story_view: Union["StoryView", None] = None,
+    metadata: Union[StoryMetadata, None] = None,
+    trace: Union[Trace, None] = None,
+    show_view: bool = True,
+    vocab: Sequence[str] = (),
+    variant: str = "",
+) -> None:
+    if story is None:
+        # The prompt was copied to the clipboard.
+        finish_trace(trace, "clipboard")
+        return
+    col_name: str = cast(Collection, mw.col).path
+    name: str = (
+        deck_name or col_name
+    )  # If no deck name is set, we pulled from all decks so use col_name.
+    config: Config = get_config()
+    story_id: int = save_story(story, name, metadata, trace, vocab)
+
+    with span(trace, "story_view"):
+        if story_view is not None and variant:
+            if not sip.isdeleted(story_view):
+                story_view.add_variant(story, story_id, variant)
+        elif story_view is not None:
+            # The story was streamed into an already open view.
+            story_view.finish_stream(story, story_id)
+        elif show_view:
+            story_view = StoryView(
+                name, font_size_idx=config['story_font_size_idx'])
+            setattr(mw, "anki_storytime__story_view", story_view)
+            story_view.show()
+
+    if trace is not None:
+        get_tracer().finish(trace)
+
+
+def save_story(
+    story: str,
+    deck_name: str,
+    metadata: Union[StoryMetadata, None] = None,
+    trace: Union[Trace, None] = None,
+    vocab: Sequence[str] = (),
+) -> int:
+    with span(trace, "save_story"):
+        store: StoryStore = get_story_store()
+        story_id: int = store.add_story(deck_name, story, metadata, vocab=vocab)
+        store.trim(deck_name, get_config()["max_stories_per_collection"])
+    return story_id
+
+
+def story_job_key(
+    deck_name: str, config: Config, prompt: str, theme: str, lang: str, vocab: List[str]
+) -> str:
+    return cache_key(primary_model(config), "\n".join([deck_name, prompt, theme, lang, *vocab]))
+
+
+def submit_story_job(
+    manager: JobManager,
+    deck_name: str,
+    vocab: List[str],
+    theme: str,
+    prompt: str,
+    lang: str,
+    use_cache: bool,
+    metadata: StoryMetadata,
+    trace: Trace,
+    on_delta: Union[Callable[[str], None], None] = None,
+    story_view: Union["StoryView", None] = None,
+    show_view: bool = True,
+    config: Union[Config, None] = None,
+    variant: str = "",
+) -> Job:
+    """Queues the story on the job manager. Once it is ready it is saved to the deck's
+    history and, with `show_view`, opened. A `variant` is instead added to `story_view`
+    alongside the others, with `config` set up for its model."""
+    config = config or get_config()
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = metrics_recorder(
+        deck_name, metadata)
+
+    def generate(cancel: CancelToken) -> Union[str, None]:
+        return run_profiled(trace, lambda: prepare_story(
+            vocab, theme, prompt, lang, on_delta=on_delta, use_cache=use_cache,
+            trace=trace, cancel=cancel, on_metrics=on_metrics, config=config))
+
+    def on_done(job: Job) -> None:
+        mw.taskman.run_on_main(lambda: on_story_job_done(
+            job, metadata, trace, story_view, show_view, vocab, variant))
+
+    return manager.submit(
+        story_job_key(deck_name, config, prompt, theme, lang, vocab),
+        f"{deck_name} ({variant or theme})" if variant or theme else deck_name,
+        deck_name,
+        generate,
+        on_done,
+    )
+
+
+def submit_supplement_job(
+    story_id: int, missing: List[str], story_view: Union["StoryView", None] = None
+) -> Union[Job, None]:
+    """Queues a request for a continuation of the story using the `missing` words, which
+    is added to the end of the saved story once it is ready."""
+    record: Union[StoryRecord, None] = get_story_store().record(story_id)
+    if record is None:
+        return None
+    config: Config = get_config()
+    metadata: StoryMetadata = StoryMetadata(
+        model=primary_model(config),
+        prompt=config["supplement_prompt"],
+        theme=record["theme"],
+        lang=record["lang"],
+        vocab_query=record["vocab_query"],
+    )
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = metrics_recorder(
+        record["deck"], metadata)
+    trace: Trace = get_tracer().start("supplement")
+
+    def generate(cancel: CancelToken) -> str:
+        return run_profiled(trace, lambda: generate_supplement(
+            record["story"], missing, record["theme"], record["lang"], config,
+            get_http_client(config),
+            get_response_cache(config) if config["cache_responses"] else None,
+            trace, cancel, on_metrics))
+
+    def on_done(job: Job) -> None:
+        mw.taskman.run_on_main(
+            lambda: on_supplement_job_done(job, story_id, trace, story_view))
+
+    return get_job_manager().submit(
+        cache_key(primary_model(config), "\n".join([str(story_id), *missing])),
+        f"{record['deck']} (missing words)",
+        record["deck"],
+        generate,
+        on_done,
+    )
+
+
+def on_supplement_job_done(
+    job: Job, story_id: int, trace: Trace, story_view: Union["StoryView", None] = None
+) -> None:
+    view_open: bool = story_view is not None and not sip.isdeleted(story_view)
+    if job.status == JOB_DONE:
+        with span(trace, "save_story"):
+            get_story_store().append_to_story(story_id, PART_SEPARATOR + job.result)
+        get_tracer().finish(trace)
+        if story_view is not None and view_open:
+            story_view.reload_story(story_id)
+        return
+    finish_trace(trace, job_outcome(job))
+    if story_view is not None and view_open:
+        story_view.supplement_button.setDisabled(False)
+    if job.status == JOB_CANCELLED:
+        tooltip(f"Cancelled the missing words for {job.deck_name}")
+    elif job.status == JOB_FAILED:
+        showInfo(f"Failed to add the missing words: {job.error}")
+
+
+class StagedStory:
+    """A story being written, or already written, in advance for a deck, not yet saved to
+    its history. `key` is its `story_job_key`, so it is only used for the same words and
+    presets."""
+
+    def __init__(
+        self, deck_name: str, key: str, vocab: List[str], metadata: StoryMetadata
+    ):
+        self.deck_name = deck_name
+        self.key = key
+        self.vocab = vocab
+        self.metadata = metadata
+        self.job: Union[Job, None] = None
+        self.story: Union[str, None] = None
+        # Taken by the prompt dialog while still being written, which then waits for it.
+        self.taken: bool = False
+
+
+def get_staged_stories() -> Dict[str, StagedStory]:
+    staged: Union[Dict[str, StagedStory], None] = getattr(
+        mw, "anki_storytime__staged_stories", None)
+    if staged is None:
+        staged = {}
+        setattr(mw, "anki_storytime__staged_stories", staged)
+    return staged
+
+
+def default_presets(config: Config) -> Tuple[str, str, str, str]:
+    """The query, theme, prompt and language the prompt dialog starts with."""
+    return cast(Tuple[str, str, str, str], tuple(
+        config[field][0]["value"] if config[field] else ""
+        for field in ("vocab_query_presets", "theme_presets", "prompt_presets", "lang_presets")
+    ))
+
+
+def pregenerate_story() -> None:
+    """With `pregenerate_stories` on, writes the selected deck's story with the first
+    presets in the background, so the prompt dialog can open it without waiting. Called
+    when a review session ends and when the deck overview is shown."""
+    config: Config = get_config()
+    if not config["pregenerate_stories"] or mw.col is None:
+        return
+    if not config["openai_api_key"] and not config["providers"]:
+        return
+    col: Collection = mw.col
+    deck_name: str = cast(DeckDict, col.decks.get(col.decks.selected()))["name"]
+    query: str = default_presets(config)[0]
+    trace: Trace = get_tracer().start("pregenerate")
+
+    op = QueryOp(
+        parent=mw,
+        op=lambda col: collect_deck_vocab(col, deck_name, query, config, trace),
+        success=lambda extraction: stage_story(deck_name, extraction, trace),
+    )
+    # Nothing was asked for, so nothing to report if it fails.
+    op.failure(lambda _: finish_trace(trace, "failed")).run_in_background()
+
+
+def stage_story(deck_name: str, extraction: VocabExtraction, trace: Trace) -> None:
+    staged_stories: Dict[str, StagedStory] = get_staged_stories()
+    vocab: List[str] = extraction["vocab"]
+    if extraction["unknown_note_types"] or not vocab:
+        discard_staged_story(deck_name)
+        finish_trace(
+            trace, "unknown_note_types" if extraction["unknown_note_types"] else "no_vocab")
+        return
+
+    config: Config = get_config()
+    query, theme, prompt, lang = default_presets(config)
+    key: str = story_job_key(deck_name, config, prompt, theme, lang, vocab)
+    current: Union[StagedStory, None] = staged_stories.get(deck_name)
+    if current is not None and current.key == key:
+        finish_trace(trace, "duplicate")
+        return
+    # The words have changed, such as after reviewing more cards, so the story written
+    # for the old ones would never be used.
+    discard_staged_story(deck_name)
+    manager: JobManager = get_job_manager()
+    if manager.find(key) is not None:
+        # Already asked for from the prompt dialog.
+        finish_trace(trace, "duplicate")
+        return
+
+    metadata: StoryMetadata = StoryMetadata(
+        model=primary_model(config), prompt=prompt, theme=theme, lang=lang,
+        vocab_query=query)
+    staged: StagedStory = StagedStory(deck_name, key, vocab, metadata)
+    staged_stories[deck_name] = staged
+    on_metrics: Union[Callable[[RequestMetrics], None], None] = metrics_recorder(
+        deck_name, metadata)
+
+    def generate(cancel: CancelToken) -> Union[str, None]:
+        return run_profiled(trace, lambda: prepare_story(
+            vocab, theme, prompt, lang, trace=trace, cancel=cancel, on_metrics=on_metrics))
+
+    staged.job = manager.submit(
+        key,
+        f"{deck_name} (in advance)",
+        deck_name,
+        generate,
+        lambda job: mw.taskman.run_on_main(
+            lambda: on_staged_story_done(staged, job, trace)),
+    )
+
+
+def on_staged_story_done(staged: StagedStory, job: Job, trace: Trace) -> None:
+    if staged.taken:
+        # The prompt dialog waited on the same job and handles the result, its own trace
+        # covers the rest.
+        finish_trace(trace, "taken")
+        return
+    staged_stories: Dict[str, StagedStory] = get_staged_stories()
+    if job.status != JOB_DONE or job.result is None:
+        finish_trace(trace, job_outcome(job))
+        if staged_stories.get(staged.deck_name) is staged:
+            del staged_stories[staged.deck_name]
+        return
+    get_tracer().finish(trace)
+    if staged_stories.get(staged.deck_name) is not staged:
+        # Replaced after the words changed.
+        return
+    staged.story = job.result
+    prompt_window: Union[PromptForm, None] = getattr(
+        mw, "anki_storytime__prompt_window", None)
+    if (prompt_window is not None and not sip.isdeleted(prompt_window)
+            and prompt_window.deck_name == staged.deck_name):
+        prompt_window.staged_button.show()
+
+
+def take_staged_story(deck_name: str, key: str) -> Union[StagedStory, None]:
+    """Removes and returns the deck's staged story if it was written for `key`."""
+    staged_stories: Dict[str, StagedStory] = get_staged_stories()
+    staged: Union[StagedStory, None] = staged_stories.get(deck_name)
+    if staged is None or staged.key != key:
+        return None
+    del staged_stories[deck_name]
+    staged.taken = True
+    return staged
+
+
+def discard_staged_story(deck_name: str) -> None:
+    staged: Union[StagedStory, None] = get_staged_stories().pop(deck_name, None)
+    if staged is not None and staged.job is not None:
+        get_job_manager().cancel(staged.job)
+
+
+def metrics_recorder(
+    deck_name: str, metadata: StoryMetadata
+) -> Union[Callable[[RequestMetrics], None], None]:
+    """Returns a function recording a request made for this story in the metrics store,
+    or None if `record_usage` is off."""
+    config: Config = get_config()
+    if not config["record_usage"]:
+        return None
+    store: MetricsStore = get_metrics_store()
+    labels: RequestLabels = request_labels(deck_name, metadata, config)
+    prices = config["model_prices"]
+    return lambda metrics: store.record(metrics, labels, prices)
+
+
+def on_story_job_done(
+    job: Job,
+    metadata: StoryMetadata,
+    trace: Trace,
+    story_view: Union["StoryView", None] = None,
+    show_view: bool = True,
+    vocab: Sequence[str] = (),
+    variant: str = "",
+) -> None:
+    if job.status == JOB_DONE:
+        prepare_story_on_success(
+            job.result, deck_name=job.deck_name, story_view=story_view, metadata=metadata,
+            trace=trace, show_view=show_view, vocab=vocab, variant=variant)
+        return
+    finish_trace(trace, job_outcome(job))
+    if variant:
+        # The view stays open for the other variants.
+        if job.status == JOB_FAILED:
+            tooltip(f"Failed to generate {variant}: {job.error}")
+        return
+    if story_view is not None:
+        story_view.close()
+    if job.status == JOB_CANCELLED:
+        tooltip(f"Cancelled the story for {job.deck_name}")
+    elif job.status == JOB_FAILED and show_view:
+        # Failures of batches are listed in the jobs view instead.
+        showInfo(f"Failed to generate story: {job.error}")
+
+
+def finish_trace(trace: Union[Trace, None], outcome: str) -> None:
+    """Logs the timings of a run that ended without a new story as well, with `outcome`
+    counted so it can be told apart, so slow runs that time out still count."""
+    if trace is None:
+        return
+    trace.count(outcome, 1)
+    get_tracer().finish(trace)
+
+
+def job_outcome(job: Job) -> str:
+    return "cancelled" if job.status == JOB_CANCELLED else "failed"
+
+
+def prepare_story(
+        vocab: List[str],
+        theme: str,
+        prompt: str,
+        lang: str,
+        copy_to_clipboard: bool = False,
+        on_delta: Union[Callable[[str], None], None] = None,
+        use_cache: bool = True,
+        trace: Union[Trace, None] = None,
+        cancel: Union[CancelToken, None] = None,
+        on_metrics: Union[Callable[[RequestMetrics], None], None] = None,
+        config: Union[Config, None] = None,
+) -> Union[str, None]:
+    config = config or get_config()
+    if len(vocab) > 0 and copy_to_clipboard:
+        filled_prompt: str = prompt.format(vocab="\n".join(vocab), theme=theme, lang=lang)
+        app: QApplication = mw.app
+        clipboard = app.clipboard()
+        if clipboard is None:
+            raise Exception("Failed to copy to clipboard")
+        clipboard.setText(filled_prompt)
+        return None
+    return generate_story(
+        vocab,
+        theme,
+        prompt,
+        lang,
+        config,
+        get_http_client(config),
+        get_response_cache(config) if config["cache_responses"] else None,
+        on_delta,
+        use_cache,
+        trace,
+        cancel,
+        on_metrics,
+    )
+
+
+def get_story_store() -> StoryStore:
+    store: Union[StoryStore, None] = getattr(mw, "anki_storytime__story_store", None)
+    if store is None:
+        os.makedirs(USER_FILES_DIR, exist_ok=True)
+        store = StoryStore(os.path.join(USER_FILES_DIR, "stories.db"))
+        setattr(mw, "anki_storytime__story_store", store)
+    return store
+
+
+def migrate_previous_stories() -> None:
+    # Run from `setup`, on the main thread, as saving the config starts a timer.
+    config: Config = get_config()
+    if config["previous_stories"]:
+        # Stories used to be kept in the config, move them over once. If they were already
+        # moved, the config just wasn't saved afterwards.
+        get_story_store().migrate_previous_stories(config["previous_stories"])
+        config["previous_stories"] = {}
+        save_config(config)
+
+
+def get_metrics_store() -> MetricsStore:
+    store: Union[MetricsStore, None] = getattr(mw, "anki_storytime__metrics_store", None)
+    if store is None:
+        os.makedirs(USER_FILES_DIR, exist_ok=True)
+        store = MetricsStore(os.path.join(USER_FILES_DIR, "metrics.db"))
+        setattr(mw, "anki_storytime__metrics_store", store)
+    return store
+
+
+def get_http_client(config: Config) -> HttpClient:
+    client: Union[HttpClient, None] = getattr(mw, "anki_storytime__http_client", None)
+    settings = (
+        config["http_connect_timeout"],
+        config["http_read_timeout"],
+        config["http_max_retries"],
+    )
+    if client is None or client.settings() != settings:
+        if client is not None:
+            client.close()
+        client = HttpClient(*settings)
+        setattr(mw, "anki_storytime__http_client", client)
+    return client
+
+
+def get_tracer() -> Tracer:
+    tracer: Union[Tracer, None] = getattr(mw, "anki_storytime__tracer", None)
+    if tracer is None:
+        tracer = Tracer(
+            os.path.join(USER_FILES_DIR, "timings.log"),
+            os.path.join(USER_FILES_DIR, "profiles"),
+        )
+        setattr(mw, "anki_storytime__tracer", tracer)
+    return tracer
+
+
+def get_vocab_index() -> VocabIndex:
+    index: Union[VocabIndex, None] = getattr(mw, "anki_storytime__vocab_index", None)
+    if index is None:
+        index = VocabIndex()
+        setattr(mw, "anki_storytime__vocab_index", index)
+    return index
+
+
+def get_vocab_cleaner() -> VocabCleaner:
+    cleaner: Union[VocabCleaner, None] = getattr(mw, "anki_storytime__vocab_cleaner", None)
+    if cleaner is None:
+        cleaner = VocabCleaner()
+        setattr(mw, "anki_storytime__vocab_cleaner", cleaner)
+    return cleaner
+
+
+def get_job_manager() -> JobManager:
+    manager: Union[JobManager, None] = getattr(mw, "anki_storytime__job_manager", None)
+    if manager is None:
+        manager = JobManager(
+            get_config()["max_concurrent_jobs"],
+            on_change=lambda _: mw.taskman.run_on_main(refresh_jobs_view),
+        )
+        setattr(mw, "anki_storytime__job_manager", manager)
+    return manager
+
+
+def shutdown_job_manager() -> None:
+    manager: Union[JobManager, None] = getattr(mw, "anki_storytime__job_manager", None)
+    if manager is not None:
+        manager.shutdown()
+        # Its threads can't take new jobs, the next profile gets a manager of its own.
+        setattr(mw, "anki_storytime__job_manager", None)
+
+
+def show_jobs():
+    jobs_view: Union[JobsView, None] = getattr(mw, "anki_storytime__jobs_view", None)
+    if jobs_view is None or sip.isdeleted(jobs_view):
+        jobs_view = JobsView(get_job_manager())
+        setattr(mw, "anki_storytime__jobs_view", jobs_view)
+    jobs_view.refresh()
+    jobs_view.show()
+    jobs_view.raise_()
+
+
+def refresh_jobs_view() -> None:
+    jobs_view: Union[JobsView, None] = getattr(mw, "anki_storytime__jobs_view", None)
+    if jobs_view is not None and not sip.isdeleted(jobs_view) and jobs_view.isVisible():
+        jobs_view.refresh()
+
+
+def show_usage():
+    usage_view: UsageView = UsageView(get_metrics_store())
+    setattr(mw, "anki_storytime__usage_view", usage_view)
+    usage_view.show()
+
+
+def show_diagnostics():
+    diagnostics_view: DiagnosticsView = DiagnosticsView(get_tracer())
+    setattr(mw, "anki_storytime__diagnostics_view", diagnostics_view)
+    diagnostics_view.show()
+
+
+def get_response_cache(config: Config) -> ResponseCache:
+    cache: Union[ResponseCache, None] = getattr(
+        mw, "anki_storytime__response_cache", None)
+    max_bytes: int = config["cache_max_size_mb"] * 1024 * 1024
+    max_age: float = config["cache_max_age_days"] * 24 * 60 * 60
+    if cache is None or (cache.max_bytes, cache.max_age) != (max_bytes, max_age):
+        cache = ResponseCache(
+            os.path.join(USER_FILES_DIR, "response_cache"), max_bytes, max_age)
+        setattr(mw, "anki_storytime__response_cache", cache)
+    return cache
+
+
+def create_prompt_dialog():
+    config: Config = get_config()
+    col: Collection = cast(Collection, mw.col)
+    col_name: str = col.path
+    selected_deck_id: DeckId = col.decks.selected()
+    selected_deck = cast(DeckDict, col.decks.get(selected_deck_id))
+    selected_deck_name = selected_deck["name"]
+    name: str = selected_deck_name or col_name
+    prompt_window = PromptForm(
+        config["prompt_presets"], config["vocab_query_presets"], config["theme_presets"], config["lang_presets"], name, config=config
+    )
+    setattr(mw, "anki_storytime__prompt_window", prompt_window)
+    prompt_window.show()
+
@@ -0,0 +1,138 @@
+from typing import Dict, Iterator, List, Sequence, Tuple, TypedDict, Union
+from anki.collection import Collection
+from anki.models import NotetypeId
+from anki.notes import NoteId
+from anki.utils import ids2str, split_fields
+
+from .normalize import VocabCleaner, dedupe, estimate_tokens
+
+# Number of note IDs resolved per query against the notes table.
+NOTE_ID_BATCH_SIZE = 1000
+
+
+class VocabExtraction(TypedDict):
+    vocab: List[str]
+    # The note each term came from.
+    note_ids: List[NoteId]
+    # Note type name -> fields of the first matching note, for note types that do not
+    # have a vocab field configured yet.
+    unknown_note_types: Dict[str, List[str]]
+    # Estimated prompt tokens removed by normalizing and deduplicating the vocab.
+    tokens_saved: int
+
+
+def deck_search(deck_name: str, include_subdecks: bool = True) -> str:
+    """Search for the cards of a deck, with or without those in its subdecks."""
+    search: str = f'deck:"{deck_name}"'
+    if not include_subdecks:
+        search += f' -deck:"{deck_name}::*"'
+    return search
+
+
+def note_type_field_by_id(
+    col: Collection, note_type_field: Dict[str, int]
+) -> Dict[NotetypeId, Union[int, None]]:
+    """Resolves the name-keyed `note_type_field` config once per run, so notes can be
+    matched by their notetype ID without looking up the note type for every note."""
+    return {
+        NotetypeId(entry.id): note_type_field.get(entry.name)
+        for entry in col.models.all_names_and_ids()
+    }
+
+
+# Note ID, notetype ID, modification time and fields, as stored in the notes table.
+NoteRow = Tuple[NoteId, NotetypeId, int, str]
+
+
+def iter_note_rows(col: Collection, note_ids: Sequence[NoteId]) -> Iterator[NoteRow]:
+    for start in range(0, len(note_ids), NOTE_ID_BATCH_SIZE):
+        batch: Sequence[NoteId] = note_ids[start:start + NOTE_ID_BATCH_SIZE]
+        for note_id, note_type_id, mod, fields in col.db.execute(
+            f"select id, mid, mod, flds from notes where id in {ids2str(batch)}"
+        ):
+            yield NoteId(note_id), NotetypeId(note_type_id), mod, fields
+
+
+def extract_vocab(
+    col: Collection,
+    note_ids: Sequence[NoteId],
+    note_type_field: Dict[str, int],
+    cleaner: Union[VocabCleaner, None] = None,
+    dedupe_vocab: bool = False,
+) -> VocabExtraction:
+    """Pulls the configured vocab field out of every given note, normalizing each term
+    with `cleaner` if one is given.
+
+    Works on the raw notes table in batches rather than loading a `Note` per ID, so it
+    is safe to call from a background operation."""
+    rows_by_note: Dict[NoteId, NoteRow] = {
+        row[0]: row for row in iter_note_rows(col, note_ids)
+    }
+    # Keep the order of the search results rather than the order of the rows.
+    return extract_vocab_from_rows(
+        col,
+        [rows_by_note[note_id] for note_id in note_ids if note_id in rows_by_note],
+        note_type_field,
+        cleaner,
+        dedupe_vocab,
+    )
+
+
+def extract_vocab_from_rows(
+    col: Collection,
+    rows: Sequence[NoteRow],
+    note_type_field: Dict[str, int],
+    cleaner: Union[VocabCleaner, None] = None,
+    dedupe_vocab: bool = False,
+) -> VocabExtraction:
+    """Same as `extract_vocab`, for notes that were already read from the notes table."""
+    field_idx_by_id = note_type_field_by_id(col, note_type_field)
+    note_type_names: Dict[NotetypeId, str] = {
+        NotetypeId(entry.id): entry.name for entry in col.models.all_names_and_ids()
+    }
+
+    vocab: List[str] = []
+    vocab_note_ids: List[NoteId] = []
+    raw_vocab: List[str] = []
+    unknown_note_types: Dict[str, List[str]] = {}
+    for note_id, note_type_id, mod, fields in rows:
+        if note_type_id not in field_idx_by_id:
+            # Note type is missing, nothing we can do with this note.
+            continue
+        idx: Union[int, None] = field_idx_by_id[note_type_id]
+        if idx is None:
+            name: str = note_type_names[note_type_id]
+            if name not in unknown_note_types:
+                # We don't know which field has the value we want to use.
+                unknown_note_types[name] = split_fields(fields)
+            continue
+        if unknown_note_types:
+            # The vocab won't be used, only keep looking for unknown note types.
+            continue
+        note_fields: List[str] = split_fields(fields)
+        if idx >= len(note_fields):
+            continue
+        value: str = note_fields[idx]
+        raw_vocab.append(value)
+        if cleaner is not None:
+            value = cleaner.clean(note_id, mod, value)
+            if not value:
+                # Nothing left once the markup is gone, such as a field with only audio.
+                continue
+        vocab.append(value)
+        vocab_note_ids.append(note_id)
+
+    if dedupe_vocab:
+        kept: List[int] = dedupe(vocab)
+        vocab = [vocab[i] for i in kept]
+        vocab_note_ids = [vocab_note_ids[i] for i in kept]
+    tokens_saved: int = 0
+    if cleaner is not None or dedupe_vocab:
+        tokens_saved = (
+            estimate_tokens("\n".join(raw_vocab)) - estimate_tokens("\n".join(vocab)))
+    return VocabExtraction(
+        vocab=vocab,
+        note_ids=vocab_note_ids,
+        unknown_note_types=unknown_note_types,
+        tokens_saved=tokens_saved,
+    )
@@ -0,0 +1,154 @@
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+from threading import Lock
+import re
+import time
+from anki.collection import Collection
+from anki.cards import Card
+from anki.decks import DeckId
+from anki.models import NotetypeId
+from anki.notes import Note, NoteId
+from anki.utils import ids2str, join_fields
+
+from .vocab import NoteRow, deck_search, iter_note_rows
+
+# Queries the index can keep up to date on its own, e.g. `rated:1:1`.
+RATED_QUERY = re.compile(r"^\s*rated:(\d+)(?::([1-4]))?\s*$")
+DAY_SECONDS = 24 * 60 * 60
+
+
+class IndexEntry:
+    """Notes matching `rated:<days>[:<ease>]` in a deck, and its subdecks if they were
+    searched too."""
+
+    def __init__(self, deck_ids: Iterable[DeckId], days: int, ease: Union[int, None]):
+        self.deck_ids = set(deck_ids)
+        self.days = days
+        self.ease = ease
+        # Note ID -> (notetype ID, modification time, fields, time of the newest matching
+        # review in ms).
+        self.notes: Dict[NoteId, Tuple[NotetypeId, int, str, int]] = {}
+
+    def matches_ease(self, ease: int) -> bool:
+        return ease == self.ease if self.ease is not None else ease > 0
+
+
+class VocabIndex:
+    """Keeps the notes matching the `rated:` presets of each deck in memory.
+
+    An entry is filled with a full search the first time it is used, then kept up to
+    date as cards are answered and notes are edited or deleted, so later runs don't
+    search the collection. Anything the hooks can't follow, like undo or a sync, drops
+    every entry."""
+
+    def __init__(self):
+        self.lock: Lock = Lock()
+        self.entries: Dict[Tuple[str, str, bool], IndexEntry] = {}
+
+    @staticmethod
+    def parse_query(query: str) -> Union[Tuple[int, Union[int, None]], None]:
+        match = RATED_QUERY.match(query)
+        if match is None or int(match.group(1)) < 1:
+            return None
+        return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+    def is_tracked(self, query: str) -> bool:
+        return self.parse_query(query) is not None
+
+    def rows(
+        self, col: Collection, deck_name: str, query: str, include_subdecks: bool = True
+    ) -> Union[List[NoteRow], None]:
+        """Returns the notes of the deck matching `query` as notes table rows, ordered
+        by note ID, or None if the query isn't one the index can track."""
+        parsed = self.parse_query(query)
+        if parsed is None:
+            return None
+        key: Tuple[str, str, bool] = (deck_name, query.strip(), include_subdecks)
+        with self.lock:
+            entry: Union[IndexEntry, None] = self.entries.get(key)
+        if entry is None:
+            entry = self.seed(col, deck_name, query, include_subdecks, *parsed)
+            with self.lock:
+                self.entries[key] = entry
+
+        # Reviews older than the window fall off as days go by.
+        cutoff: int = (col.sched.day_cutoff - DAY_SECONDS * entry.days) * 1000
+        with self.lock:
+            for note_id in [
+                note_id for note_id, (_, _, _, reviewed) in entry.notes.items()
+                if reviewed <= cutoff
+            ]:
+                del entry.notes[note_id]
+            return [
+                (note_id, note_type_id, mod, fields)
+                for note_id, (note_type_id, mod, fields, _) in sorted(entry.notes.items())
+            ]
+
+    def seed(
+        self,
+        col: Collection,
+        deck_name: str,
+        query: str,
+        include_subdecks: bool,
+        days: int,
+        ease: Union[int, None],
+    ) -> IndexEntry:
+        deck_id: Union[DeckId, None] = col.decks.id_for_name(deck_name)
+        deck_ids: List[DeckId] = []
+        if deck_id is not None:
+            deck_ids = col.decks.deck_and_child_ids(deck_id) if include_subdecks else [deck_id]
+        entry: IndexEntry = IndexEntry(deck_ids, days, ease)
+        note_ids: Sequence[NoteId] = col.find_notes(
+            f"{deck_search(deck_name, include_subdecks)} {query}")
+        if not note_ids:
+            return entry
+
+        cutoff: int = (col.sched.day_cutoff - DAY_SECONDS * days) * 1000
+        ease_clause: str = f"= {ease}" if ease is not None else "> 0"
+        reviewed: Dict[NoteId, int] = {
+            NoteId(note_id): review_id
+            for note_id, review_id in col.db.all(
+                "select c.nid, max(r.id) from revlog r join cards c on c.id = r.cid"
+                f" where r.id > ? and r.ease {ease_clause} and c.nid in {ids2str(note_ids)}"
+                " group by c.nid",
+                cutoff,
+            )
+        }
+        now: int = int(time.time() * 1000)
+        for note_id, note_type_id, mod, fields in iter_note_rows(col, note_ids):
+            entry.notes[note_id] = (note_type_id, mod, fields, reviewed.get(note_id, now))
+        return entry
+
+    def on_card_answered(self, card: Card, ease: int) -> None:
+        deck_ids = {card.did, card.odid}
+        reviewed: int = int(time.time() * 1000)
+        with self.lock:
+            entries: List[IndexEntry] = [
+                entry for entry in self.entries.values()
+                if entry.matches_ease(ease) and entry.deck_ids & deck_ids
+            ]
+        if not entries:
+            return
+        note: Note = card.note()
+        with self.lock:
+            for entry in entries:
+                entry.notes[note.id] = (
+                    note.mid, note.mod, join_fields(note.fields), reviewed)
+
+    def on_note_flushed(self, note: Note) -> None:
+        with self.lock:
+            for entry in self.entries.values():
+                if note.id in entry.notes:
+                    # `note.mod` is only bumped once the note is written.
+                    reviewed: int = entry.notes[note.id][3]
+                    entry.notes[note.id] = (
+                        note.mid, note.mod, join_fields(note.fields), reviewed)
+
+    def on_notes_deleted(self, note_ids: Sequence[NoteId]) -> None:
+        with self.lock:
+            for entry in self.entries.values():
+                for note_id in note_ids:
+                    entry.notes.pop(note_id, None)
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,21 @@
+"""Imports add-on modules outside of Anki.
+
+The add-on's `__init__` registers hooks against the running Anki instance, so the
+package is set up here without executing it, which lets the benchmarks import the
+modules that only depend on the anki pylib."""
+import importlib
+import os
+import sys
+import types
+from typing import Any
+
+ADDON_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "addon")
+PACKAGE: str = "anki_storytime"
+
+
+def import_addon_module(name: str) -> Any:
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [ADDON_DIR]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
@@ -0,0 +1,201 @@
+"""Runs the vocab -> request -> store -> view pipeline end to end against the fake
+Responses API server and reports how long each stage takes. Vocab and requests go
+through the add-on's own `collect_deck_vocab` and `generate_story`, so the index,
+normalization, ranking, response cache, providers and hedging are all included.
+
+    python bench/bench_pipeline.py --sizes 100 1000 5000 --runs 5 --latency 0.2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Union
+
+from anki.collection import Collection
+
+from addon_loader import ADDON_DIR, import_addon_module
+from fake_openai_server import FakeServerOptions, start_fake_server
+from synthetic import DECK_NAME, create_collection
+
+cache_module = import_addon_module("cache")
+client_module = import_addon_module("client")
+generate = import_addon_module("generate")
+normalize = import_addon_module("normalize")
+providers = import_addon_module("providers")
+store_module = import_addon_module("store")
+timing = import_addon_module("timing")
+vocab_index = import_addon_module("vocab_index")
+
+# The request stage includes filling in the prompt, the cache lookup and any fallback
+# or hedged requests.
+STAGES: List[str] = ["vocab", "first_token", "request", "store", "view"]
+
+
+def default_config() -> Dict:
+    with open(os.path.join(ADDON_DIR, "config.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def make_view() -> Union[Callable[[Any, List[Dict]], None], None]:
+    """Fills the story view's history and text like `StoryView` does, if aqt's Qt is
+    available: the history from the previews, and only the shown story read in full."""
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        story_list = import_addon_module("story_list")
+        from PyQt6.QtWidgets import QApplication, QComboBox, QPlainTextEdit
+    except ImportError:
+        return None
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    def view(store, previews: List[Dict]) -> None:
+        story_model = story_list.StoryListModel(previews)
+        story_select = QComboBox()
+        story_select.setModel(story_model)
+        story_select.view().setUniformItemSizes(True)
+        story_select.setCurrentIndex(story_model.rowCount() - 1)
+        text_view = QPlainTextEdit()
+        text_view.setPlainText(store.story(story_select.currentData()) or "")
+        app.processEvents()
+
+    return view
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered: List[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def bench_config(url: str) -> Dict:
+    """The default config, sending requests to the fake server."""
+    config: Dict = default_config()
+    config.update(openai_api_url=url, openai_api_key="bench", providers=[])
+    return config
+
+
+def run_once(
+    col: Collection,
+    config: Dict,
+    client,
+    cache,
+    store,
+    index,
+    cleaner,
+    view: Union[Callable[[Any, List[Dict]], None], None],
+    stream: bool,
+    use_cache: bool,
+) -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    trace = timing.Trace("bench")
+    start: float = time.perf_counter()
+
+    vocab: List[str] = generate.collect_deck_vocab(
+        col, DECK_NAME, "", config, trace, index=index, cleaner=cleaner, store=store
+    )["vocab"]
+    timings["vocab"] = time.perf_counter() - start
+
+    mark: float = time.perf_counter()
+    first_token: List[float] = []
+
+    def on_delta(_: str) -> None:
+        if not first_token:
+            first_token.append(time.perf_counter() - mark)
+
+    theme: str = config["theme_presets"][0]["value"]
+    prompt: str = config["prompt_presets"][0]["value"]
+    lang: str = config["lang_presets"][0]["value"]
+    story: str = generate.generate_story(
+        vocab, theme, prompt, lang, config, client, cache,
+        on_delta=on_delta if stream else None, use_cache=use_cache, trace=trace)
+    timings["request"] = time.perf_counter() - mark
+    timings["first_token"] = first_token[0] if first_token else timings["request"]
+
+    mark = time.perf_counter()
+    store.add_story(
+        DECK_NAME, story,
+        store_module.StoryMetadata(
+            model=providers.primary_model(config), prompt=prompt, theme=theme, lang=lang),
+        vocab=vocab)
+    store.trim(DECK_NAME, config["max_stories_per_collection"])
+    previews: List[Dict] = store.previews(DECK_NAME)
+    timings["store"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    if view is not None:
+        view(store, previews)
+    timings["view"] = time.perf_counter() - mark
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument(
+        "--use-cache", action="store_true",
+        help="answer repeated runs from the response cache rather than the server")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--word-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_fake_server(FakeServerOptions(
+        latency=args.latency,
+        word_delay=args.word_delay,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        stall_rate=0.0,
+        stall=0.0,
+        seed=0,
+    ))
+    config: Dict = bench_config(server.url)
+    client = client_module.HttpClient(
+        config["http_connect_timeout"], config["http_read_timeout"],
+        config["http_max_retries"], backoff_base=0.05, backoff_max=1)
+    # Responses are still stored without --use-cache, as when regenerating a story.
+    cache = cache_module.ResponseCache(
+        os.path.join(tempfile.mkdtemp(), "response_cache"),
+        config["cache_max_size_mb"] * 1024 * 1024,
+        config["cache_max_age_days"] * 24 * 60 * 60,
+    )
+    view = make_view()
+    if view is None:
+        print("aqt's Qt is not available, the view stage will not be measured.")
+
+    header: str = " ".join(f"{stage + ' p50/p95':>22}" for stage in STAGES)
+    print(f"{'notes':>6} {header} {'stories/s':>10}")
+    for size in args.sizes:
+        col: Collection = create_collection(size)
+        config["note_type_field"] = {entry.name: 1 for entry in col.models.all_names_and_ids()}
+        store = store_module.StoryStore(os.path.join(tempfile.mkdtemp(), "stories.db"))
+        # Kept across runs, as the add-on keeps them for the session.
+        index = vocab_index.VocabIndex() if config["vocab_index_enabled"] else None
+        cleaner = normalize.VocabCleaner() if config["normalize_vocab"] else None
+        runs: List[Dict[str, float]] = [
+            run_once(
+                col, config, client, cache, store, index, cleaner, view, args.stream,
+                args.use_cache)
+            for _ in range(args.runs)
+        ]
+        columns: str = " ".join(
+            f"{percentile([r[stage] for r in runs], 50) * 1000:>10.1f}/"
+            f"{percentile([r[stage] for r in runs], 95) * 1000:>8.1f}ms"
+            for stage in STAGES
+        )
+        throughput: float = len(runs) / sum(r["total"] for r in runs)
+        print(f"{size:>6} {columns} {throughput:>10.2f}")
+        store.close()
+        col.close()
+
+    print(f"{server.request_count} requests over {server.connection_count} connections")
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
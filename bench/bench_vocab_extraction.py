@@ -0,0 +1,69 @@
+"""Compares pulling vocab one `col.get_note()` at a time against the batched
+`extract_vocab` path.
+
+    python bench/bench_vocab_extraction.py [note_count ...]
+"""
+import sys
+import time
+from typing import Callable, Dict, List, Sequence
+
+from anki.collection import Collection
+from anki.notes import NoteId
+
+from addon_loader import import_addon_module
+from synthetic import DECK_NAME, create_collection
+
+vocab = import_addon_module("vocab")
+
+DEFAULT_SIZES: List[int] = [10_000, 25_000, 50_000]
+
+
+def extract_vocab_per_note(
+    col: Collection, note_ids: Sequence[NoteId], note_type_field: Dict[str, int]
+) -> List[str]:
+    # Mirrors how PromptForm.prepare_story used to resolve vocab.
+    notes = list(map(lambda note_id: col.get_note(note_id), note_ids))
+    result: List[str] = []
+    for note in notes:
+        if note.note_type() is None:
+            continue
+        note_type_name = (note.note_type() or {}).get("name")
+        if note_type_name not in note_type_field:
+            return []
+    for note in notes:
+        note_type = note.note_type()
+        if note_type is None:
+            continue
+        result.append(note.fields[note_type_field[note_type["name"]]])
+    return result
+
+
+def timed(fn: Callable[[], List[str]]) -> float:
+    start: float = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main(sizes: List[int]) -> None:
+    print(f"{'notes':>8} {'per-note (s)':>14} {'batched (s)':>12} {'speedup':>8}")
+    for size in sizes:
+        col: Collection = create_collection(size)
+        note_type_field: Dict[str, int] = {
+            entry.name: 1 for entry in col.models.all_names_and_ids()
+        }
+        note_ids: Sequence[NoteId] = col.find_notes(f'deck:"{DECK_NAME}"')
+
+        expected: List[str] = extract_vocab_per_note(col, note_ids, note_type_field)
+        actual: List[str] = vocab.extract_vocab(col, note_ids, note_type_field)["vocab"]
+        assert expected == actual, "Batched extraction does not match per-note extraction"
+
+        per_note: float = timed(
+            lambda: extract_vocab_per_note(col, note_ids, note_type_field))
+        batched: float = timed(
+            lambda: vocab.extract_vocab(col, note_ids, note_type_field)["vocab"])
+        print(f"{size:>8} {per_note:>14.3f} {batched:>12.3f} {per_note / batched:>7.1f}x")
+        col.close()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,275 @@
+"""A stand-in for the OpenAI `/v1/responses` endpoint, and the `/v1/chat/completions`
+endpoint local servers offer, for testing and benchmarking without spending anything.
+
+    python bench/fake_openai_server.py --port 8765 --latency 0.5 --error-rate 0.05
+
+Point the add-on at it by setting `openai_api_url` to
+`http://127.0.0.1:8765/v1/responses` in the add-on config, or add it as a provider with
+the `chat_completions` schema and `http://127.0.0.1:8765/v1/chat/completions`.
+"""
+import argparse
+import http.server
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Tuple, TypedDict
+
+
+class FakeServerOptions(TypedDict):
+    # Seconds before the first byte of the response is sent.
+    latency: float
+    # Seconds between streamed words, also used to delay non-streamed responses by the
+    # time the words would have taken.
+    word_delay: float
+    # Chance of answering with a 500.
+    error_rate: float
+    # Requests allowed per second before answering with a 429, 0 for no limit.
+    rate_limit: float
+    # Chance of a request taking `stall` seconds longer, to test hedged requests.
+    stall_rate: float
+    stall: float
+    seed: int
+
+
+DEFAULT_OPTIONS: FakeServerOptions = FakeServerOptions(
+    latency=0.0, word_delay=0.0, error_rate=0.0, rate_limit=0.0, stall_rate=0.0, stall=0.0,
+    seed=0,
+)
+
+
+def fake_story(prompt: str) -> str:
+    # The add-on's prompts list the vocab after the first empty line.
+    vocab: List[str] = [
+        line.strip() for line in prompt.split("\n\n", 1)[-1].splitlines() if line.strip()
+    ]
+    return " ".join(f"これは「{word}」の文です。" for word in vocab) or "空の物語です。"
+
+
+def response_body(model: str, text: str, prompt: str) -> Dict:
+    input_tokens: int = len(prompt) // 2
+    output_tokens: int = len(text) // 2
+    return {
+        "id": f"resp_fake_{random.getrandbits(32):08x}",
+        "object": "response",
+        "status": "completed",
+        "model": model,
+        "output": [
+            {
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+def chat_body(model: str, text: str, prompt: str) -> Dict:
+    input_tokens: int = len(prompt) // 2
+    output_tokens: int = len(text) // 2
+    return {
+        "id": f"chatcmpl-fake{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": input_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+            "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class FakeOpenAIServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], options: FakeServerOptions):
+        super().__init__(address, FakeOpenAIHandler)
+        self.options = options
+        self.lock = threading.Lock()
+        self.random = random.Random(options["seed"])
+        self.request_times: List[float] = []
+        self.request_count = 0
+        self.connection_count = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[0], self.server_address[1]
+        return f"http://{host!s}:{port}/v1/responses"
+
+    def admit(self) -> Tuple[int, float]:
+        """Decides how to answer the next request, returning the status to use and the
+        `Retry-After` to send with a 429."""
+        with self.lock:
+            self.request_count += 1
+            now: float = time.monotonic()
+            rate_limit: float = self.options["rate_limit"]
+            if rate_limit > 0:
+                self.request_times = [t for t in self.request_times if now - t < 1]
+                if len(self.request_times) >= rate_limit:
+                    return 429, 1 - (now - self.request_times[0])
+                self.request_times.append(now)
+            if self.random.random() < self.options["error_rate"]:
+                return 500, 0
+            return 200, 0
+
+    def stall_time(self) -> float:
+        with self.lock:
+            stalled: bool = self.random.random() < self.options["stall_rate"]
+        return self.options["stall"] if stalled else 0.0
+
+
+class FakeOpenAIHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle hold the body back.
+    disable_nagle_algorithm = True
+    server: FakeOpenAIServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def send_json(self, status: int, body: Dict, headers: Dict[str, str] = {}):
+        data: bytes = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, event: str, body: Dict):
+        body = {"type": event, **body}
+        data: str = json.dumps(body, ensure_ascii=False)
+        self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        length: int = int(self.headers.get("Content-Length", 0))
+        request: Dict = json.loads(self.rfile.read(length) or b"{}")
+        options: FakeServerOptions = self.server.options
+
+        status, retry_after = self.server.admit()
+        time.sleep(options["latency"] + self.server.stall_time())
+        if status == 429:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                {"Retry-After": f"{max(0.0, retry_after):.3f}"},
+            )
+            return
+        if status == 500:
+            self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        chat: bool = self.path.rstrip("/").endswith("/chat/completions")
+        prompt: str = (
+            request.get("messages", [{}])[-1].get("content", "") if chat
+            else request.get("input", ""))
+        model: str = request.get("model", "")
+        text: str = fake_story(prompt)
+        words: List[str] = text.split(" ")
+        body: Dict = chat_body(model, text, prompt) if chat else response_body(model, text, prompt)
+
+        if not request.get("stream"):
+            time.sleep(options["word_delay"] * len(words))
+            self.send_json(200, body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # No content length for a stream, so the connection can't be reused after it.
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if chat:
+            self.stream_chat(body, words, request)
+            return
+        self.send_event("response.created", {"response": {**body, "status": "in_progress", "output": []}})
+        for i, word in enumerate(words):
+            time.sleep(options["word_delay"])
+            self.send_event(
+                "response.output_text.delta",
+                {"output_index": 0, "content_index": 0, "delta": word if i == 0 else " " + word},
+            )
+        self.send_event("response.output_text.done", {"output_index": 0, "content_index": 0, "text": text})
+        self.send_event("response.completed", {"response": body})
+        self.close_connection = True
+
+
+    def stream_chat(self, body: Dict, words: List[str], request: Dict):
+        def send_chunk(chunk: Dict):
+            chunk = {"id": body["id"], "object": "chat.completion.chunk", "model": body["model"], **chunk}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, word in enumerate(words):
+            time.sleep(self.server.options["word_delay"])
+            send_chunk({"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]})
+        send_chunk({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if request.get("stream_options", {}).get("include_usage"):
+            send_chunk({"choices": [], "usage": body["usage"]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_fake_server(
+    options: FakeServerOptions = DEFAULT_OPTIONS, host: str = "127.0.0.1", port: int = 0
+) -> FakeOpenAIServer:
+    """Starts the server on a background thread, `port` 0 picks a free port."""
+    server: FakeOpenAIServer = FakeOpenAIServer((host, port), options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=DEFAULT_OPTIONS["latency"])
+    parser.add_argument("--word-delay", type=float, default=DEFAULT_OPTIONS["word_delay"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_OPTIONS["error_rate"])
+    parser.add_argument("--rate-limit", type=float, default=DEFAULT_OPTIONS["rate_limit"])
+    parser.add_argument("--stall-rate", type=float, default=DEFAULT_OPTIONS["stall_rate"])
+    parser.add_argument("--stall", type=float, default=DEFAULT_OPTIONS["stall"])
+    parser.add_argument("--seed", type=int, default=DEFAULT_OPTIONS["seed"])
+    args = parser.parse_args()
+
+    options: FakeServerOptions = FakeServerOptions(
+        latency=args.latency,
+        word_delay=args.word_delay,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        stall_rate=args.stall_rate,
+        stall=args.stall,
+        seed=args.seed,
+    )
+    server: FakeOpenAIServer = FakeOpenAIServer((args.host, args.port), options)
+    print(f"Serving fake responses at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Builds throwaway collections filled with generated vocab notes."""
+import os
+import random
+import tempfile
+from typing import List
+
+from anki.collection import AddNoteRequest, Collection
+from anki.decks import DeckId
+from anki.models import NotetypeDict
+
+DECK_NAME: str = "Storytime Bench"
+VOCAB_NOTE_TYPE: str = "Storytime Bench Vocab"
+KANA: str = "あいうえおかきくけこさしすせそたちつてとなにぬねのまみむめもやゆよらりるれろわ"
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(KANA) for _ in range(rng.randint(2, 5)))
+
+
+def add_vocab_note_type(col: Collection) -> NotetypeDict:
+    models = col.models
+    note_type: NotetypeDict = models.new(VOCAB_NOTE_TYPE)
+    for field_name in ["Meaning", "Word", "Reading"]:
+        models.add_field(note_type, models.new_field(field_name))
+    template = models.new_template("Card 1")
+    template["qfmt"] = "{{Word}}"
+    template["afmt"] = "{{FrontSide}}<hr id=answer>{{Meaning}}"
+    models.add_template(note_type, template)
+    models.add(note_type)
+    return models.by_name(VOCAB_NOTE_TYPE) or note_type
+
+
+def create_collection(note_count: int, seed: int = 0, directory: str = "") -> Collection:
+    """Creates a collection with `note_count` notes split across the stock Basic note type
+    and a three field vocab note type, all in `DECK_NAME`."""
+    rng: random.Random = random.Random(seed)
+    directory = directory or tempfile.mkdtemp(prefix="storytime_bench_")
+    col: Collection = Collection(os.path.join(directory, "collection.anki2"))
+    deck_id: DeckId = DeckId(col.decks.id(DECK_NAME) or 0)
+    note_types: List[NotetypeDict] = [
+        add_vocab_note_type(col),
+        col.models.by_name("Basic") or col.models.current(),
+    ]
+
+    requests: List[AddNoteRequest] = []
+    for i in range(note_count):
+        note = col.new_note(note_types[i % len(note_types)])
+        word: str = random_word(rng)
+        for idx in range(len(note.fields)):
+            note.fields[idx] = f"{word} {idx}" if idx else word
+        requests.append(AddNoteRequest(note=note, deck_id=deck_id))
+    col.add_notes(requests)
+    return col